@@ -0,0 +1,247 @@
+import http_client
+from datetime import datetime
+from urllib.parse import urljoin
+import threading
+import json
+import os
+from data_store import file_lock
+from scraper import PageScraper, parse_advisory_listing, parse_advisory_article
+
+
+DA_ADVISORIES_URL = "https://www.da.gov.ph/category/advisories/"
+
+
+class AdvisoryCrawler:
+    """
+    Incremental crawler building a local archive of DA advisories.
+
+    Each crawl walks the listing pages newest first and stops at the first
+    advisory already in the archive (the last-seen watermark), so after the
+    initial backfill a crawl costs one listing page plus one request per
+    new advisory. Article bodies are fetched once and stored with their
+    publish date in a JSON archive; a background thread repeats the crawl
+    every interval seconds and hands new advisories to on_new. A crawl
+    that fails part-way is retried after a short backoff instead of a
+    full interval.
+
+    The archive is shared by every worker process on the host: one of
+    them crawls under a file lock, the others just pick up its archive.
+    """
+
+    MAX_ARTICLE_RETRIES = 3
+    RETRY_DELAY = 300  # seconds before retrying a failed crawl, doubling per failure
+
+    def __init__(self, scraper=None, archive_path=None, listing_url=DA_ADVISORIES_URL,
+                 max_pages=30, interval=None, on_new=None, timeout=10):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.archive_path = archive_path or os.path.join(data_dir, 'advisories.json')
+        self.scraper = scraper or PageScraper()
+        self.listing_url = listing_url
+        self.max_pages = max_pages
+        if interval is None:
+            interval = int(os.getenv('AGRIAID_CRAWL_INTERVAL', '21600'))
+        self.interval = interval
+        self.on_new = on_new
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.crawl_lock = threading.Lock()
+        self.items = {}  # link -> {'title', 'link', 'published', 'body', 'source', 'fetched'}
+        self.order = []  # links, newest first
+        self.last_crawl = None
+        self.failures = {}  # link -> failed fetches
+        self.failed_crawls = 0  # consecutive crawls that did not finish
+        self.requests_made = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._load()
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def watermark(self):
+        """Link of the newest archived advisory"""
+        with self.lock:
+            return self.order[0] if self.order else None
+
+    # ==================== ARCHIVE ====================
+
+    def _load(self):
+        """Merge the archive on disk (possibly written by another process); returns the items new to us"""
+        try:
+            with open(self.archive_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"Advisory archive load error: {e}")
+            return []
+
+        with self.lock:
+            new = [item for item in data.get('items', []) if item['link'] not in self.items]
+            links = [item['link'] for item in data.get('items', [])]
+            on_disk = set(links)
+            self.items.update((item['link'], item) for item in new)
+            self.order = links + [link for link in self.order if link not in on_disk]
+            self.last_crawl = data.get('last_crawl') or self.last_crawl
+        return new
+
+    def _save(self):
+        """Write the archive atomically so readers never see a partial file"""
+        try:
+            directory = os.path.dirname(self.archive_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                data = {'last_crawl': self.last_crawl, 'items': [self.items[link] for link in self.order]}
+            tmp_path = f"{self.archive_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.archive_path)
+        except Exception as e:
+            print(f"Advisory archive save error: {e}")
+
+    def latest(self, limit=5):
+        """Newest archived advisories"""
+        with self.lock:
+            return [self.items[link] for link in self.order[:limit]]
+
+    def all_items(self):
+        with self.lock:
+            return [self.items[link] for link in self.order]
+
+    # ==================== CRAWLING ====================
+
+    def _fetch_article(self, link):
+        """Body and publish date of one advisory (parsed off the serving threads, not cached)"""
+        try:
+            response = http_client.get(link, timeout=self.timeout)
+            self.requests_made += 1
+            response.raise_for_status()
+            return self.scraper.parse(parse_advisory_article, response.content)
+        except Exception as e:
+            print(f"DA advisory fetch error ({link}): {e}")
+            return None
+
+    def _new_listings(self):
+        """Walk listing pages until the watermark; returns unseen listings, newest first"""
+        new_items = []
+        url = self.listing_url
+
+        for page in range(1, self.max_pages + 1):
+            listing = self.scraper.scrape(url, parse_advisory_listing)
+            self.requests_made += 1
+
+            reached_watermark = False
+            for item in listing['items']:
+                # Resolve relative links; the parsed listing is shared with the scrape cache
+                item = dict(item, link=urljoin(url, item['link']))
+                with self.lock:
+                    known = item['link'] in self.items
+                if known:
+                    reached_watermark = True
+                    break
+                if all(item['link'] != seen['link'] for seen in new_items):
+                    new_items.append(item)
+
+            if reached_watermark or not listing['items']:
+                break
+            # Fall back to WordPress-style /page/N/ URLs when there is no next link
+            url = urljoin(url, listing['next']) if listing['next'] else urljoin(self.listing_url, f"page/{page + 1}/")
+
+        return new_items
+
+    def _crawled_recently(self):
+        if not self.last_crawl:
+            return False
+        elapsed = datetime.now() - datetime.strptime(self.last_crawl, '%Y-%m-%d %H:%M')
+        return elapsed.total_seconds() < self.interval
+
+    def crawl(self, force=False):
+        """
+        One incremental crawl; returns the newly archived advisories, newest
+        first. Skipped (returning what other processes archived) while
+        another process holds the crawl lock or crawled within the interval.
+        """
+        with self.crawl_lock, file_lock(f"{self.archive_path}.lock", blocking=False) as acquired:
+            # Another worker may have crawled since we last looked
+            added = self._load()
+            if not acquired or (self._crawled_recently() and not force):
+                if added and self.on_new:
+                    self.on_new(added)
+                return added
+
+            complete = True
+            try:
+                listings = self._new_listings()
+            except Exception as e:
+                print(f"DA advisory crawl error: {e}")
+                listings = []
+                complete = False
+
+            # Oldest first, stopping at the first failed fetch so the
+            # watermark stays below it and the next crawl retries it
+            fetched = []
+            for listing in reversed(listings):
+                article = self._fetch_article(listing['link'])
+                if article is None:
+                    self.failures[listing['link']] = self.failures.get(listing['link'], 0) + 1
+                    if self.failures[listing['link']] < self.MAX_ARTICLE_RETRIES:
+                        complete = False
+                        break
+                    # Give up on an article that keeps failing rather than stall the archive
+                    continue
+                self.failures.pop(listing['link'], None)
+                fetched.append({
+                    'title': listing['title'],
+                    'link': listing['link'],
+                    'published': listing['published'] or article['published'],
+                    'body': article['body'],
+                    'source': 'DA Philippines',
+                    'fetched': datetime.now().strftime('%Y-%m-%d %H:%M')
+                })
+            fetched.reverse()
+
+            with self.lock:
+                for item in fetched:
+                    self.items[item['link']] = item
+                self.order = [item['link'] for item in fetched] + self.order
+                # Only a finished crawl counts, so a failed one is not skipped as recent
+                if complete:
+                    self.last_crawl = datetime.now().strftime('%Y-%m-%d %H:%M')
+            self.failed_crawls = 0 if complete else self.failed_crawls + 1
+            self._save()
+            added = fetched + added
+
+        if added and self.on_new:
+            self.on_new(added)
+        return added
+
+    def _run(self):
+        while True:
+            self.crawl()
+            delay = self.interval
+            if self.failed_crawls:
+                delay = min(self.interval, self.RETRY_DELAY * 2 ** (self.failed_crawls - 1))
+            if self._stop.wait(delay):
+                break
+
+    def start(self):
+        """Crawl now and then every interval seconds in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='advisory-crawler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    crawler = AdvisoryCrawler(scraper=PageScraper(parse_workers=0))
+    print(f"Archive: {len(crawler)} advisories, watermark {crawler.watermark}")
+
+    new_items = crawler.crawl(force=True)
+    print(f"Crawl: {len(new_items)} new advisories in {crawler.requests_made} requests")
+    for item in crawler.latest(5):
+        print(f"- [{item['published']}] {item['title']}\n  {item['body'][:100]}")
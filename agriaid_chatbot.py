@@ -1,29 +1,136 @@
 import requests
 import json
+import asyncio
+import concurrent.futures
+import threading
 from datetime import datetime
 from api_services import AgriculturalAPIs
 from philippine_apis import PhilippineAgriculturalAPIs
+from feed_aggregator import FeedAggregator
+from relevance_index import BM25Index, tokenize
+from knowledge_retriever import KnowledgeRetriever
+from conversation_history import ConversationHistory
+from data_store import SnapshotStore
+from fast_path import FastPathRouter, OPEN_ENDED_WORDS, WORD_PATTERN
+from briefings import BriefingService
+from advisory_crawler import AdvisoryCrawler
+from soil_grid import to_conventional
+from crop_health import CropHealthMonitor
+from agromet import indicators_for
+from ollama_monitor import OllamaMonitor
+from token_budget import ContextPacker, counter as token_counter
+from checkpoint import Checkpointer
+import http_client
+import time
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+class OllamaError(Exception):
+    """Non-200 answer from the Ollama generate endpoint"""
+
+
 class FarmerChatbot:
+    BACKEND_DOWN_MESSAGE = "⚠️ The assistant model is not reachable right now. Please try again in a minute."
+
     def __init__(self):
         self.ollama_url = os.getenv('OLLAMA_HOST', 'http://localhost:11434') + '/api/generate'
         self.model = os.getenv('OLLAMA_MODEL', 'agriaid')
-        self.conversation_history = []
 
-        # Initialize API services
-        self.global_apis = AgriculturalAPIs()
-        self.ph_apis = PhilippineAgriculturalAPIs()
+        # Preload the model and watch the backend so farmers don't pay a cold start
+        self.ollama = OllamaMonitor(model=self.model)
+        self.keep_alive = self.ollama.keep_alive
+        if os.getenv('AGRIAID_WARMUP', '1') == '1':
+            self.ollama.start()
+
+        # Raw turns only; old turns are compacted under a token budget and,
+        # optionally, summarized by the model in the background
+        summarize = os.getenv('AGRIAID_HISTORY_SUMMARY', '0') == '1'
+        self.conversation_history = ConversationHistory(
+            budget_tokens=int(os.getenv('AGRIAID_HISTORY_TOKENS', '800')),
+            summarizer=self._summarize_history if summarize else None
+        )
+
+        # Upstream snapshots shared with other workers
+        self.store = SnapshotStore()
+
+        # Initialize API services (one feed store and snapshot store shared by both)
+        self.feeds = FeedAggregator()
+        self.global_apis = AgriculturalAPIs(feed_aggregator=self.feeds, store=self.store)
+        self.ph_apis = PhilippineAgriculturalAPIs(feed_aggregator=self.feeds, store=self.store)
+
+        # Local archive of DA advisories, crawled incrementally in the background
+        self.advisories = AdvisoryCrawler(scraper=self.ph_apis.scraper,
+                                          on_new=lambda items: self.index_items(advisories=items))
+
+        # Templated answers for structured price/calendar lookups (no LLM call)
+        self.fast_path = FastPathRouter(self.ph_apis)
+
+        # BM25 index over every advisory, news article and RSS item seen so far
+        self.relevance_index = BM25Index()
+
+        # Hot state from the last run (snapshots, parsed pages, the index, fast-path
+        # stats, upstream latencies); otherwise start from the last good snapshots
+        self.checkpoint = Checkpointer({
+            'snapshots': self.store,
+            'scraper': self.ph_apis.scraper,
+            'bm25': self.relevance_index,
+            'fast_path': self.fast_path,
+            'http': http_client.client
+        })
+        start = time.perf_counter()
+        restored = self.checkpoint.restore()
+        if restored:
+            print(f"♻️ Warm start from checkpoint in {(time.perf_counter() - start) * 1000:.0f} ms: {restored}")
+        if not restored.get('snapshots'):
+            self.store.warm_start()
+
+        self.index_items(advisories=self.advisories.all_items(), rss_items=self.feeds.all_items())
+
+        # NDVI history of the registered Agromonitoring fields
+        self.crop_health = CropHealthMonitor(self.global_apis)
+
+        if os.getenv('AGRIAID_CRAWL', '1') == '1':
+            self.advisories.start()
+            self.global_apis.pest_index.start()
+            if self.global_apis.agromonitoring_key:
+                self.crop_health.start()
+
+        # Static crop/pest/price knowledge, chunked into the same index
+        self.knowledge = KnowledgeRetriever(self.ph_apis, index=self.relevance_index)
+        self.knowledge_budget = int(os.getenv('AGRIAID_KNOWLEDGE_TOKENS', '300'))
+
+        # Context sources are fetched in parallel; in speculative mode the reply
+        # starts from whatever is ready after a short wait and late data is
+        # added as a follow-up (or, if it changes the answer early on, a restart)
+        self.gather_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.getenv('AGRIAID_GATHER_WORKERS', '8')), thread_name_prefix='gather')
+        self.speculative = os.getenv('AGRIAID_SPECULATIVE', '0') == '1'
+        self.speculative_wait = float(os.getenv('AGRIAID_SPECULATIVE_WAIT', '0.3'))
+        self.restart_tokens = int(os.getenv('AGRIAID_RESTART_TOKENS', '24'))
+        # Extra time, counted from the start of the turn, that follow-up sources get to arrive
+        self.late_wait = float(os.getenv('AGRIAID_LATE_WAIT', '5'))
+
+        # Splits the ModelFile's num_ctx between system prompt, question, data and history
+        self.packer = ContextPacker(reserve_tokens=int(os.getenv('AGRIAID_REPLY_TOKENS', '512')))
+        self._last_model_prompt = ''  # what Ollama likely still holds in its KV cache
+
+        # Per-region weather briefings, regenerated only when the forecast changes
+        self.briefings = BriefingService(self.ph_apis, self._generate_briefing)
+        if os.getenv('AGRIAID_BRIEFINGS', '1') == '1':
+            self.briefings.start()
+
+        if os.getenv('AGRIAID_CHECKPOINT', '1') == '1':
+            self.checkpoint.start()
 
     def detect_intent(self, user_input):
         """Detect what the user is asking about"""
         user_input_lower = user_input.lower()
 
         intents = {
-            'weather': ['weather', 'temperature', 'temp', 'rain', 'ulan', 'forecast', 'climate', 'bagyo', 'typhoon',
+            'weather': ['weather', 'panahon', 'temperature', 'temp', 'rain', 'ulan', 'forecast', 'climate', 'bagyo', 'typhoon',
                         'init', 'lamig'],
             'soil': ['soil', 'lupa', 'moisture', 'ph', 'fertility', 'nutrients', 'pataba'],
             'pest': ['pest', 'insect', 'kulisap', 'bug', 'disease', 'sakit', 'damage', 'infestation', 'peste'],
@@ -39,77 +146,187 @@ class FarmerChatbot:
 
         return detected if detected else ['general']
 
-    def gather_context_data(self, intents, location, lat=None, lon=None, region=None):
-        """Gather both global and Philippine-specific data"""
-        context = {}
-
-        # Default coordinates for Manila if not provided
-        if not lat or not lon:
-            lat, lon = 14.5995, 120.9842
+    def _context_sources(self, intents, lat, lon, region, question):
+        """
+        The data sources a turn needs, as [(name, fetch)]; each fetch
+        returns a dict of context entries and runs on the gather pool
+        """
+        sources = []
 
         # Philippine-specific data (prioritized)
         if 'weather' in intents:
             print("📡 Fetching PAGASA and weather data...")
 
             # PAGASA forecast
-            pagasa = self.ph_apis.get_pagasa_weather_forecast()
-            context['pagasa_weather'] = pagasa
+            sources.append(('pagasa_weather', lambda: {'pagasa_weather': self.ph_apis.get_pagasa_weather_forecast()}))
 
             # Regional weather
             if region:
-                regional = self.ph_apis.get_regional_weather(region)
-                context['regional_weather'] = regional
+                def regional():
+                    context = {'regional_weather': self.ph_apis.get_regional_weather(region)}
+
+                    # Shared regional briefing, spliced in for the model to build on
+                    briefing = self.briefings.get(region)
+                    if briefing:
+                        context['briefing'] = briefing['text']
+                        self.briefings.record('spliced')
+                    return context
+
+                sources.append(('regional_weather', regional))
 
             # Typhoon alerts
-            typhoon = self.ph_apis.get_pagasa_tropical_cyclone_info()
-            context['typhoon_alert'] = typhoon
+            sources.append(('typhoon_alert', lambda: {'typhoon_alert': self.ph_apis.get_pagasa_tropical_cyclone_info()}))
 
             # Detailed weather from Open-Meteo
-            detailed = self.global_apis.get_open_meteo_weather(lat, lon)
-            context['detailed_weather'] = detailed
+            sources.append(('detailed_weather', lambda: {'detailed_weather': self.global_apis.get_open_meteo_weather(lat, lon)}))
+
+        # Farm numbers from the hourly forecast (spray windows matter for pest control too)
+        if 'weather' in intents or 'pest' in intents:
+            sources.append(('agromet', lambda: {
+                'agromet': indicators_for(self.global_apis.get_open_meteo_weather(lat, lon), lat)
+            }))
 
         if 'soil' in intents:
             print("📡 Fetching soil data...")
-            soil = self.global_apis.get_soil_data(lat, lon)
-            context['soil'] = soil
+
+            def soil():
+                # Soil properties come from the local SoilGrids raster; the
+                # Agromonitoring temperature/moisture call needs a paid key
+                soil_info = self.global_apis.get_soilgrids_data(lat, lon)
+                context = {'soil_properties': to_conventional(soil_info) if soil_info else None}
+
+                if self.global_apis.agromonitoring_key:
+                    context['soil'] = self.global_apis.get_soil_data(lat, lon)
+                return context
+
+            sources.append(('soil', soil))
 
         if 'pest' in intents:
             print("📡 Loading pest information...")
-            ph_pests = self.ph_apis.get_common_philippine_pests()
-            context['ph_pests'] = ph_pests
-
-            observations = self.global_apis.get_pest_observations(lat, lon)
-            context['pest_observations'] = observations
+            sources.append(('ph_pests', lambda: {'ph_pests': self.ph_apis.get_common_philippine_pests()}))
+            sources.append(('pest_observations', lambda: {
+                'pest_observations': self.global_apis.get_pest_observations(lat, lon)
+            }))
+
+            # Sighting counts and trends near the farm, matched to the known pests
+            pest_index = self.global_apis.pest_index
+
+            def pest_activity():
+                if not pest_index.watermark:
+                    return {}
+                counts = pest_index.species_counts(lat, lon)
+                return {'pest_activity': {
+                    'known': pest_index.match_known_pests(counts, self.ph_apis.get_common_philippine_pests()),
+                    'counts': counts
+                }}
+
+            sources.append(('pest_activity', pest_activity))
+
+        # Registered fields whose NDVI is dropping
+        if ('crop' in intents or 'pest' in intents) and len(self.crop_health):
+            sources.append(('crop_health', lambda: {
+                'crop_health': self.crop_health.declining_fields(region=region, limit=3)
+            }))
 
         if 'crop' in intents:
             print("📡 Loading crop calendar...")
             # Try to detect crop type
             crops = ['rice', 'corn', 'vegetables', 'banana']
+            last_user_text = self.conversation_history.last_user_text().lower()
             for crop in crops:
-                if crop in intents or crop in str(self.conversation_history[-1:]).lower():
-                    calendar = self.ph_apis.get_philippine_crop_calendar(crop)
-                    context['crop_calendar'] = calendar
+                if crop in intents or crop in last_user_text:
+                    sources.append(('crop_calendar', lambda crop=crop: {
+                        'crop_calendar': self.ph_apis.get_philippine_crop_calendar(crop)
+                    }))
                     break
 
         if 'price' in intents:
             print("📡 Fetching market prices...")
-            prices = self.ph_apis.get_market_prices_manual()
-            context['prices'] = prices
+
+            def prices():
+                context = {'prices': self.ph_apis.get_market_prices_manual()}
+
+                # Latest Bantay Presyo prices with week-over-week change
+                self.ph_apis.update_price_history()
+                history = self.ph_apis.price_history
+                terms = [term for term in tokenize(question or '') if history.find(term)] or ['rice']
+                context['price_watch'] = history.summary(terms, region=region)
+                return context
+
+            sources.append(('prices', prices))
 
         if 'news' in intents:
             print("📡 Fetching agricultural news...")
-            da_advisories = self.ph_apis.get_da_advisories()
-            context['da_advisories'] = da_advisories
+            sources.append(('da_advisories', lambda: {
+                'da_advisories': self.advisories.latest(5) or self.ph_apis.get_da_advisories()
+            }))
+            sources.append(('news', lambda: {
+                'news': self.global_apis.get_agricultural_news(query="philippines agriculture")
+            }))
+
+        return sources
+
+    def _gather(self, intents, lat, lon, region, question, wait=None):
+        """
+        Fetch the turn's sources in parallel. With wait=None every source is
+        awaited; otherwise only the ones ready within `wait` seconds are used.
+        Returns (context, {name: future} still pending).
+        """
+        # Default coordinates for Manila if not provided
+        if not lat or not lon:
+            lat, lon = 14.5995, 120.9842
+
+        futures = {name: self.gather_pool.submit(fetch)
+                   for name, fetch in self._context_sources(intents, lat, lon, region, question)}
+        if wait is not None:
+            concurrent.futures.wait(futures.values(), timeout=wait)
+
+        context = {}
+        pending = {}
+        for name, future in futures.items():
+            if wait is None or future.done():
+                context.update(future.result())
+            else:
+                pending[name] = future
+
+        self.index_items(context.get('da_advisories'), context.get('news'), self.feeds.all_items())
 
-            news = self.global_apis.get_agricultural_news(query="philippines agriculture")
-            context['news'] = news
+        # Only the static knowledge chunks that match the question, within budget
+        if question:
+            knowledge = self.knowledge.retrieve(question, intents, self.knowledge_budget, region, with_kinds=True)
+            if knowledge:
+                context['knowledge'] = [text for _, text in knowledge]
+                context['knowledge_kinds'] = sorted({kind for kind, _ in knowledge})
 
+        return context, pending
+
+    def gather_context_data(self, intents, location, lat=None, lon=None, region=None, question=None):
+        """Gather both global and Philippine-specific data (sources fetched in parallel)"""
+        context, _ = self._gather(intents, lat, lon, region, question)
         return context
 
-    def format_context_for_llm(self, context):
+    def index_items(self, advisories=None, news=None, rss_items=None):
+        """Add fetched advisories, news and RSS items to the relevance index"""
+        for advisory in advisories or []:
+            text = f"{advisory['title']} {advisory.get('body') or ''}"
+            self.relevance_index.add(advisory['link'], text, advisory, kind='advisory')
+
+        for article in news or []:
+            text = f"{article['title']} {article.get('description') or ''}"
+            self.relevance_index.add(article['url'], text, article, kind='news')
+
+        for item in rss_items or []:
+            text = f"{item['title']} {item.get('summary') or ''}"
+            self.relevance_index.add(item['id'], text, {'title': item['title'], 'url': item['link']}, kind='rss')
+
+    def format_context_for_llm(self, context, question=None, region=None):
         """Format gathered data for LLM consumption"""
         formatted = "\n\n[REAL-TIME AGRICULTURAL DATA]\n"
 
+        # Regional briefing
+        if context.get('briefing'):
+            formatted += f"\n🗓️ REGIONAL WEATHER BRIEFING:\n{context['briefing']}\n"
+
         # PAGASA Weather
         if 'pagasa_weather' in context and context['pagasa_weather']:
             formatted += f"\n🇵🇭 PAGASA WEATHER FORECAST:\n"
@@ -136,6 +353,21 @@ class FarmerChatbot:
                 formatted += f"- Wind: {w.get('windspeed', 'N/A')} km/h\n"
                 formatted += f"- Precipitation: {w.get('precipitation', 0)} mm\n"
 
+        # Agro-met indicators
+        if context.get('agromet'):
+            a = context['agromet']
+            formatted += f"\n🌾 FARM WEATHER INDICATORS (next {a['days']} days):\n"
+            formatted += f"- Rain: {a['rain_24h']} mm next 24h, {a['rain_72h']} mm next 72h, {a['rain_total']} mm total (wettest 24h: {a['max_rain_24h']} mm)\n"
+            formatted += f"- Evapotranspiration (ET0): {a['et0_total']} mm, water balance {a['water_balance']:+} mm\n"
+            formatted += f"- Growing degree days (base {a['gdd_base']:.0f}°C): {a['gdd']}\n"
+            if a['heat_stress_hours']:
+                formatted += f"- Heat stress: {a['heat_stress_hours']} hours at 35°C or more\n"
+            if a['spray_windows']:
+                windows = ', '.join(f"{w['start']} ({w['hours']}h)" for w in a['spray_windows'][:3])
+                formatted += f"- Spray windows (calm, dry 6h after): {windows}\n"
+            else:
+                formatted += f"- Spray windows: none (too windy, wet or hot)\n"
+
         # Soil data
         if 'soil' in context and context['soil']:
             s = context['soil']
@@ -143,168 +375,576 @@ class FarmerChatbot:
             formatted += f"- Temperature: {s['soil_temp']}°C\n"
             formatted += f"- Moisture: {s['soil_moisture']}\n"
 
+        if context.get('soil_properties'):
+            s = context['soil_properties']
+            labels = [('clay', 'Clay', '%'), ('sand', 'Sand', '%'), ('silt', 'Silt', '%'),
+                      ('phh2o', 'pH', ''), ('soc', 'Organic carbon', ' g/kg'), ('nitrogen', 'Nitrogen', ' g/kg')]
+            formatted += f"\n🧪 SOIL PROPERTIES (SoilGrids, topsoil 0-5cm):\n"
+            for key, label, unit in labels:
+                if key in s:
+                    formatted += f"- {label}: {s[key]:g}{unit}\n"
+
+        # Retrieved crop/pest/price knowledge replaces the generic dump of the same kind below
+        knowledge_kinds = context.get('knowledge_kinds') or ()
+        if context.get('knowledge'):
+            formatted += f"\n📚 RELEVANT FARMING INFORMATION:\n"
+            for chunk in context['knowledge']:
+                formatted += f"- {chunk}\n"
+
         # Pest info
-        if 'ph_pests' in context and context['ph_pests']:
+        if 'ph_pests' in context and context['ph_pests'] and 'pest' not in knowledge_kinds:
             formatted += f"\n🐛 COMMON PHILIPPINE PESTS:\n"
             if 'pests' in context['ph_pests']:
                 for pest in context['ph_pests']['pests'][:2]:
                     formatted += f"- {pest['name']}: {pest['symptoms']}\n"
 
+        # Pest sightings near the farm
+        if context.get('pest_activity') and (context['pest_activity']['known'] or context['pest_activity']['counts']):
+            activity = context['pest_activity']
+            formatted += f"\n🔎 PEST SIGHTINGS WITHIN 50 KM (iNaturalist, last 30 days):\n"
+            for match in activity['known'][:3]:
+                formatted += f"- {match['pest']} ({match['crop']}): {match['count']} sightings, {match['trend']}\n"
+            if not activity['known']:
+                for entry in activity['counts'][:3]:
+                    formatted += f"- {entry['common_name']} ({entry['species']}): {entry['count']} sightings, {entry['trend']}\n"
+        elif context.get('pest_observations'):
+            formatted += f"\n🔎 RECENT INSECT SIGHTINGS NEARBY (iNaturalist):\n"
+            for obs in context['pest_observations'][:3]:
+                formatted += f"- {obs['common_name']} ({obs['species']}), {obs['location']}, {obs['observed_on']}\n"
+
+        # Field vigor
+        if context.get('crop_health'):
+            formatted += f"\n🛰️ FIELDS WITH DECLINING VIGOR (NDVI, last 2 weeks vs. prior 6 weeks):\n"
+            for field in context['crop_health']:
+                crop = f" ({field['crop']})" if field['crop'] else ""
+                formatted += f"- {field['name']}{crop}: NDVI {field['ndvi_recent']} vs {field['ndvi_baseline']} ({field['change_pct']}%)"
+                if field['slope_per_week'] is not None:
+                    formatted += f", {field['slope_per_week']:+.3f}/week"
+                formatted += "\n"
+
         # Prices
-        if 'prices' in context and context['prices']:
+        if 'prices' in context and context['prices'] and 'price' not in knowledge_kinds:
             formatted += f"\n💰 CURRENT MARKET PRICES (as of {context['prices']['last_updated']}):\n"
             if 'rice' in context['prices']['prices']:
                 formatted += f"- Rice: {context['prices']['prices']['rice']['regular_milled']}\n"
 
-        # News and advisories
-        if 'da_advisories' in context and context['da_advisories']:
-            formatted += f"\n📰 DA ADVISORIES:\n"
-            for advisory in context['da_advisories'][:3]:
-                formatted += f"- {advisory['title']}\n  {advisory['link']}\n"
-
-        if 'news' in context and context['news']:
-            formatted += f"\n📡 LATEST AGRICULTURAL NEWS:\n"
-            for article in context['news'][:3]:
-                formatted += f"- {article['title']}\n  {article['url']}\n"
+        # Price history
+        if context.get('price_watch'):
+            formatted += f"\n📈 PRICE WATCH (DA Bantay Presyo):\n"
+            for p in context['price_watch']:
+                area = f"Region {p['region']}" if p['region'] != 'all markets' else p['region']
+                change = f", {p['week_change_pct']:+.1f}% vs last week" if p['week_change_pct'] is not None else ""
+                formatted += f"- {p['commodity'].capitalize()}: {p['min']:.2f}-{p['max']:.2f} PHP/kg ({area}, {p['date']}{change})\n"
+
+        # News and advisories: rank everything indexed so far against the question,
+        # falling back to the latest items when nothing matches
+        if 'da_advisories' in context or 'news' in context:
+            advisories = context.get('da_advisories') or []
+            news = context.get('news') or []
+            if question:
+                ranked = self.relevance_index.search(question, k=3, kinds=('advisory',), region=region)
+                advisories = [item for _, _, item in ranked] or advisories
+                ranked = self.relevance_index.search(question, k=3, kinds=('news', 'rss'), region=region)
+                news = [item for _, _, item in ranked] or news
+
+            if advisories:
+                formatted += f"\n📰 DA ADVISORIES:\n"
+                for advisory in advisories[:3]:
+                    published = f" ({advisory['published']})" if advisory.get('published') else ""
+                    formatted += f"- {advisory['title']}{published}\n  {advisory['link']}\n"
+
+            if news:
+                formatted += f"\n📡 LATEST AGRICULTURAL NEWS:\n"
+                for article in news[:3]:
+                    formatted += f"- {article['title']}\n  {article['url']}\n"
 
         formatted += "\n[END OF REAL-TIME DATA]\n"
 
         return formatted
 
-    def chat(self, user_input, location="Manila", lat=None, lon=None, region=None, stream=False):
-        """Main chat function"""
+    def _fast_path_answer(self, user_input, region=None):
+        """Templated answer for a structured lookup (recorded in history), or None"""
+        answer = self.fast_path.answer(user_input, self.detect_intent(user_input), region=region)
+        if answer:
+            print(f"⚡ Fast path (hit rate {self.fast_path.hit_rate:.0%})")
+            self.conversation_history.add("user", user_input)
+            self.conversation_history.add("assistant", answer)
+        return answer
+
+    def _briefing_answer(self, user_input, region):
+        """The region's precomputed briefing for a plain weather question (recorded in history), or None"""
+        words = WORD_PATTERN.findall(user_input.lower())
+        if (not region or self.detect_intent(user_input) != ['weather'] or len(words) > 12
+                or set(words) & OPEN_ENDED_WORDS):
+            return None
+
+        # Briefings are written in one language; other questions go to the model,
+        # which gets the briefing spliced into its context instead
+        if FastPathRouter.is_tagalog(words) != (self.briefings.LANGUAGE == 'tl'):
+            return None
+
+        briefing = self.briefings.get(region)
+        if not briefing:
+            return None
+
+        print(f"🗓️ Regional briefing ({region.upper()})")
+        self.briefings.record('served')
+        self.conversation_history.add("user", user_input)
+        self.conversation_history.add("assistant", briefing['text'])
+        return briefing['text']
+
+    def _prepare_turn(self, user_input, location="Manila", lat=None, lon=None, region=None, wait=None):
+        """
+        Detect intents, gather and format context, record the turn; returns
+        (prompt, context, {name: future} of sources not ready within wait)
+        """
         # Detect intents
         intents = self.detect_intent(user_input)
         print(f"🤖 Detected: {', '.join(intents)}")
 
         # Gather context data
-        context_data = self.gather_context_data(intents, location, lat, lon, region)
+        context_data, pending = self._gather(intents, lat, lon, region, user_input, wait)
 
-        # Format context
-        context_text = self.format_context_for_llm(context_data)
+        # Add the farmer's raw words to history; the data block rides only on this turn
+        self.conversation_history.add("user", user_input)
 
-        # Enhance prompt
-        enhanced_prompt = user_input + context_text
+        return self._build_prompt(context_data, user_input, region), context_data, pending
 
-        # Add to history
-        self.conversation_history.append({
-            "role": "user",
-            "content": enhanced_prompt
-        })
+    def _build_prompt(self, context_data, user_input, region):
+        """Format context, fit it into the context window and build the prompt for the current turn"""
+        context_text = self.format_context_for_llm(context_data, question=user_input, region=region)
+        plan = self.packer.plan(context_text, user_input)
+        return self.conversation_history.build_prompt(plan['data'], max_tokens=plan['history'])
 
-        # Build conversation
-        full_prompt = ""
-        for msg in self.conversation_history[-10:]:
-            full_prompt += f"{msg['role']}: {msg['content']}\n"
+    def _observe_prompt(self, prompt, result):
+        """Calibrate the token counter with the prompt size Ollama reported"""
+        text = f"{self.packer.system_prompt}\n{prompt}"
+        # Ollama only evaluated what follows the prefix shared with the previous prompt
+        cached = os.path.commonprefix([self._last_model_prompt, text])
+        self._last_model_prompt = text
+        token_counter.observe(text, result.get('prompt_eval_count'), cached_prefix=cached)
+
+    def chat(self, user_input, location="Manila", lat=None, lon=None, region=None, stream=False, speculative=None):
+        """Main chat function"""
+        speculative = self.speculative if speculative is None else speculative
+        if stream or speculative:
+            # Same streaming path as stream_chat, collected into the final text
+            final = {}
+            for event in self.stream_chat(user_input, location, lat, lon, region, speculative=speculative):
+                if event.get('done'):
+                    final = event
+            return final.get('error') or final.get('response', '')
+
+        answer = self._fast_path_answer(user_input, region) or self._briefing_answer(user_input, region)
+        if answer:
+            return answer
+
+        if self.ollama.is_down:
+            return self.BACKEND_DOWN_MESSAGE
+
+        full_prompt, _, _ = self._prepare_turn(user_input, location, lat, lon, region)
 
         # Call Ollama
         payload = {
             "model": self.model,
             "prompt": full_prompt,
-            "stream": stream
+            "stream": False,
+            "keep_alive": self.keep_alive
         }
 
         try:
-            if stream:
-                return self._stream_response(payload)
-            else:
-                # response = requests.post(self.ollama_url, json=payload)
-                # result = response.json()
-                # assistant_response = result['response']
-                #
-                # self.conversation_history.append({
-                #     "role": "assistant",
-                #     "content": assistant_response
-                # })
-                #
-                # return assistant_response
-                response = requests.post(self.ollama_url, json=payload, timeout=60)
-                print(f"📡 Response status: {response.status_code}")
-
-                if response.status_code != 200:
-                    error_msg = f"Ollama error: {response.status_code} - {response.text}"
-                    print(error_msg)
-                    return error_msg
-
-                result = response.json()
-                print(f"🔍 Response keys: {list(result.keys())}")
-
-                # Try to get response
-                try:
-                    assistant_response = result['response']  # This line might be failing
-                    print(f"✅ Got response: {assistant_response[:100]}...")
-                except KeyError as e:
-                    print(f"❌ KeyError: {e}")
-                    print(f"🔍 Full result keys: {result.keys()}")
-                    print(f"🔍 Full result: {json.dumps(result, indent=2)[:500]}")
-                    return f"Error: 'response' key not found in Ollama output"
-
-                # Check if response is empty
-                if not assistant_response or not assistant_response.strip():
-                    print("⚠️ Empty response from Ollama")
-                    return "I apologize, I couldn't generate a response. Please try again."
-
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": assistant_response
-                })
-                return assistant_response
-        except Exception as e:
-            return f"❌ Error: {e}"
-
-    def _stream_response(self, payload):
-        """Stream responses in real-time"""
-        try:
-            response = requests.post(self.ollama_url, json=payload, stream=True, timeout=60)
+            # response = requests.post(self.ollama_url, json=payload)
+            # result = response.json()
+            # assistant_response = result['response']
+            #
+            # self.conversation_history.append({
+            #     "role": "assistant",
+            #     "content": assistant_response
+            # })
+            #
+            # return assistant_response
+            response = requests.post(self.ollama_url, json=payload, timeout=60)
+            print(f"📡 Response status: {response.status_code}")
 
             if response.status_code != 200:
-                error_msg = f"Ollama error: {response.status_code}"
-                print(f"\n🤖 Bot: {error_msg}")
+                error_msg = f"Ollama error: {response.status_code} - {response.text}"
+                print(error_msg)
                 return error_msg
 
-            full_response = ""
-            print("\n🤖 Bot: ", end='', flush=True)
-
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        json_response = json.loads(line)
+            result = response.json()
+            print(f"🔍 Response keys: {list(result.keys())}")
+            self._observe_prompt(full_prompt, result)
 
-                        if 'response' in json_response:
-                            token = json_response['response']
-                            full_response += token
-                            print(token, end='', flush=True)
-
-                        # Check if generation is done
-                        if json_response.get('done', False):
-                            break
+            # Try to get response
+            try:
+                assistant_response = result['response']  # This line might be failing
+                print(f"✅ Got response: {assistant_response[:100]}...")
+            except KeyError as e:
+                print(f"❌ KeyError: {e}")
+                print(f"🔍 Full result keys: {result.keys()}")
+                print(f"🔍 Full result: {json.dumps(result, indent=2)[:500]}")
+                return f"Error: 'response' key not found in Ollama output"
+
+            # Check if response is empty
+            if not assistant_response or not assistant_response.strip():
+                print("⚠️ Empty response from Ollama")
+                return "I apologize, I couldn't generate a response. Please try again."
+
+            self.conversation_history.add("assistant", assistant_response)
+            return assistant_response
+        except Exception as e:
+            return f"❌ Error: {e}"
 
-                    except json.JSONDecodeError:
-                        continue
+    # ==================== STREAMING ====================
+
+    def stream_chat(self, user_input, location="Manila", lat=None, lon=None, region=None, speculative=None):
+        """
+        Generator over the reply as it is produced.
+        Yields {'token': str} events, then one final event:
+        {'done': True, 'response': full text, 'eval_count', 'prompt_eval_count',
+         'total_duration', 'eval_duration'} -- or {'done': True, 'error': msg}.
+        Closing the generator early (client gone) closes the Ollama stream,
+        which stops generation and frees the model slot.
+        Fast-path answers and regional briefings arrive as a single token
+        with 'fast_path': True.
+        In speculative mode (AGRIAID_SPECULATIVE=1) two more events can
+        appear: {'restart': True} (discard the text shown so far) and
+        {'follow_up': True} (the tokens after it update the answer).
+        """
+        answer = self._fast_path_answer(user_input, region) or self._briefing_answer(user_input, region)
+        if answer:
+            yield {'token': answer}
+            yield {'done': True, 'response': answer, 'fast_path': True}
+            return
+
+        if self.ollama.is_down:
+            yield {'done': True, 'error': self.BACKEND_DOWN_MESSAGE}
+            return
+
+        if self.speculative if speculative is None else speculative:
+            yield from self._stream_speculative(user_input, location, lat, lon, region)
+            return
+
+        full_prompt, _, _ = self._prepare_turn(user_input, location, lat, lon, region)
+
+        parts = []
+        final = {}
+        finished = False
+        try:
+            yield from self._ollama_tokens(full_prompt, parts, final)
 
-            print()  # New line after streaming
+            full_response = ''.join(parts)
 
             # Check if we got any response
-            if not full_response or not full_response.strip():
-                fallback = "I apologize, I couldn't generate a response. Please try again."
+            if not full_response.strip():
                 print(f"⚠️ Empty response, using fallback")
-                full_response = fallback
+                full_response = "I apologize, I couldn't generate a response. Please try again."
+
+            self.conversation_history.add("assistant", full_response)
+            finished = True
+            yield {
+                'done': True,
+                'response': full_response,
+                'eval_count': final.get('eval_count'),
+                'prompt_eval_count': final.get('prompt_eval_count'),
+                'total_duration': final.get('total_duration'),
+                'eval_duration': final.get('eval_duration')
+            }
+
+        except OllamaError as e:
+            finished = True
+            yield {'done': True, 'error': str(e)}
+        except Exception as e:
+            if not finished:
+                finished = True
+                yield {'done': True, 'error': f"Error: {str(e)}"}
+        finally:
+            # Cancelled mid-reply: keep what the farmer already saw in history
+            if not finished and parts:
+                self.conversation_history.add("assistant", ''.join(parts))
+
+    def _ollama_tokens(self, prompt, parts, final, options=None):
+        """
+        Stream one generation: yields {'token': str} events and appends each
+        token to parts; Ollama's closing message is copied into final.
+        Raises OllamaError on a non-200 answer. Closing the generator
+        closes the HTTP stream.
+        """
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        if options:
+            payload["options"] = options
 
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": full_response
-            })
+        response = requests.post(self.ollama_url, json=payload, stream=True, timeout=60)
+        try:
+            if response.status_code != 200:
+                raise OllamaError(f"Ollama error: {response.status_code}")
 
-            return full_response
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    json_response = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                token = json_response.get('response')
+                if token:
+                    parts.append(token)
+                    yield {'token': token}
+
+                # Check if generation is done
+                if json_response.get('done', False):
+                    final.update(json_response)
+                    self._observe_prompt(prompt, json_response)
+                    break
+        finally:
+            response.close()
+
+    # ==================== SPECULATIVE STREAMING ====================
+
+    NO_UPDATE = "NO_UPDATE"
+    HEAVY_RAIN_MM = 50
+    # Late sources worth a second generation: the active-cyclone list and DA advisories
+    # (fetched only when the question is about weather or news), plus agromet when it
+    # shows heavy rain. Anything else arriving late only warms the caches.
+    FOLLOW_UP_SOURCES = ('typhoon_alert', 'da_advisories', 'agromet')
+
+    def _collect_late(self, pending):
+        """Context entries of the pending sources that have finished (removed from pending)"""
+        late = {}
+        for name in [name for name, future in pending.items() if future.done()]:
+            try:
+                late.update(pending.pop(name).result())
+            except Exception as e:
+                print(f"Late source error ({name}): {e}")
+        return late
+
+    def _changes_answer(self, late):
+        """Late data that should reshape the answer, not just be appended: an active cyclone or heavy rain"""
+        if isinstance(late.get('typhoon_alert'), list) and late['typhoon_alert']:
+            return True
+        agromet = late.get('agromet')
+        return bool(agromet and agromet['rain_24h'] >= self.HEAVY_RAIN_MM)
+
+    def _stream_speculative(self, user_input, location, lat, lon, region):
+        """
+        Two-phase reply: start generating from the sources ready within
+        speculative_wait (cached snapshots, static crop/pest data), then
+        - restart once, if data that changes the answer arrives within the
+          first restart_tokens tokens, or
+        - append a short follow-up written from late data that matters (an
+          active cyclone, DA advisories, heavy rain), skipped when the model
+          says it changes nothing.
+        """
+        started = time.monotonic()
+        full_prompt, context, pending = self._prepare_turn(user_input, location, lat, lon, region,
+                                                           wait=self.speculative_wait)
+        if pending:
+            print(f"⏩ Speculative start, still loading: {', '.join(pending)}")
+
+        parts = []
+        final = {}
+        late = {}
+        restarted = False
+        finished = False
+        try:
+            while True:
+                restart = False
+                tokens = self._ollama_tokens(full_prompt, parts, final)
+                try:
+                    for event in tokens:
+                        yield event
+                        if pending and not restarted and len(parts) < self.restart_tokens:
+                            late.update(self._collect_late(pending))
+                            if self._changes_answer(late):
+                                restart = True
+                                break
+                finally:
+                    tokens.close()
+                if not restart:
+                    break
 
+                print(f"🔁 Restarting with late data: {', '.join(late)}")
+                context.update(late)
+                late = {}
+                parts.clear()
+                final.clear()
+                restarted = True
+                full_prompt = self._build_prompt(context, user_input, region)
+                yield {'restart': True}
+
+            draft = ''.join(parts)
+            if not draft.strip():
+                print(f"⚠️ Empty response, using fallback")
+                draft = "I apologize, I couldn't generate a response. Please try again."
+
+            # Follow-up sources still loading get what is left of late_wait; the rest
+            # finish in the background and only warm the caches
+            waiting = [future for name, future in pending.items() if name in self.FOLLOW_UP_SOURCES]
+            if waiting:
+                concurrent.futures.wait(waiting, timeout=max(0.0, started + self.late_wait - time.monotonic()))
+            late.update(self._collect_late(pending))
+            self.index_items(late.get('da_advisories'), late.get('news'))
+            late = {name: late[name] for name in self.FOLLOW_UP_SOURCES
+                    if late.get(name) and (name != 'agromet' or self._changes_answer({name: late[name]}))
+                    and not (name == 'typhoon_alert' and isinstance(late[name], str))}
+
+            update = ''
+            if late:
+                try:
+                    update = yield from self._stream_follow_up(late, draft, user_input, region)
+                except Exception as e:
+                    print(f"Follow-up error: {e}")
+
+            full_response = f"{draft}\n\n{update}" if update else draft
+            self.conversation_history.add("assistant", full_response)
+            finished = True
+            yield {
+                'done': True,
+                'response': full_response,
+                'speculative': True,
+                'restarted': restarted,
+                'late_sources': sorted(late),
+                'eval_count': final.get('eval_count'),
+                'prompt_eval_count': final.get('prompt_eval_count'),
+                'total_duration': final.get('total_duration'),
+                'eval_duration': final.get('eval_duration')
+            }
+
+        except OllamaError as e:
+            finished = True
+            yield {'done': True, 'error': str(e)}
         except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            print(f"\n🤖 Bot: {error_msg}")
-            return error_msg
+            if not finished:
+                finished = True
+                yield {'done': True, 'error': f"Error: {str(e)}"}
+        finally:
+            # Cancelled mid-reply: keep what the farmer already saw in history
+            if not finished and parts:
+                self.conversation_history.add("assistant", ''.join(parts))
+
+    def _stream_follow_up(self, late, draft, user_input, region):
+        """Stream an update written from the late data; returns its text ('' when nothing changed)"""
+        late_text = self.format_context_for_llm(late, question=user_input, region=region)
+        prompt = (
+            f"user: {user_input}\nassistant: {draft}\n{late_text}\n"
+            f"The data above arrived after you answered. If it changes or adds to your advice, write a "
+            f"short update of at most 3 sentences in the farmer's language. If it changes nothing, reply "
+            f"only with {self.NO_UPDATE}."
+        )
+
+        parts = []
+        shown = False
+        tokens = self._ollama_tokens(prompt, parts, {}, options={"num_predict": 150})
+        try:
+            for event in tokens:
+                if shown:
+                    yield event
+                    continue
+                # Hold tokens back until it is clear this is not NO_UPDATE
+                text = ''.join(parts).lstrip()
+                if self.NO_UPDATE.startswith(text):
+                    continue
+                if text.startswith(self.NO_UPDATE):
+                    return ''
+                shown = True
+                yield {'follow_up': True}
+                yield {'token': f"\n\n{text}"}
+        finally:
+            tokens.close()
+
+        text = ''.join(parts).strip()
+        if not text or text.startswith(self.NO_UPDATE):
+            return ''
+        if not shown:
+            yield {'follow_up': True}
+            yield {'token': f"\n\n{text}"}
+        return text
+
+    async def astream_chat(self, user_input, location="Manila", lat=None, lon=None, region=None, max_buffered=32):
+        """
+        Async iterator with the same events as stream_chat.
+        The blocking stream runs in a worker thread feeding a bounded queue,
+        so a slow consumer applies backpressure to generation; if the
+        consumer stops iterating (or its task is cancelled) the worker
+        closes the Ollama stream.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=max_buffered)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not stop.is_set():
+                try:
+                    future.result(timeout=0.25)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    continue
+            future.cancel()
+            return False
+
+        def produce():
+            events = self.stream_chat(user_input, location, lat, lon, region)
+            try:
+                for event in events:
+                    if not put(event):
+                        break
+            finally:
+                events.close()
+                put(end)
+
+        worker = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                event = await queue.get()
+                if event is end:
+                    break
+                yield event
+        finally:
+            stop.set()
+            await asyncio.shield(worker)
+
+    def _summarize_history(self, previous_summary, turns):
+        """Ask the model for a short running summary of turns dropped from history"""
+        transcript = "".join(f"{turn['role']}: {turn['content']}\n" for turn in turns)
+        prompt = (
+            "Summarize this farming conversation in at most two sentences. "
+            "Keep crops, locations and problems mentioned.\n"
+            + (f"Earlier summary: {previous_summary}\n" if previous_summary else "")
+            + transcript
+        )
+        payload = {"model": self.model, "prompt": prompt, "stream": False,
+                   "keep_alive": self.keep_alive, "options": {"num_predict": 80}}
+        response = requests.post(self.ollama_url, json=payload, timeout=120)
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        self._observe_prompt(prompt, result)
+        return result.get('response')
+
+    def _generate_briefing(self, prompt):
+        """One regional briefing from the model (background, not part of any conversation)"""
+        if self.ollama.is_down:
+            return None
+        payload = {"model": self.model, "prompt": prompt, "stream": False,
+                   "keep_alive": self.keep_alive, "options": {"num_predict": 200}}
+        response = requests.post(self.ollama_url, json=payload, timeout=120)
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        self._observe_prompt(prompt, result)
+        return result.get('response')
 
     def reset_conversation(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.conversation_history.reset()
         print("✅ Conversation reset")
 
 
@@ -351,14 +991,32 @@ if __name__ == "__main__":
                 continue
 
             # Use streaming for better UX
+            events = bot.stream_chat(user_input, location=location, region=region)
             try:
-                bot.chat(user_input, location=location, region=region, stream=True)
+                streamed = False
+                for event in events:
+                    if not streamed:
+                        print("\n🤖 Bot: ", end='', flush=True)
+                    if 'token' in event:
+                        print(event['token'], end='', flush=True)
+                    elif event.get('restart'):
+                        # A terminal can't take back printed text; mark where the new answer starts
+                        print("\n\n🔁 New data arrived, updated answer:\n", end='', flush=True)
+                    elif event.get('follow_up'):
+                        print("\n\n📌 Update from data that arrived late:", end='', flush=True)
+                    elif not streamed:
+                        # Error, or fallback text for an empty generation
+                        print(event.get('error') or event['response'], end='')
+                    streamed = True
+                print()  # New line after streaming
             except KeyboardInterrupt:
                 print("\n\n⚠️ Interrupted by user")
                 continue
             except Exception as e:
                 print(f"\n❌ Error: {e}")
                 continue
+            finally:
+                events.close()  # Stops generation if we bailed out early
 
         except KeyboardInterrupt:
             print("\n\n🤖 Bot: Goodbye! 🌾")
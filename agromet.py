@@ -0,0 +1,264 @@
+import numpy as np
+from datetime import datetime, timedelta, timezone
+import time
+
+
+# Thresholds for the indicators (lowland rice / general field crops)
+GDD_BASE_TEMP = 10.0  # °C, base temperature for rice growing degree days
+HEAT_STRESS_TEMP = 35.0  # °C, spikelet sterility risk at flowering
+SPRAY_MAX_WIND = 15.0  # km/h, drift above this
+SPRAY_MIN_WIND = 3.0  # km/h, inversion / droplets hang below this
+SPRAY_MAX_TEMP = 32.0  # °C, evaporation and volatilization above this
+SPRAY_RAIN_FREE_HOURS = 6  # hours without rain after spraying (rainfastness)
+SPRAY_DAY_HOURS = (6, 18)  # local hours when spraying is practical
+RAIN_THRESHOLD = 0.1  # mm per step counted as rain
+
+
+class HourlyForecast:
+    """
+    One location's forecast as NumPy arrays on a regular step: local time
+    (datetime64[m]), temperature (°C), relative humidity (%), wind (km/h)
+    and precipitation (mm over the step). utc_offset_hours is the offset of
+    that local time, used to place "now" on the same clock.
+    """
+
+    def __init__(self, times, temp, humidity, wind, precip, lat, step_hours=1, utc_offset_hours=8):
+        self.times = np.asarray(times, dtype='datetime64[m]')
+        self.temp = np.asarray(temp, dtype=np.float32)
+        self.humidity = np.asarray(humidity, dtype=np.float32)
+        self.wind = np.asarray(wind, dtype=np.float32)
+        self.precip = np.asarray(precip, dtype=np.float32)
+        self.lat = lat
+        self.step_hours = step_hours
+        self.utc_offset_hours = utc_offset_hours
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def from_open_meteo(cls, hourly, lat, utc_offset_seconds=8 * 3600):
+        """From the Open-Meteo 'hourly' block (timezone=auto, so times are local)"""
+        if not hourly or not hourly.get('time'):
+            return None
+
+        def column(name):
+            return [np.nan if v is None else v for v in hourly.get(name, [None] * len(hourly['time']))]
+
+        return cls(hourly['time'], column('temperature_2m'), column('relative_humidity_2m'),
+                   column('wind_speed_10m'), column('precipitation'), lat, step_hours=1,
+                   utc_offset_hours=utc_offset_seconds / 3600)
+
+    @classmethod
+    def from_openweather(cls, forecast, lat, utc_offset_hours=8):
+        """From get_weather_forecast() entries (UTC, 3-hourly, wind in m/s)"""
+        if not forecast:
+            return None
+        times = np.array([f['datetime'].replace(' ', 'T') for f in forecast], dtype='datetime64[m]')
+        times = times + np.timedelta64(utc_offset_hours * 60, 'm')
+        return cls(times, [f['temp'] for f in forecast], [f['humidity'] for f in forecast],
+                   [f['wind_speed'] * 3.6 for f in forecast], [f['rain_3h'] for f in forecast],
+                   lat, step_hours=3, utc_offset_hours=utc_offset_hours)
+
+
+def _stack(forecasts, name, length, fill=np.nan):
+    matrix = np.full((len(forecasts), length), fill, dtype=np.float32)
+    for i, forecast in enumerate(forecasts):
+        values = getattr(forecast, name)
+        matrix[i, :len(values)] = values
+    return matrix
+
+
+def _extraterrestrial_radiation(lat, day_of_year):
+    """FAO-56 eq. 21, Ra in mm/day of evaporation equivalent; lat (n,1), day_of_year (n,d)"""
+    phi = np.radians(lat)
+    dr = 1 + 0.033 * np.cos(2 * np.pi * day_of_year / 365)
+    delta = 0.409 * np.sin(2 * np.pi * day_of_year / 365 - 1.39)
+    ws = np.arccos(np.clip(-np.tan(phi) * np.tan(delta), -1, 1))
+    ra = (24 * 60 / np.pi) * 0.0820 * dr * (ws * np.sin(phi) * np.sin(delta) +
+                                           np.cos(phi) * np.cos(delta) * np.sin(ws))
+    return 0.408 * ra
+
+
+def _runs(mask_row):
+    """(start, length) of each run of True in a 1-D boolean array"""
+    edges = np.diff(np.r_[0, mask_row.astype(np.int8), 0])
+    starts = np.flatnonzero(edges == 1)
+    return zip(starts, np.flatnonzero(edges == -1) - starts)
+
+
+def _compute(forecasts, now):
+    """Indicators for forecasts that share a step length, as one batch of 2-D arrays"""
+    step = forecasts[0].step_hours
+    n = len(forecasts)
+    length = max(len(f) for f in forecasts)
+
+    temp = _stack(forecasts, 'temp', length)
+    wind = _stack(forecasts, 'wind', length)
+    precip = np.nan_to_num(_stack(forecasts, 'precip', length))
+    times = np.full((n, length), np.datetime64('NaT'), dtype='datetime64[m]')
+    for i, forecast in enumerate(forecasts):
+        times[i, :len(forecast)] = forecast.times
+    valid = ~np.isnat(times) & ~np.isnan(temp)
+
+    # Hours from now and local calendar day of every step. Without an
+    # explicit now, each location's current hour on its own local clock
+    if now is None:
+        utc_hour = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), 'h')
+        now = np.array([[utc_hour + np.timedelta64(round(f.utc_offset_hours * 60), 'm')] for f in forecasts],
+                       dtype='datetime64[m]')
+    else:
+        now = np.datetime64(now, 'm')
+    hours_ahead = (times - now).astype(np.float64) / 60
+    days = times.astype('datetime64[D]')
+    first_day = days[:, :1]
+    day_index = np.where(valid, (days - first_day).astype(np.int64), 0)
+    n_days = int(day_index.max()) + 1
+
+    # ---- Daily aggregates via flat bincount / ufunc.at over (location, day) ----
+    flat = (np.arange(n)[:, None] * n_days + day_index)[valid]
+    counts = np.bincount(flat, minlength=n * n_days).reshape(n, n_days)
+    tmax = np.full(n * n_days, -np.inf)
+    tmin = np.full(n * n_days, np.inf)
+    np.maximum.at(tmax, flat, temp[valid])
+    np.minimum.at(tmin, flat, temp[valid])
+    daily_rain = np.bincount(flat, weights=precip[valid], minlength=n * n_days).reshape(n, n_days)
+    tmax, tmin = tmax.reshape(n, n_days), tmin.reshape(n, n_days)
+
+    # Only days covered by at least 3/4 of their steps count (partial first/last days)
+    full = counts >= 0.75 * 24 / step
+    tmax = np.where(full, tmax, np.nan)
+    tmin = np.where(full, tmin, np.nan)
+    tmean = (tmax + tmin) / 2
+
+    gdd = np.maximum(tmean - GDD_BASE_TEMP, 0)
+    day_dates = first_day + np.arange(n_days)
+    day_of_year = (day_dates - day_dates.astype('datetime64[Y]')).astype(np.int64) + 1
+    lats = np.array([f.lat for f in forecasts], dtype=np.float64)[:, None]
+    ra = _extraterrestrial_radiation(lats, day_of_year)
+    et0 = 0.0023 * ra * (tmean + 17.8) * np.sqrt(np.maximum(tmax - tmin, 0))  # Hargreaves
+
+    # ---- Forward-looking hourly indicators ----
+    ahead = valid & (hours_ahead > -step)
+    rain_24h = np.where(ahead & (hours_ahead < 24), precip, 0).sum(axis=1)
+    rain_72h = np.where(ahead & (hours_ahead < 72), precip, 0).sum(axis=1)
+    rain_total = np.where(ahead, precip, 0).sum(axis=1)
+
+    window = max(1, 24 // step)
+    cumulative = np.cumsum(np.where(ahead, precip, 0), axis=1)
+    cumulative = np.concatenate([np.zeros((n, 1)), cumulative], axis=1)
+    max_rain_24h = (cumulative[:, window:] - cumulative[:, :-window]).max(axis=1) if length >= window \
+        else cumulative[:, -1]
+
+    heat_hours = (ahead & (temp >= HEAT_STRESS_TEMP)).sum(axis=1) * step
+
+    # Spray window: calm, not hot, daylight, dry now and for the next few hours
+    raining = np.where(valid, precip >= RAIN_THRESHOLD, True)
+    rain_ahead = max(1, SPRAY_RAIN_FREE_HOURS // step)
+    wet = np.cumsum(np.concatenate([raining, np.ones((n, rain_ahead), bool)], axis=1), axis=1)
+    wet = np.concatenate([np.zeros((n, 1)), wet], axis=1)
+    dry_ahead = (wet[:, 1 + rain_ahead:1 + rain_ahead + length] - wet[:, :length]) == 0
+    hour_of_day = (times - days).astype(np.int64) // 60
+    sprayable = (ahead & dry_ahead & (wind >= SPRAY_MIN_WIND) & (wind <= SPRAY_MAX_WIND) &
+                 (temp <= SPRAY_MAX_TEMP) & (hour_of_day >= SPRAY_DAY_HOURS[0]) &
+                 (hour_of_day < SPRAY_DAY_HOURS[1]))
+
+    results = []
+    for i, forecast in enumerate(forecasts):
+        windows = [{'start': str(times[i, start].astype(datetime).strftime('%a %d %b %H:%M')),
+                    'hours': int(count * step)}
+                   for start, count in _runs(sprayable[i]) if count * step >= 2]
+        full_days = full[i]
+        daily = [{
+            'date': str(day_dates[i, d]),
+            'tmax': round(float(tmax[i, d]), 1),
+            'tmin': round(float(tmin[i, d]), 1),
+            'rain': round(float(daily_rain[i, d]), 1),
+            'gdd': round(float(gdd[i, d]), 1),
+            'et0': round(float(et0[i, d]), 1)
+        } for d in range(n_days) if full_days[d]]
+        et0_total = float(np.nansum(et0[i]))
+        covered_rain = float(daily_rain[i][full_days].sum())
+        results.append({
+            'days': int(full_days.sum()),
+            'gdd_base': GDD_BASE_TEMP,
+            'gdd': round(float(np.nansum(gdd[i])), 1),
+            'rain_24h': round(float(rain_24h[i]), 1),
+            'rain_72h': round(float(rain_72h[i]), 1),
+            'rain_total': round(float(rain_total[i]), 1),
+            'max_rain_24h': round(float(max_rain_24h[i]), 1),
+            'heat_stress_hours': int(heat_hours[i]),
+            'et0_total': round(et0_total, 1),
+            'water_balance': round(covered_rain - et0_total, 1),
+            'spray_windows': windows,
+            'daily': daily
+        })
+    return results
+
+
+def compute_indicators(forecasts, now=None):
+    """
+    Agro-met indicators for many locations at once. Forecasts with the same
+    step are stacked into (locations x steps) arrays and computed together;
+    returns one dict per forecast (None for a missing forecast), in order.
+    now is a naive local time; by default the current hour in each
+    forecast's own timezone (not the server's).
+    """
+    results = [None] * len(forecasts)
+    groups = {}
+    for i, forecast in enumerate(forecasts):
+        if forecast is not None and len(forecast):
+            groups.setdefault(forecast.step_hours, []).append(i)
+
+    for indices in groups.values():
+        for i, result in zip(indices, _compute([forecasts[i] for i in indices], now)):
+            results[i] = result
+    return results
+
+
+def indicators_for(weather, lat, now=None):
+    """Indicators for one get_open_meteo_weather() answer, or None"""
+    if not isinstance(weather, dict):
+        return None
+    forecast = HourlyForecast.from_open_meteo(weather.get('hourly_forecast'), lat,
+                                              weather.get('utc_offset_seconds', 8 * 3600))
+    return compute_indicators([forecast], now)[0] if forecast else None
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    rng = np.random.default_rng(7)
+    start_day = datetime.now(timezone(timedelta(hours=8))).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    hours = np.arange(7 * 24)
+    times = [(start_day + timedelta(hours=int(h))).strftime('%Y-%m-%dT%H:%M') for h in hours]
+
+    def synthetic(lat):
+        diurnal = 27 + 5 * np.sin((hours % 24 - 9) / 24 * 2 * np.pi) + rng.normal(0, 1, len(hours))
+        rain = np.where(rng.random(len(hours)) < 0.08, rng.gamma(2, 3, len(hours)), 0)
+        return HourlyForecast.from_open_meteo({
+            'time': times, 'temperature_2m': diurnal.tolist(),
+            'relative_humidity_2m': rng.uniform(60, 95, len(hours)).tolist(),
+            'wind_speed_10m': rng.gamma(3, 3, len(hours)).tolist(), 'precipitation': rain.tolist()
+        }, lat)
+
+    n_locations = 1000
+    forecasts = [synthetic(rng.uniform(5, 20)) for _ in range(n_locations)]
+
+    start = time.perf_counter()
+    batch = compute_indicators(forecasts)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    single = [compute_indicators([f])[0] for f in forecasts[:100]]
+    single_ms = (time.perf_counter() - start) * 1000 * n_locations / 100
+
+    assert single == batch[:100]
+    print(f"{n_locations} locations x {len(hours)} hours: batch {batch_ms:.0f} ms, "
+          f"one at a time ~{single_ms:.0f} ms")
+
+    result = batch[0]
+    print(f"GDD (base {result['gdd_base']}°C, {result['days']} days): {result['gdd']}")
+    print(f"Rain: next 24h {result['rain_24h']} mm, 72h {result['rain_72h']} mm, "
+          f"wettest 24h {result['max_rain_24h']} mm")
+    print(f"ET0 {result['et0_total']} mm, water balance {result['water_balance']} mm, "
+          f"heat stress {result['heat_stress_hours']} h")
+    print(f"Spray windows: {result['spray_windows'][:3]}")
@@ -1,20 +1,38 @@
 import requests
+import http_client
 from datetime import datetime, timedelta
 import json
 import os
 from dotenv import load_dotenv
+from feed_aggregator import FeedAggregator
+from data_store import SnapshotStore, snapshot
+from soil_grid import SoilGrid
+from pest_observations import PestObservationIndex
 
 load_dotenv()
 
 class AgriculturalAPIs:
-    def __init__(self):
+    def __init__(self, feed_aggregator=None, store=None, soil_grid=None, pest_index=None):
         # Load API keys from .env file
         self.openweather_key = os.getenv('OPENWEATHER_API_KEY', '')
         self.agromonitoring_key = os.getenv('AGROMONITORING_API_KEY', '')
         self.news_key = os.getenv('NEWS_API_KEY', '')
 
+        # Shared RSS engine (conditional GET + persistent dedup store)
+        self.feeds = feed_aggregator or FeedAggregator()
+
+        # Persistent snapshots shared across worker processes (read-through)
+        self.store = store or SnapshotStore()
+
+        # Local memory-mapped SoilGrids raster (built with soil_grid.py)
+        self.soil_grid = soil_grid or SoilGrid()
+
+        # Local index of iNaturalist pest sightings (synced in the background)
+        self.pest_index = pest_index or PestObservationIndex()
+
     # ==================== WEATHER APIs ====================
 
+    @snapshot('openweather_current', ttl=600)
     def get_current_weather(self, city=None, lat=None, lon=None):
         """
         OpenWeatherMap - Free tier: 1,000 calls/day
@@ -28,7 +46,7 @@ class AgriculturalAPIs:
             return None
 
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
             data = response.json()
 
             if response.status_code == 200:
@@ -49,6 +67,7 @@ class AgriculturalAPIs:
             print(f"Weather API error: {e}")
             return None
 
+    @snapshot('openweather_forecast', ttl=1800)
     def get_weather_forecast(self, city=None, lat=None, lon=None):
         """
         5-day weather forecast (3-hour intervals)
@@ -61,7 +80,7 @@ class AgriculturalAPIs:
             return None
 
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
             data = response.json()
 
             if response.status_code == 200:
@@ -81,6 +100,7 @@ class AgriculturalAPIs:
             print(f"Forecast API error: {e}")
             return None
 
+    @snapshot('open_meteo', ttl=1800)
     def get_open_meteo_weather(self, lat, lon):
         """
         Open-Meteo - Completely FREE, no API key needed!
@@ -92,16 +112,18 @@ class AgriculturalAPIs:
             'longitude': lon,
             'current': 'temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m',
             'daily': 'temperature_2m_max,temperature_2m_min,precipitation_sum,rain_sum,windspeed_10m_max',
+            'hourly': 'temperature_2m,relative_humidity_2m,precipitation,wind_speed_10m',
             'timezone': 'auto',
             'forecast_days': 7
         }
 
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = http_client.get(url, params=params, timeout=10)
+            response.raise_for_status()
             data = response.json()
 
-            # Extract current weather (new API structure)
-            current = data.get('current', {})
+            # Extract current weather (new API structure); an answer without it is an error
+            current = data['current']
             daily = data.get('daily', {})
 
             # Format current weather
@@ -115,7 +137,9 @@ class AgriculturalAPIs:
 
             return {
                 'current': current_weather,
-                'daily_forecast': daily
+                'daily_forecast': daily,
+                'hourly_forecast': data.get('hourly', {}),  # input for agromet indicators
+                'utc_offset_seconds': data.get('utc_offset_seconds', 8 * 3600)  # of those local times
             }
         except Exception as e:
             print(f"Open-Meteo error: {e}")
@@ -123,6 +147,7 @@ class AgriculturalAPIs:
 
     # ==================== CROP/SOIL APIs ====================
 
+    @snapshot('agro_soil', ttl=3600)
     def get_soil_data(self, lat, lon):
         """
         Agromonitoring Soil API - Free tier available
@@ -131,7 +156,7 @@ class AgriculturalAPIs:
         url = f"http://api.agromonitoring.com/agro/1.0/soil?lat={lat}&lon={lon}&appid={self.agromonitoring_key}"
 
         try:
-            response = requests.get(url)
+            response = http_client.get(url)
             data = response.json()
 
             if response.status_code == 200:
@@ -144,6 +169,7 @@ class AgriculturalAPIs:
             print(f"Soil API error: {e}")
             return None
 
+    @snapshot('agro_ndvi', ttl=21600)
     def get_ndvi_data(self, polygon_id):
         """
         Agromonitoring NDVI (Normalized Difference Vegetation Index)
@@ -152,24 +178,49 @@ class AgriculturalAPIs:
         start_time = int((datetime.now() - timedelta(days=30)).timestamp())
         end_time = int(datetime.now().timestamp())
 
+        try:
+            return self.get_ndvi_history(polygon_id, start_time, end_time)
+        except Exception as e:
+            print(f"NDVI API error: {e}")
+            return None
+
+    def get_ndvi_history(self, polygon_id, start_time, end_time):
+        """
+        NDVI scenes for a polygon between two unix timestamps, oldest first.
+        Raises on network/API errors so batch callers can retry the field.
+        """
         url = f"http://api.agromonitoring.com/agro/1.0/ndvi/history?polyid={polygon_id}&start={start_time}&end={end_time}&appid={self.agromonitoring_key}"
 
-        try:
-            response = requests.get(url)
-            data = response.json()
+        response = http_client.get(url)
+        response.raise_for_status()
+
+        ndvi_values = []
+        for entry in response.json():
+            ndvi_values.append({
+                'date': datetime.fromtimestamp(entry['dt']).strftime('%Y-%m-%d'),
+                'dt': entry['dt'],
+                'ndvi_mean': entry['data']['mean'],
+                'ndvi_max': entry['data']['max'],
+                'ndvi_min': entry['data']['min'],
+                'cloud': entry.get('cl')
+            })
+        return sorted(ndvi_values, key=lambda v: v['dt'])
+
+    def list_polygons(self):
+        """All polygons registered on the Agromonitoring account"""
+        url = f"http://api.agromonitoring.com/agro/1.0/polygons?appid={self.agromonitoring_key}"
 
-            if response.status_code == 200:
-                ndvi_values = []
-                for entry in data:
-                    ndvi_values.append({
-                        'date': datetime.fromtimestamp(entry['dt']).strftime('%Y-%m-%d'),
-                        'ndvi_mean': entry['data']['mean'],
-                        'ndvi_max': entry['data']['max'],
-                        'ndvi_min': entry['data']['min']
-                    })
-                return ndvi_values
+        try:
+            response = http_client.get(url)
+            response.raise_for_status()
+            return [{
+                'polygon_id': polygon['id'],
+                'name': polygon['name'],
+                'area': polygon.get('area'),
+                'center': polygon.get('center')  # [lon, lat]
+            } for polygon in response.json()]
         except Exception as e:
-            print(f"NDVI API error: {e}")
+            print(f"Polygon list error: {e}")
             return None
 
     def create_polygon(self, name, coordinates):
@@ -207,9 +258,17 @@ class AgriculturalAPIs:
 
     def get_soilgrids_data(self, lat, lon):
         """
-        SoilGrids API - FREE, no key needed
-        Get detailed soil properties
+        SoilGrids - FREE, no key needed
+        Get detailed soil properties, from the local grid when it covers the point
         """
+        soil_info = self.soil_grid.lookup(lat, lon)
+        if soil_info:
+            return soil_info
+        return self._query_soilgrids(lat, lon)
+
+    @snapshot('soilgrids', ttl=30 * 86400)
+    def _query_soilgrids(self, lat, lon):
+        """SoilGrids REST API (slow, rate-limited) for points outside the local grid"""
         url = f"https://rest.isric.org/soilgrids/v2.0/properties/query"
         params = {
             'lon': lon,
@@ -220,7 +279,8 @@ class AgriculturalAPIs:
         }
 
         try:
-            response = requests.get(url, params=params)
+            response = http_client.get(url, params=params)
+            response.raise_for_status()
             data = response.json()
 
             soil_info = {}
@@ -235,6 +295,7 @@ class AgriculturalAPIs:
 
     # ==================== PEST & DISEASE APIs ====================
 
+    @snapshot('inat_taxa', ttl=7 * 86400)
     def search_pest_info(self, pest_name):
         """
         iNaturalist API - FREE
@@ -247,7 +308,7 @@ class AgriculturalAPIs:
         }
 
         try:
-            response = requests.get(url, params=params)
+            response = http_client.get(url, params=params)
             data = response.json()
 
             if data['results']:
@@ -263,10 +324,18 @@ class AgriculturalAPIs:
             print(f"Pest search error: {e}")
             return None
 
-    def get_pest_observations(self, lat, lon, radius_km=50):
+    def get_pest_observations(self, lat, lon, radius_km=50, days=30):
         """
-        Get recent pest observations near your location
+        Get recent pest observations near your location, from the local
+        index once it has been synced
         """
+        if self.pest_index.watermark:
+            return self.pest_index.recent_near(lat, lon, radius_km, days)
+        return self._query_pest_observations(lat, lon, radius_km)
+
+    @snapshot('inat_observations', ttl=21600)
+    def _query_pest_observations(self, lat, lon, radius_km=50):
+        """Live iNaturalist query, used until the local index has data"""
         url = "https://api.inaturalist.org/v1/observations"
         params = {
             'lat': lat,
@@ -279,7 +348,8 @@ class AgriculturalAPIs:
         }
 
         try:
-            response = requests.get(url, params=params)
+            response = http_client.get(url, params=params)
+            response.raise_for_status()
             data = response.json()
 
             observations = []
@@ -299,6 +369,7 @@ class AgriculturalAPIs:
 
     # ==================== NEWS & INFORMATION APIs ====================
 
+    @snapshot('newsapi', ttl=3600)
     def get_agricultural_news(self, query="agriculture", country="ph", days=7):
         """
         NewsAPI - Free tier: 100 requests/day
@@ -317,7 +388,7 @@ class AgriculturalAPIs:
         }
 
         try:
-            response = requests.get(url, params=params)
+            response = http_client.get(url, params=params)
             data = response.json()
 
             if response.status_code == 200:
@@ -336,6 +407,7 @@ class AgriculturalAPIs:
             print(f"News API error: {e}")
             return None
 
+    @snapshot('usda_nass', ttl=86400)
     def get_crop_prices_usda(self, commodity='CORN', year=2024):
         """
         USDA NASS API - FREE
@@ -352,7 +424,7 @@ class AgriculturalAPIs:
         }
 
         try:
-            response = requests.get(url, params=params)
+            response = http_client.get(url, params=params)
             data = response.json()
 
             if 'data' in data:
@@ -361,9 +433,11 @@ class AgriculturalAPIs:
             print(f"USDA API error: {e}")
             return None
 
-    def search_agricultural_papers(self, query):
+    def search_agricultural_papers(self, query, new_only=False):
         """
         Use RSS feeds from agricultural websites (FREE)
+        Feeds are refreshed in parallel with conditional GET; set new_only
+        to get just the entries that appeared since the previous refresh
         """
         feeds = [
             'https://www.agriculture.com/feed',
@@ -371,24 +445,20 @@ class AgriculturalAPIs:
             'http://www.fao.org/news/rss-feed/en/'
         ]
 
-        # You'll need feedparser: pip install feedparser
         try:
-            import feedparser
+            new_items = self.feeds.refresh(feeds)
 
             articles = []
             for feed_url in feeds:
-                feed = feedparser.parse(feed_url)
-                for entry in feed.entries[:3]:
+                entries = new_items[feed_url] if new_only else self.feeds.latest(feed_url, limit=3)
+                for entry in entries:
                     articles.append({
-                        'title': entry.title,
-                        'link': entry.link,
-                        'published': entry.get('published', 'N/A')
+                        'title': entry['title'],
+                        'link': entry['link'],
+                        'published': entry['published']
                     })
 
             return articles
-        except ImportError:
-            print("Install feedparser: pip install feedparser")
-            return None
         except Exception as e:
             print(f"RSS feed error: {e}")
             return None
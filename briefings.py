@@ -0,0 +1,199 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import hashlib
+import json
+import time
+import os
+from data_store import file_lock
+from philippine_apis import REGION_COORDS, REGION_NAMES
+
+
+PH_TIME = timezone(timedelta(hours=8))
+
+
+class BriefingService:
+    """
+    Short LLM weather briefings, one per region, shared by every farmer
+    and worker process.
+
+    refresh() walks the 17 regions and fingerprints the data each briefing
+    is written from (the regional daily forecast, the PAGASA cyclone
+    bulletins and forecast headlines). Only when that fingerprint changes
+    is a new briefing generated and stored in the snapshot store, so the
+    model runs once per region per weather update instead of once per
+    question. The fingerprint deliberately leaves out current conditions
+    and fetch timestamps, which change on every fetch without changing
+    the forecast. Only one process on the host generates at a time (a
+    file lock); the others serve what it stored.
+
+    Briefings are written in Tagalog and name days by date, and are only
+    served while their first forecast day is still today.
+    """
+
+    SOURCE = 'briefing'
+    LANGUAGE = 'tl'
+
+    def __init__(self, ph_apis, generate, store=None, interval=None, max_age=6 * 3600):
+        self.ph_apis = ph_apis
+        self.generate = generate  # prompt -> text or None
+        self.store = store or ph_apis.store
+        if interval is None:
+            interval = int(os.getenv('AGRIAID_BRIEFING_INTERVAL', '1800'))
+        self.interval = interval
+        self.max_age = max_age
+        self.lock_path = os.path.join(os.getenv('AGRIAID_DATA_DIR', 'data'), 'briefings.lock')
+        self.lock = threading.Lock()
+        self.stats = {'generated': 0, 'unchanged': 0, 'served': 0, 'spliced': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    # ==================== INPUTS ====================
+
+    def inputs(self, region):
+        """The data a region's briefing is written from, or None if the forecast is unavailable"""
+        weather = self.ph_apis.get_regional_weather(region)
+        if not isinstance(weather, dict):
+            return None
+
+        daily = weather['forecast']
+        days = [
+            {'date': date, 'max': daily['temperature_2m_max'][i], 'min': daily['temperature_2m_min'][i],
+             'rain': daily['precipitation_sum'][i]}
+            for i, date in enumerate(daily.get('time', [])[:3])
+        ]
+
+        typhoon = self.ph_apis.get_pagasa_tropical_cyclone_info()
+        bulletins = [b['content'][:400] for b in typhoon] if isinstance(typhoon, list) else []
+
+        forecasts = self.ph_apis.get_pagasa_weather_forecast() or []
+        headlines = [f['title'] for f in forecasts[:2]]
+
+        return {'region': region, 'days': days, 'bulletins': bulletins, 'pagasa': headlines}
+
+    @staticmethod
+    def fingerprint(inputs):
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _prompt(self, inputs):
+        name = REGION_NAMES.get(inputs['region'], inputs['region'])
+        lines = [f"{datetime.strptime(d['date'], '%Y-%m-%d'):%a %d %b}: {d['min']}-{d['max']}°C, rain {d['rain']} mm"
+                 for d in inputs['days']]
+        if inputs['bulletins']:
+            lines += [f"PAGASA bulletin: {b}" for b in inputs['bulletins']]
+        else:
+            lines.append("No active tropical cyclones")
+        lines += [f"PAGASA: {title}" for title in inputs['pagasa']]
+
+        return (
+            f"Write a weather briefing for farmers in {name} (Region {inputs['region']}) in 3 to 4 short "
+            f"sentences, in Tagalog with key English terms. Cover the coming days' rain and temperature, "
+            f"naming each day by its date as listed (never 'today' or 'tomorrow'), any typhoon warning, "
+            f"and one practical farm action.\n"
+            + '\n'.join(lines)
+        )
+
+    # ==================== GENERATION ====================
+
+    def refresh_region(self, region):
+        """Regenerate one region's briefing if its data changed; returns True when regenerated"""
+        inputs = self.inputs(region)
+        if inputs is None:
+            return False
+        digest = self.fingerprint(inputs)
+
+        # Read from disk: another worker may already have written this version
+        current = self.store.get(self.SOURCE, region)
+        if current and current['payload'].get('data_version') == digest:
+            # Same data, same briefing: re-stamp it before get() would
+            # start treating it as expired
+            if time.time() - current['payload']['generated_at'] > self.max_age - self.interval:
+                self.store.put(self.SOURCE, region, dict(current['payload'], generated_at=time.time()))
+            self.record('unchanged')
+            return False
+
+        text = self.generate(self._prompt(inputs))
+        if not text or not text.strip():
+            return False
+
+        self.store.put(self.SOURCE, region, {
+            'region': region,
+            'text': text.strip(),
+            'data_version': digest,
+            'generated_at': time.time(),
+            'language': self.LANGUAGE,
+            'forecast_dates': [d['date'] for d in inputs['days']]
+        })
+        self.record('generated')
+        return True
+
+    def refresh(self, regions=None):
+        """
+        One pass over the regions; returns how many briefings were regenerated.
+        Skipped while another process on the host is already running a pass.
+        """
+        regenerated = 0
+        with file_lock(self.lock_path, blocking=False) as acquired:
+            if not acquired:
+                return 0
+            for region in regions or REGION_COORDS:
+                try:
+                    regenerated += self.refresh_region(region)
+                except Exception as e:
+                    print(f"Briefing error ({region}): {e}")
+        return regenerated
+
+    def _run(self):
+        while True:
+            self.refresh()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """Refresh now and then every interval seconds in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='briefings', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ==================== SERVING ====================
+
+    def get(self, region):
+        """Latest briefing for a region if it is recent and its forecast starts today (PH time), else None"""
+        if not region:
+            return None
+        region = region.upper()
+        # Always read from disk: the briefing may have been regenerated by another worker
+        snapshot = self.store.get(self.SOURCE, region)
+        if not snapshot or time.time() - snapshot['payload']['generated_at'] > self.max_age:
+            return None
+        today = datetime.now(PH_TIME).strftime('%Y-%m-%d')
+        if snapshot['payload'].get('forecast_dates', [None])[:1] != [today]:
+            return None
+        return snapshot['payload']
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    from philippine_apis import PhilippineAgriculturalAPIs
+
+    calls = []
+
+    def fake_generate(prompt):
+        calls.append(prompt)
+        return f"Briefing #{len(calls)}"
+
+    service = BriefingService(PhilippineAgriculturalAPIs(), fake_generate)
+    print(f"First pass: {service.refresh(['III', 'VII'])} regenerated")
+    print(f"Second pass: {service.refresh(['III', 'VII'])} regenerated (data unchanged)")
+    briefing = service.get('III')
+    if briefing:
+        print(f"Region III ({datetime.fromtimestamp(briefing['generated_at']):%H:%M}): {briefing['text']}")
+    print(f"Stats: {service.stats}")
+    if calls:
+        print(f"\nPrompt:\n{calls[0]}")
@@ -0,0 +1,136 @@
+import threading
+import atexit
+import zlib
+import json
+import time
+import os
+
+
+class Checkpointer:
+    """
+    Periodic checkpoint of the process's hot in-memory state, restored at
+    boot so a deploy or crash does not start from cold caches.
+
+    Components are any objects with checkpoint_state() (JSON-serializable)
+    and restore_state(state). Their states are written together to one
+    zlib-compressed JSON file, replaced atomically. Nothing is trusted
+    blindly after a restore: snapshots keep their fetched_at and are only
+    served while fresher than their TTL (older ones are revalidated by the
+    read-through path), and cached parses are reused only when the page
+    body hash still matches.
+    """
+
+    VERSION = 1
+
+    def __init__(self, components, path=None, interval=None, max_age=7 * 86400):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.path = path or os.path.join(data_dir, 'warm_state.json.z')
+        self.components = components  # name -> component
+        if interval is None:
+            interval = int(os.getenv('AGRIAID_CHECKPOINT_INTERVAL', '300'))
+        self.interval = interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def save(self):
+        """Write every component's state; returns the file size in bytes, or None"""
+        try:
+            state = {'version': self.VERSION, 'saved_at': time.time(),
+                     'components': {name: component.checkpoint_state() for name, component in self.components.items()}}
+            data = zlib.compress(json.dumps(state, separators=(',', ':'), default=str).encode('utf-8'), 1)
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            return len(data)
+        except Exception as e:
+            print(f"Checkpoint save error: {e}")
+            return None
+
+    def restore(self):
+        """Load the last checkpoint into the components; returns {name: restored count}"""
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Checkpoint load error: {e}")
+            return {}
+
+        if state.get('version') != self.VERSION or time.time() - state.get('saved_at', 0) > self.max_age:
+            return {}
+
+        restored = {}
+        for name, component_state in state['components'].items():
+            component = self.components.get(name)
+            if component is None:
+                continue
+            try:
+                restored[name] = component.restore_state(component_state)
+            except Exception as e:
+                print(f"Checkpoint restore error ({name}): {e}")
+        return restored
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.save()
+
+    def start(self):
+        """Checkpoint every interval seconds in a background thread, and once more at exit"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='checkpoint', daemon=True)
+            self._thread.start()
+            atexit.register(self.save)
+
+    def stop(self):
+        self._stop.set()
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    import random
+    import tempfile
+    from data_store import SnapshotStore
+    from relevance_index import BM25Index
+    from scraper import PageScraper
+
+    random.seed(2)
+    vocabulary = [f"word{i}" for i in range(3000)]
+    texts = [' '.join(random.choices(vocabulary, k=60)) for _ in range(3000)]
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = SnapshotStore(db_path=os.path.join(data_dir, 'snapshots.db'))
+        for i in range(300):
+            store.put('open_meteo', f"[[{i}], {{}}]", {'hourly': {'temperature_2m': [random.random() for _ in range(168)]}})
+        index = BM25Index()
+        for i, text in enumerate(texts):
+            index.add(f"doc{i}", text, {'title': f"Item {i}"})
+        scraper = PageScraper(parse_workers=0)
+        for i in range(50):
+            scraper.cache[(f"https://www.da.gov.ph/page/{i}/", 'parse_advisory_listing')] = ('0' * 40, [{'title': 'x' * 80}] * 10)
+
+        path = os.path.join(data_dir, 'warm_state.json.z')
+        start = time.perf_counter()
+        size = Checkpointer({'snapshots': store, 'bm25': index, 'scraper': scraper}, path=path).save()
+        print(f"Saved {size / 1024:.0f} KB in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        restored_index = BM25Index()
+        components = {'snapshots': SnapshotStore(db_path=os.path.join(data_dir, 'snapshots.db')),
+                      'bm25': restored_index, 'scraper': PageScraper(parse_workers=0)}
+        start = time.perf_counter()
+        restored = Checkpointer(components, path=path).restore()
+        print(f"Restored {restored} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        start = time.perf_counter()
+        rebuilt = BM25Index()
+        for i, text in enumerate(texts):
+            rebuilt.add(f"doc{i}", text, {'title': f"Item {i}"})
+        print(f"(Rebuilding the index from text instead: {(time.perf_counter() - start) * 1000:.0f} ms)")
+        assert restored_index.search('word1 word2') and len(restored_index) == len(index)
@@ -0,0 +1,144 @@
+import threading
+from token_budget import count_tokens
+
+
+class ConversationHistory:
+    """
+    Conversation memory that keeps the farmer's raw words apart from the
+    real-time data block.
+
+    Only the current turn is sent with its [REAL-TIME AGRICULTURAL DATA];
+    earlier turns are replayed as plain text, newest first, under a token
+    budget. Older turns are shortened, and turns that no longer fit are
+    dropped -- or, when a summarizer is given, folded into a running
+    summary in a background thread so the reply never waits for it.
+    """
+
+    def __init__(self, budget_tokens=800, max_turns=10, truncate_chars=300, summarizer=None):
+        self.budget_tokens = budget_tokens
+        self.max_turns = max_turns
+        self.truncate_chars = truncate_chars
+        self.summarizer = summarizer  # callable(previous summary, [turns]) -> summary text
+        self.lock = threading.Lock()
+        self.turns = []  # {'role', 'content'} with raw text only
+        self.summary = ''
+        self._pending = []  # dropped turns waiting to be folded into the summary
+        self._summarizing = False
+        self.generation = 0  # bumped by reset(); summaries of an older conversation are discarded
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add(self, role, content):
+        """Record a turn (raw user text or assistant reply, never the data block)"""
+        with self.lock:
+            self.turns.append({'role': role, 'content': content})
+            overflow = self.turns[:-self.max_turns] if len(self.turns) > self.max_turns else []
+            if overflow:
+                self.turns = self.turns[-self.max_turns:]
+            generation = self.generation
+
+        if overflow:
+            self._fold(overflow, generation)
+
+    def last_user_text(self):
+        """Raw text of the most recent user turn, or ''"""
+        with self.lock:
+            for turn in reversed(self.turns):
+                if turn['role'] == 'user':
+                    return turn['content']
+        return ''
+
+    def reset(self):
+        with self.lock:
+            self.turns = []
+            self.summary = ''
+            self._pending = []
+            self.generation += 1
+
+    # ==================== COMPACTION ====================
+
+    def _fold(self, dropped, generation):
+        """Fold dropped turns (of conversation `generation`) into the summary off the request path"""
+        if not self.summarizer:
+            return
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._pending.extend(dropped)
+            if self._summarizing:
+                return
+            self._summarizing = True
+
+        def run():
+            while True:
+                with self.lock:
+                    batch, self._pending = self._pending, []
+                    previous = self.summary
+                    generation = self.generation
+                    if not batch:
+                        self._summarizing = False
+                        return
+                try:
+                    summary = self.summarizer(previous, batch)
+                    if summary:
+                        with self.lock:
+                            # A reset() while summarizing started a new conversation
+                            if generation == self.generation:
+                                self.summary = summary.strip()
+                except Exception as e:
+                    print(f"History summary error: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _shorten(self, text):
+        if len(text) <= self.truncate_chars:
+            return text
+        return text[:self.truncate_chars].rsplit(' ', 1)[0] + '...'
+
+    def build_prompt(self, context_text='', max_tokens=None):
+        """
+        Prompt text for the model: optional summary, earlier turns that fit
+        the budget (the latest exchange in full, older ones shortened), then
+        the current user turn with this turn's real-time data appended.
+        max_tokens tightens the budget for this turn only (turns left out
+        for it are kept for later turns).
+        """
+        with self.lock:
+            turns = list(self.turns)
+            summary = self.summary
+            generation = self.generation
+
+        if not turns:
+            return context_text
+
+        current = turns[-1]
+        current_line = f"{current['role']}: {current['content']}{context_text if current['role'] == 'user' else ''}\n"
+
+        summary_line = f"system: Earlier in this conversation: {summary}\n" if summary else ''
+        if max_tokens is not None:
+            max_tokens -= count_tokens(summary_line)
+
+        lines = []
+        used = 0
+        earlier = turns[:-1]
+        for position, turn in enumerate(reversed(earlier)):
+            # Keep the previous exchange (2 turns) verbatim, shorten anything older
+            content = turn['content'] if position < 2 else self._shorten(turn['content'])
+            line = f"{turn['role']}: {content}\n"
+            cost = count_tokens(line)
+            if max_tokens is not None and used + cost > max_tokens and used + cost <= self.budget_tokens:
+                break
+            if used + cost > self.budget_tokens:
+                # Everything from here back is out of budget: drop it for good
+                # (into the next summary, if we have a summarizer)
+                dropped = earlier[:len(earlier) - position]
+                with self.lock:
+                    self.turns = [t for t in self.turns if not any(t is d for d in dropped)]
+                self._fold(dropped, generation)
+                break
+            lines.append(line)
+            used += cost
+
+        return summary_line + ''.join(reversed(lines)) + current_line
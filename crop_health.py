@@ -0,0 +1,360 @@
+import numpy as np
+from philippine_apis import REGION_COORDS
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import warnings
+import json
+import time
+import os
+
+
+DAY = 86400
+
+
+def nearest_region(center):
+    """Region code whose representative point is closest to a [lon, lat] center"""
+    if not center:
+        return None
+    lon, lat = center
+    return min(REGION_COORDS, key=lambda code: (REGION_COORDS[code][0] - lat) ** 2 + (REGION_COORDS[code][1] - lon) ** 2)
+
+
+class CropHealthMonitor:
+    """
+    NDVI crop-health tracking for many Agromonitoring polygons at once.
+
+    Each field keeps its NDVI history as two NumPy arrays (scene day and
+    mean NDVI). refresh() fetches only the days since each field's last
+    fetch, plus a REFETCH_DAYS overlap for scenes the provider publishes
+    late, with at most max_concurrency requests in flight. analyze()
+    lays every field onto one fields x days matrix and computes the
+    rolling statistics in a single vectorized pass: recent vs. baseline
+    mean, z-score against the baseline spread, and a least-squares slope
+    over the recent window. Fields whose vigor is falling are flagged for
+    the chat context.
+    """
+
+    REFETCH_DAYS = 7  # scenes can show up days after their acquisition date
+
+    def __init__(self, apis, path=None, max_concurrency=4, history_days=120, max_cloud=60,
+                 recent_days=14, baseline_days=45, interval=None):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.path = path or os.path.join(data_dir, 'ndvi_fields.npz')
+        self.apis = apis
+        self.max_concurrency = max_concurrency
+        self.history_days = history_days
+        self.max_cloud = max_cloud
+        self.recent_days = recent_days
+        self.baseline_days = baseline_days
+        if interval is None:
+            interval = int(os.getenv('AGRIAID_NDVI_INTERVAL', '43200'))
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.fields = {}  # polygon_id -> {'name', 'region', 'crop', 'area', 'center', 'fetched_until'}
+        self.series = {}  # polygon_id -> (days int32, ndvi float32), sorted by day
+        self._analysis = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.load()
+
+    def __len__(self):
+        return len(self.fields)
+
+    # ==================== FIELDS ====================
+
+    def register_field(self, polygon_id, name, region=None, crop=None, area=None, center=None):
+        with self.lock:
+            field = self.fields.setdefault(polygon_id, {'fetched_until': None, 'region': None, 'crop': None})
+            # Keep a region/crop set earlier when re-registering without one
+            field.update({'name': name, 'region': region or field.get('region'), 'crop': crop or field.get('crop'),
+                          'area': area, 'center': center})
+            self.series.setdefault(polygon_id, (np.empty(0, np.int32), np.empty(0, np.float32)))
+
+    def import_polygons(self, region=None, crop=None):
+        """
+        Register every polygon on the account and save; returns how many were
+        new. Without a region, each polygon gets the region nearest its center.
+        """
+        polygons = self.apis.list_polygons()
+        if polygons is None:
+            return 0
+        new = 0
+        for polygon in polygons:
+            if polygon['polygon_id'] not in self.fields:
+                new += 1
+            self.register_field(polygon['polygon_id'], polygon['name'], region or nearest_region(polygon.get('center')),
+                                crop, polygon.get('area'), polygon.get('center'))
+        if new:
+            self.save()
+        return new
+
+    def create_fields(self, specs):
+        """
+        Create and register polygons in bounded-concurrency batches.
+        specs: [{'name', 'coordinates', 'region', 'crop'}]; returns the created ids
+        """
+        def create(spec):
+            return spec, self.apis.create_polygon(spec['name'], spec['coordinates'])
+
+        created = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for spec, polygon in executor.map(create, specs):
+                if polygon:
+                    self.register_field(polygon['polygon_id'], polygon['name'], spec.get('region'),
+                                        spec.get('crop'), polygon.get('area'))
+                    created.append(polygon['polygon_id'])
+        self.save()
+        return created
+
+    # ==================== FETCHING ====================
+
+    def _fetch(self, polygon_id, now):
+        """New scenes for one field since its last fetch; returns (id, scenes or None)"""
+        with self.lock:
+            fetched_until = self.fields[polygon_id]['fetched_until']
+        start = now - self.history_days * DAY
+        if fetched_until:
+            # Re-read the last few days; _merge keeps one value per day
+            start = max(start, fetched_until - self.REFETCH_DAYS * DAY)
+        try:
+            return polygon_id, self.apis.get_ndvi_history(polygon_id, start, now)
+        except Exception as e:
+            print(f"NDVI fetch error ({polygon_id}): {e}")
+            return polygon_id, None
+
+    def _merge(self, polygon_id, scenes, now):
+        with self.lock:
+            days, ndvi = self.series[polygon_id]
+            clear = [s for s in scenes if s['cloud'] is None or s['cloud'] <= self.max_cloud]
+            if clear:
+                new_days = np.array([s['dt'] // DAY for s in clear], np.int32)
+                new_ndvi = np.array([s['ndvi_mean'] for s in clear], np.float32)
+                days = np.concatenate([days, new_days])
+                ndvi = np.concatenate([ndvi, new_ndvi])
+                # One value per day, the latest scene winning
+                order = np.argsort(days, kind='stable')
+                days, ndvi = days[order], ndvi[order]
+                last = np.r_[days[1:] != days[:-1], True]
+                days, ndvi = days[last], ndvi[last]
+                cutoff = now // DAY - self.history_days
+                keep = days >= cutoff
+                self.series[polygon_id] = (days[keep], ndvi[keep])
+            self.fields[polygon_id]['fetched_until'] = now
+
+    def refresh(self, polygon_ids=None):
+        """Fetch new NDVI scenes for all (or the given) fields; returns how many fields updated"""
+        now = int(time.time())
+        polygon_ids = list(polygon_ids or self.fields)
+        updated = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for polygon_id, scenes in executor.map(lambda pid: self._fetch(pid, now), polygon_ids):
+                if scenes is not None:
+                    self._merge(polygon_id, scenes, now)
+                    updated += 1
+
+        with self.lock:
+            self._analysis = None
+        if updated:
+            self.save()
+        return updated
+
+    def _run(self):
+        while True:
+            # Pick up polygons added on the account since the last pass
+            if self.apis.agromonitoring_key:
+                self.import_polygons()
+            if self.fields:
+                self.refresh()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """Import polygons and refresh now, then every interval seconds in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ndvi-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ==================== ANALYSIS ====================
+
+    def matrix(self, today=None):
+        """(ids, fields x days NDVI matrix with NaN gaps, first day) over the analysis window"""
+        end = today or int(time.time()) // DAY
+        start = end - self.baseline_days - self.recent_days + 1
+        with self.lock:
+            ids = list(self.series)
+            grid = np.full((len(ids), end - start + 1), np.nan, np.float32)
+            for i, polygon_id in enumerate(ids):
+                days, ndvi = self.series[polygon_id]
+                inside = (days >= start) & (days <= end)
+                grid[i, days[inside] - start] = ndvi[inside]
+        return ids, grid, start
+
+    def analyze(self, today=None, z_threshold=-2.0, drop_threshold=-0.15, slope_threshold=-0.005,
+                declining_z=-1.0, trend_days=30, min_points=5):
+        """
+        Per-field statistics computed across all fields at once: recent and
+        baseline mean NDVI, relative change, z-score, slope (NDVI/day) and
+        flags 'anomaly' (sharp drop) / 'declining' (steady downward trend).
+        A slope fitted to two or three noisy scenes is easily steep, so the
+        trend is fitted over the last trend_days, and 'declining' needs
+        min_points clear scenes in it and a recent mean already below the
+        baseline (z < declining_z).
+        """
+        ids, grid, _ = self.matrix(today)
+        if not ids:
+            return []
+
+        baseline = grid[:, :self.baseline_days]
+        recent = grid[:, self.baseline_days:]
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            # Fields with no clear scene in a window are all-NaN rows
+            warnings.simplefilter('ignore', RuntimeWarning)
+            base_mean = np.nanmean(baseline, axis=1)
+            base_std = np.nanstd(baseline, axis=1)
+            recent_mean = np.nanmean(recent, axis=1)
+
+            change = (recent_mean - base_mean) / base_mean
+            z = (recent_mean - base_mean) / np.maximum(base_std, 0.02)
+
+            # Least-squares slope over the trend window, ignoring cloud gaps
+            trend = grid[:, -trend_days:]
+            x = np.arange(trend.shape[1], dtype=np.float32)
+            valid = ~np.isnan(trend)
+            n = valid.sum(axis=1)
+            xs = np.where(valid, x, 0).sum(axis=1)
+            ys = np.where(valid, trend, 0).sum(axis=1)
+            xy = np.where(valid, x * trend, 0).sum(axis=1)
+            xx = np.where(valid, x * x, 0).sum(axis=1)
+            slope = np.where(n >= 3, (n * xy - xs * ys) / (n * xx - xs * xs), np.nan)
+
+        anomaly = (z < z_threshold) | (change < drop_threshold)
+        declining = (n >= min_points) & (slope < slope_threshold) & (z < declining_z)
+
+        results = []
+        with self.lock:
+            for i, polygon_id in enumerate(ids):
+                field = self.fields[polygon_id]
+                flags = [name for name, mask in (('anomaly', anomaly), ('declining', declining)) if mask[i]]
+                results.append({
+                    'polygon_id': polygon_id,
+                    'name': field['name'],
+                    'region': field.get('region'),
+                    'crop': field.get('crop'),
+                    'ndvi_recent': None if np.isnan(recent_mean[i]) else round(float(recent_mean[i]), 3),
+                    'ndvi_baseline': None if np.isnan(base_mean[i]) else round(float(base_mean[i]), 3),
+                    'change_pct': None if np.isnan(change[i]) else round(float(change[i]) * 100, 1),
+                    'z': None if np.isnan(z[i]) else round(float(z[i]), 2),
+                    'slope_per_week': None if np.isnan(slope[i]) else round(float(slope[i]) * 7, 3),
+                    'flags': flags
+                })
+        return results
+
+    def declining_fields(self, region=None, limit=5):
+        """Flagged fields, worst first (cached until the next refresh)"""
+        with self.lock:
+            analysis = self._analysis
+        if analysis is None:
+            analysis = self.analyze()
+            with self.lock:
+                self._analysis = analysis
+
+        flagged = [f for f in analysis if f['flags'] and (not region or not f['region'] or
+                                                        f['region'].upper() == region.upper())]
+        flagged.sort(key=lambda f: (f['z'] if f['z'] is not None else 0, f['slope_per_week'] or 0))
+        return flagged[:limit]
+
+    # ==================== STORE ====================
+
+    def save(self):
+        """Write fields and series to one .npz file atomically"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                arrays = {'fields': np.array(json.dumps(self.fields))}
+                for i, polygon_id in enumerate(self.series):
+                    arrays[f"days_{i}"], arrays[f"ndvi_{i}"] = self.series[polygon_id]
+                arrays['order'] = np.array(json.dumps(list(self.series)))
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"NDVI store save error: {e}")
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                fields = json.loads(str(data['fields']))
+                order = json.loads(str(data['order']))
+                series = {polygon_id: (data[f"days_{i}"], data[f"ndvi_{i}"]) for i, polygon_id in enumerate(order)}
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"NDVI store load error: {e}")
+            return
+        with self.lock:
+            self.fields, self.series = fields, series
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    class SyntheticNDVI:
+        """Stands in for AgriculturalAPIs: a 5-day revisit with noise, some fields failing"""
+
+        def __init__(self, n_fields):
+            self.rng = np.random.default_rng(5)
+            self.failing = set(range(0, n_fields, 25))
+            self.requests = 0
+            self.scenes = 0
+
+        def get_ndvi_history(self, polygon_id, start, end):
+            self.requests += 1
+            index = int(polygon_id.split('-')[1])
+            scenes = []
+            for dt in range(start - start % (5 * DAY), end, 5 * DAY):
+                if dt < start:
+                    continue
+                age = (end - dt) / DAY
+                value = 0.7 + 0.02 * self.rng.standard_normal()
+                if index in self.failing and age < 20:
+                    value -= 0.015 * (20 - age)
+                scenes.append({'dt': dt, 'ndvi_mean': value, 'cloud': float(self.rng.uniform(0, 80))})
+            self.scenes += len(scenes)
+            return scenes
+
+    n_fields = 500
+    apis = SyntheticNDVI(n_fields)
+    if os.path.exists('/tmp/ndvi_benchmark.npz'):
+        os.remove('/tmp/ndvi_benchmark.npz')
+    monitor = CropHealthMonitor(apis, path='/tmp/ndvi_benchmark.npz', max_concurrency=8)
+    for i in range(n_fields):
+        monitor.register_field(f"field-{i}", f"Field {i}", region='III', crop='rice')
+
+    start = time.perf_counter()
+    monitor.refresh()
+    print(f"Initial fetch: {n_fields} fields, {apis.requests} requests, {apis.scenes} scenes "
+          f"in {time.perf_counter() - start:.2f}s")
+    apis.scenes = 0
+    monitor.refresh()
+    print(f"Incremental fetch: {apis.scenes} scenes (only the {monitor.REFETCH_DAYS}-day overlap "
+          f"before each field's last fetch)")
+
+    reloaded = CropHealthMonitor(apis, path='/tmp/ndvi_benchmark.npz')
+    print(f"Reloaded {len(reloaded)} fields from {reloaded.path}")
+
+    start = time.perf_counter()
+    analysis = monitor.analyze()
+    print(f"Vectorized analysis of {len(analysis)} fields: {(time.perf_counter() - start) * 1000:.1f} ms")
+    flagged = monitor.declining_fields(limit=100)
+    healthy = [f for f in flagged if int(f['polygon_id'].split('-')[1]) not in apis.failing]
+    print(f"Flagged {len(flagged)} fields (synthetic failing fields: {len(apis.failing)}, "
+          f"healthy fields flagged: {len(healthy)})")
+    for field in flagged[:3]:
+        print(f"- {field['name']}: NDVI {field['ndvi_recent']} vs {field['ndvi_baseline']} "
+              f"({field['change_pct']}%), z {field['z']}, {field['slope_per_week']}/week {field['flags']}")
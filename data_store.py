@@ -0,0 +1,265 @@
+import sqlite3
+import functools
+import contextlib
+import hashlib
+import threading
+import json
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process deployments only
+    fcntl = None
+
+
+class SnapshotStore:
+    """
+    Persistent snapshot store for upstream data, shared by all worker
+    processes on the host.
+
+    Backed by SQLite in WAL mode: any number of readers run concurrently
+    with one writer, and writers are serialized with BEGIN IMMEDIATE.
+    Each (source, key) keeps its last few versions; a new version is only
+    written when the payload actually changes. Reads go through an
+    in-process hot map, which warm_start() fills from the last good
+    snapshots at boot.
+
+    When a fetch fails (or AGRIAID_OFFLINE=1) the last good snapshot is
+    served, however old, so the bot keeps working when rural connectivity
+    to the government sites drops.
+    """
+
+    def __init__(self, db_path=None, keep_versions=5, offline=None):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.db_path = db_path or os.path.join(data_dir, 'snapshots.db')
+        self.keep_versions = keep_versions
+        if offline is None:
+            offline = os.getenv('AGRIAID_OFFLINE', '0') == '1'
+        self.offline = offline
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hot = {}  # (source, key) -> {'payload', 'fetched_at', 'version', 'digest'}
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                source TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                digest TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (source, key, version)
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    def _key_lock(self, source, key):
+        with self.lock:
+            return self.key_locks.setdefault((source, key), threading.Lock())
+
+    # ==================== SNAPSHOTS ====================
+
+    def get(self, source, key):
+        """Latest snapshot on disk as a dict (payload, fetched_at, version, digest) or None"""
+        row = self._conn().execute(
+            "SELECT payload, fetched_at, version, digest FROM snapshots "
+            "WHERE source = ? AND key = ? ORDER BY version DESC LIMIT 1",
+            (source, key)
+        ).fetchone()
+        if row is None:
+            return None
+
+        snapshot = {'payload': json.loads(row[0]), 'fetched_at': row[1], 'version': row[2], 'digest': row[3]}
+        with self.lock:
+            self.hot[(source, key)] = snapshot
+        return snapshot
+
+    def put(self, source, key, payload):
+        """Store a fetched payload; returns its version (unchanged payloads keep theirs)"""
+        text = json.dumps(payload, sort_keys=True, default=str)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        now = time.time()
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT version, digest FROM snapshots WHERE source = ? AND key = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (source, key)
+            ).fetchone()
+
+            if row and row[1] == digest:
+                version = row[0]
+                conn.execute(
+                    "UPDATE snapshots SET fetched_at = ? WHERE source = ? AND key = ? AND version = ?",
+                    (now, source, key, version)
+                )
+            else:
+                version = (row[0] + 1) if row else 1
+                conn.execute(
+                    "INSERT INTO snapshots (source, key, version, fetched_at, digest, payload) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (source, key, version, now, digest, text)
+                )
+                conn.execute(
+                    "DELETE FROM snapshots WHERE source = ? AND key = ? AND version <= ?",
+                    (source, key, version - self.keep_versions)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self.lock:
+            self.hot[(source, key)] = {'payload': payload, 'fetched_at': now, 'version': version, 'digest': digest}
+        return version
+
+    def history(self, source, key):
+        """All retained versions, newest first, as (version, fetched_at, payload)"""
+        rows = self._conn().execute(
+            "SELECT version, fetched_at, payload FROM snapshots WHERE source = ? AND key = ? "
+            "ORDER BY version DESC",
+            (source, key)
+        ).fetchall()
+        return [(version, fetched_at, json.loads(payload)) for version, fetched_at, payload in rows]
+
+    def peek(self, source, key, ttl=None):
+        """In-memory snapshot without any I/O; only returned if fresher than ttl (when given)"""
+        with self.lock:
+            snapshot = self.hot.get((source, key))
+        if snapshot and (ttl is None or time.time() - snapshot['fetched_at'] < ttl):
+            return snapshot
+        return None
+
+    def warm_start(self):
+        """Load the latest snapshot of every (source, key) into memory; returns the count"""
+        rows = self._conn().execute(
+            "SELECT s.source, s.key, s.payload, s.fetched_at, s.version, s.digest FROM snapshots s "
+            "JOIN (SELECT source, key, MAX(version) AS version FROM snapshots GROUP BY source, key) latest "
+            "ON s.source = latest.source AND s.key = latest.key AND s.version = latest.version"
+        ).fetchall()
+
+        with self.lock:
+            for source, key, payload, fetched_at, version, digest in rows:
+                self.hot[(source, key)] = {
+                    'payload': json.loads(payload), 'fetched_at': fetched_at, 'version': version, 'digest': digest
+                }
+        return len(rows)
+
+    def checkpoint_state(self):
+        """The hot map, for the warm-start checkpoint"""
+        with self.lock:
+            return [[source, key, snapshot] for (source, key), snapshot in self.hot.items()]
+
+    def restore_state(self, state):
+        """Load checkpointed snapshots, keeping whichever copy was fetched last; returns the count"""
+        with self.lock:
+            for source, key, snapshot in state:
+                current = self.hot.get((source, key))
+                if current is None or current['fetched_at'] < snapshot['fetched_at']:
+                    self.hot[(source, key)] = snapshot
+        return len(state)
+
+    # ==================== READ-THROUGH ====================
+
+    def read_through(self, source, key, ttl, fetch, valid=None):
+        """
+        Return a payload no older than ttl seconds, fetching only when
+        neither this process nor another worker has a fresh one. A fetch
+        returning None, or a payload valid(payload) rejects, counts as a
+        failure and the last good snapshot is served instead.
+        """
+        snapshot = self.peek(source, key, ttl)
+        if snapshot:
+            return snapshot['payload']
+
+        with self._key_lock(source, key):
+            # Another thread or worker process may have refreshed it meanwhile
+            snapshot = self.get(source, key)
+            if snapshot and (self.offline or time.time() - snapshot['fetched_at'] < ttl):
+                return snapshot['payload']
+            if self.offline:
+                return None
+
+            payload = fetch()
+            if payload is None or (valid is not None and not valid(payload)):
+                if snapshot:
+                    print(f"Serving last good {source} snapshot (v{snapshot['version']})")
+                    return snapshot['payload']
+                return None
+
+            try:
+                self.put(source, key, payload)
+            except Exception as e:
+                print(f"Snapshot store error: {e}")
+            return payload
+
+
+def snapshot(source, ttl, valid=None):
+    """
+    Decorator for API methods: read through self.store, keyed by the call
+    arguments, with a freshness window of ttl seconds. valid(payload)
+    rejects answers that are not worth storing (e.g. an empty list from a
+    site that always lists something); None is always a failure.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            store = getattr(self, 'store', None)
+            if store is None:
+                return method(self, *args, **kwargs)
+            key = json.dumps([args, kwargs], sort_keys=True, default=str)
+            return store.read_through(source, key, ttl, lambda: method(self, *args, **kwargs), valid)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+    """
+    Advisory lock shared by all worker processes on the host, held for the
+    with-block. Yields whether it was acquired (always True when blocking).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        acquired = True
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired and fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    store = SnapshotStore()
+    print(f"Warm start: {store.warm_start()} snapshots loaded from {store.db_path}")
+    for (source, key), snap in sorted(store.hot.items()):
+        age = (time.time() - snap['fetched_at']) / 60
+        print(f"- {source} {key[:40]} v{snap['version']} ({age:.0f} min old)")
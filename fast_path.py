@@ -0,0 +1,237 @@
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from philippine_apis import REGION_NAMES
+
+
+# Tagalog / English names -> key in the price table (category, item or None for all).
+# Palay (unmilled rice) sells at a farm-gate price, not the retail rice price,
+# so questions about it go to the model.
+PRICE_COMMODITIES = {
+    'bigas': ('rice', None), 'rice': ('rice', None),
+    'mais': ('corn', None), 'corn': ('corn', None),
+    'kamatis': ('vegetables', 'tomato'), 'tomato': ('vegetables', 'tomato'),
+    'talong': ('vegetables', 'eggplant'), 'eggplant': ('vegetables', 'eggplant'),
+    'repolyo': ('vegetables', 'cabbage'), 'cabbage': ('vegetables', 'cabbage'),
+    'sibuyas': ('vegetables', 'onion'), 'onion': ('vegetables', 'onion'),
+    'gulay': ('vegetables', None), 'vegetables': ('vegetables', None),
+    'saging': ('fruits', 'banana'), 'banana': ('fruits', 'banana'),
+    'mangga': ('fruits', 'mango'), 'mango': ('fruits', 'mango'),
+    'papaya': ('fruits', 'papaya')
+}
+
+CALENDAR_CROPS = {
+    'palay': 'rice', 'rice': 'rice', 'bigas': 'rice',
+    'mais': 'corn', 'corn': 'corn',
+    'gulay': 'vegetables', 'vegetables': 'vegetables',
+    'saging': 'banana', 'banana': 'banana'
+}
+
+TAGALOG_CROP_NAMES = {'rice': 'palay', 'corn': 'mais', 'vegetables': 'gulay', 'banana': 'saging'}
+
+PRICE_WORDS = {'presyo', 'price', 'prices', 'magkano', 'halaga', 'cost'}
+CALENDAR_WORDS = {'kailan', 'when', 'magtanim', 'tanim', 'itanim', 'plant', 'planting', 'season',
+                  'harvest', 'ani', 'anihin', 'schedule', 'calendar'}
+
+# Questions asking for reasoning or advice need the model
+OPEN_ENDED_WORDS = {'bakit', 'why', 'paano', 'how', 'dapat', 'should', 'pwede', 'can', 'tips',
+                    'advice', 'payo', 'problema', 'problem', 'compare', 'ikumpara'}
+
+TAGALOG_MARKERS = {'ng', 'ang', 'sa', 'po', 'ba', 'kailan', 'magkano', 'presyo', 'magtanim', 'mga',
+                   'ngayon', 'ano', 'bigas', 'mais', 'palay', 'gulay'}
+
+# Region names a farmer may put in the question -> region code
+REGION_MENTIONS = {name.lower(): code for code, name in REGION_NAMES.items()}
+REGION_MENTIONS.update({'ncr': 'NCR', 'manila': 'NCR', 'barmm': 'BARMM', 'zamboanga': 'IX'})
+
+WORD_PATTERN = re.compile(r"[a-zñ]+")
+
+# Bantay Presyo prices older than this (weekends, outages) fall back to the static table
+PRICE_MAX_AGE_DAYS = 4
+PH_TIME = timezone(timedelta(hours=8))
+
+
+class FastPathRouter:
+    """
+    Answers high-confidence structured lookups (crop prices, planting
+    calendars) straight from local data with a Tagalog or English
+    template, so they never wait for an LLM generation. Prices come from
+    the Bantay Presyo history for the asked (or the farmer's) region when
+    it has the commodity, else from the static table. Anything that looks
+    open-ended, or mixes in other topics, falls back to the model.
+    """
+
+    def __init__(self, ph_apis, max_words=10):
+        self.ph_apis = ph_apis
+        self.max_words = max_words
+        self.lock = threading.Lock()
+        self.stats = {'queries': 0, 'hits': 0, 'price': 0, 'calendar': 0}
+
+    @property
+    def hit_rate(self):
+        with self.lock:
+            return self.stats['hits'] / self.stats['queries'] if self.stats['queries'] else 0.0
+
+    def checkpoint_state(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def restore_state(self, state):
+        with self.lock:
+            for kind, count in state.items():
+                if kind in self.stats:
+                    self.stats[kind] += count
+        return state.get('queries', 0)
+
+    def _record(self, kind=None):
+        with self.lock:
+            self.stats['queries'] += 1
+            if kind:
+                self.stats['hits'] += 1
+                self.stats[kind] += 1
+
+    @staticmethod
+    def is_tagalog(words):
+        return sum(1 for word in words if word in TAGALOG_MARKERS) >= 2 or 'ng' in words
+
+    @staticmethod
+    def mentioned_region(text):
+        """Region code named in the question ('rice price in davao' -> 'XI'), or None"""
+        text = ' '.join(WORD_PATTERN.findall(text.lower()))
+        for name, code in REGION_MENTIONS.items():
+            if re.search(rf"\b{name}\b", text):
+                return code
+        return None
+
+    def answer(self, user_input, intents, region=None):
+        """Templated answer for a structured query, or None to use the LLM"""
+        words = WORD_PATTERN.findall(user_input.lower().replace('how much', 'magkano'))
+        word_set = set(words)
+
+        if (not words or len(words) > self.max_words or word_set & OPEN_ENDED_WORDS
+                or not set(intents) <= {'price', 'crop'}):
+            self._record()
+            return None
+
+        tagalog = self.is_tagalog(words)
+
+        if word_set & PRICE_WORDS:
+            commodities = [PRICE_COMMODITIES[w] for w in words if w in PRICE_COMMODITIES]
+            if len(set(commodities)) == 1:
+                self._record('price')
+                region = self.mentioned_region(user_input) or region
+                return (self._price_history_answer(words, commodities[0], region, tagalog) or
+                        self._price_answer(words, commodities[0], tagalog))
+
+        elif word_set & CALENDAR_WORDS:
+            crops = {CALENDAR_CROPS[w] for w in words if w in CALENDAR_CROPS}
+            if len(crops) == 1:
+                self._record('calendar')
+                return self._calendar_answer(crops.pop(), tagalog)
+
+        self._record()
+        return None
+
+    # ==================== TEMPLATES ====================
+
+    def _price_history_answer(self, words, commodity, region, tagalog):
+        """
+        Latest Bantay Presyo prices with weekly change, or None while the
+        history lacks the commodity or its newest prices are stale
+        """
+        # Records today's snapshot (fetched at most every few hours) and other workers' saves
+        self.ph_apis.update_price_history()
+        category, item = commodity
+        lines = self.ph_apis.price_history.summary([item or category], region=region)
+        today = datetime.now(PH_TIME).date()
+        lines = [line for line in lines
+                 if (today - datetime.strptime(line['date'], '%Y-%m-%d').date()).days <= PRICE_MAX_AGE_DAYS]
+        if not lines:
+            return None
+
+        name = next(w for w in words if w in PRICE_COMMODITIES)
+        listed = []
+        for line in lines:
+            area = f"Region {line['region']}" if line['region'] != 'all markets' else ('lahat ng palengke' if tagalog else 'all markets')
+            change = ''
+            if line['week_change_pct'] is not None:
+                change = f", {line['week_change_pct']:+.1f}% {'mula noong nakaraang linggo' if tagalog else 'vs last week'}"
+            listed.append(f"- {line['commodity'].capitalize()}: {line['min']:.2f}-{line['max']:.2f} PHP/kg ({area}{change})")
+        listed = '\n'.join(listed)
+        day = max(line['date'] for line in lines)
+
+        if tagalog:
+            return (f"Presyo ng {name} (DA Bantay Presyo, {day}):\n{listed}\n"
+                    f"Paalala: nag-iiba ang presyo depende sa palengke.")
+        return (f"{name.capitalize()} prices (DA Bantay Presyo, {day}):\n{listed}\n"
+                f"Note: prices vary by market.")
+
+    def _price_answer(self, words, commodity, tagalog):
+        table = self.ph_apis.get_market_prices_manual()
+        category, item = commodity
+        prices = table['prices'][category]
+        if item:
+            prices = {item: prices[item]}
+
+        name = next(w for w in words if w in PRICE_COMMODITIES)
+        listed = '\n'.join(f"- {key.replace('_', ' ').capitalize()}: {value}" for key, value in prices.items())
+
+        if tagalog:
+            return (f"Presyo ng {name} (DA Price Monitoring, {table['last_updated']}):\n{listed}\n"
+                    f"Paalala: nag-iiba ang presyo depende sa rehiyon at palengke.")
+        return (f"{name.capitalize()} prices (DA Price Monitoring, {table['last_updated']}):\n{listed}\n"
+                f"Note: {table['note']}.")
+
+    def _calendar_answer(self, crop, tagalog):
+        calendar = self.ph_apis.get_philippine_crop_calendar(crop)
+        lines = []
+
+        if crop == 'vegetables':
+            labels = {'rainy_season': ('Tag-ulan', 'Rainy season'), 'dry_season': ('Tag-araw', 'Dry season'),
+                      'year_round': ('Buong taon', 'Year-round')}
+            for key, (tl, en) in labels.items():
+                lines.append(f"- {tl if tagalog else en}: {', '.join(calendar[key])}")
+        elif 'wet_season' in calendar:
+            for key, (tl, en) in (('wet_season', ('Tag-ulan', 'Wet season')), ('dry_season', ('Tag-araw', 'Dry season'))):
+                s = calendar[key]
+                if tagalog:
+                    lines.append(f"- {tl}: magtanim sa {s['planting']}, ani sa {s['harvesting']} ({s['duration']})")
+                else:
+                    lines.append(f"- {en}: plant {s['planting']}, harvest {s['harvesting']} ({s['duration']})")
+        else:
+            lines.append(f"- {'Pagtatanim' if tagalog else 'Planting'}: {calendar['planting']}")
+            lines.append(f"- {'Pag-ani' if tagalog else 'Harvest'}: {calendar['harvesting']}")
+
+        if calendar.get('varieties'):
+            lines.append(f"- {'Mga barayti' if tagalog else 'Varieties'}: {', '.join(calendar['varieties'])}")
+        lines.append(f"- {'Paalala' if tagalog else 'Note'}: {calendar['notes']}")
+
+        title = f"Kalendaryo ng pagtatanim ng {TAGALOG_CROP_NAMES[crop]}" if tagalog else f"{crop.capitalize()} planting calendar"
+        return f"{title}:\n" + '\n'.join(lines)
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    import time
+    from philippine_apis import PhilippineAgriculturalAPIs
+
+    router = FastPathRouter(PhilippineAgriculturalAPIs())
+    questions = [
+        ("presyo ng bigas?", ['price', 'crop']),
+        ("kailan magtanim ng mais?", ['crop']),
+        ("How much is the price of onion?", ['price']),
+        ("rice price in davao", ['price', 'crop']),
+        ("presyo ng palay?", ['price', 'crop']),
+        ("When to plant banana", ['crop']),
+        ("bakit mahal ang presyo ng bigas?", ['price']),
+        ("may bagyo ba bukas?", ['weather'])
+    ]
+
+    for question, intents in questions:
+        start = time.perf_counter()
+        answer = router.answer(question, intents)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n=== {question} ({elapsed:.2f} ms) ===")
+        print(answer or "-> LLM")
+
+    print(f"\nHit rate: {router.hit_rate:.0%} {router.stats}")
@@ -0,0 +1,177 @@
+import http_client
+import feedparser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import threading
+import json
+import os
+
+
+class FeedAggregator:
+    """
+    Parallel RSS/Atom aggregator shared by the API services.
+
+    Feeds are fetched concurrently with conditional GET (ETag /
+    If-Modified-Since), so unchanged feeds cost a 304 and no parsing.
+    Items are deduplicated by guid/link into a persistent JSON store,
+    and each refresh returns only the entries that were not seen before.
+    """
+
+    def __init__(self, store_path=None, max_workers=8, max_items_per_feed=100, max_seen=5000, timeout=10):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.store_path = store_path or os.path.join(data_dir, 'feeds.json')
+        self.max_workers = max_workers
+        self.max_items_per_feed = max_items_per_feed
+        self.max_seen = max_seen
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.feeds = {}  # url -> {'etag', 'modified', 'checked', 'items': [newest first]}
+        self.seen = {}  # insertion-ordered set of item ids, oldest first
+        self._load()
+
+    # ==================== STORE ====================
+
+    def _load(self):
+        """Load the persisted feed state, if any"""
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Feed store load error: {e}")
+            return
+
+        self.feeds = data.get('feeds', {})
+        self.seen = dict.fromkeys(data.get('seen', []))
+
+    def _save(self):
+        """Write the feed state atomically so readers never see a partial file"""
+        try:
+            directory = os.path.dirname(self.store_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.store_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'feeds': self.feeds, 'seen': list(self.seen)}, f)
+            os.replace(tmp_path, self.store_path)
+        except Exception as e:
+            print(f"Feed store save error: {e}")
+
+    # ==================== FETCHING ====================
+
+    @staticmethod
+    def _entry_id(entry):
+        """Stable dedup key: guid, then link, then a hash of the title"""
+        key = entry.get('id') or entry.get('guid') or entry.get('link')
+        if not key:
+            key = hashlib.sha1(entry.get('title', '').encode('utf-8')).hexdigest()
+        return key
+
+    def _fetch_one(self, url):
+        """Conditional GET for one feed; returns (url, response or None)"""
+        with self.lock:
+            state = dict(self.feeds.get(url, {}))
+
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('modified'):
+            headers['If-Modified-Since'] = state['modified']
+
+        try:
+            response = http_client.get(url, headers=headers, timeout=self.timeout)
+            return url, response
+        except Exception as e:
+            print(f"RSS feed error ({url}): {e}")
+            return url, None
+
+    def _merge(self, url, response):
+        """Parse a 200 response and merge unseen entries; returns the new items"""
+        feed = feedparser.parse(response.content)
+
+        new_items = []
+        with self.lock:
+            state = self.feeds.setdefault(url, {'items': []})
+            state['etag'] = response.headers.get('ETag')
+            state['modified'] = response.headers.get('Last-Modified')
+            state['checked'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+
+            for entry in feed.entries:
+                item_id = self._entry_id(entry)
+                if item_id in self.seen:
+                    continue
+                self.seen[item_id] = None
+                new_items.append({
+                    'id': item_id,
+                    'title': entry.get('title', ''),
+                    'link': entry.get('link', ''),
+                    'summary': entry.get('summary', entry.get('description', '')),
+                    'published': entry.get('published', 'N/A'),
+                    'feed': url
+                })
+
+            # Feeds list newest first, so new items go in front of what we had
+            state['items'] = (new_items + state['items'])[:self.max_items_per_feed]
+
+            # Ids outlive the items themselves so trimmed entries are not re-announced
+            while len(self.seen) > self.max_seen:
+                del self.seen[next(iter(self.seen))]
+
+        return new_items
+
+    def refresh(self, urls):
+        """
+        Fetch all feeds in parallel and return {url: [new items]}.
+        Feeds answering 304 Not Modified (or failing) yield no new items.
+        """
+        results = {url: [] for url in urls}
+        merged = False
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls) or 1)) as executor:
+            for url, response in executor.map(self._fetch_one, urls):
+                if response is None or response.status_code == 304:
+                    continue
+                if response.status_code != 200:
+                    print(f"RSS feed error ({url}): HTTP {response.status_code}")
+                    continue
+                try:
+                    results[url] = self._merge(url, response)
+                    merged = True
+                except Exception as e:
+                    print(f"RSS parse error ({url}): {e}")
+
+        # Also persist when only validators changed, so the next run gets its 304
+        if merged:
+            with self.lock:
+                self._save()
+
+        return results
+
+    def latest(self, url, limit=5):
+        """Most recent stored items for a feed, without touching the network"""
+        with self.lock:
+            return list(self.feeds.get(url, {}).get('items', [])[:limit])
+
+    def all_items(self):
+        """Every stored item across feeds (used to seed retrieval indexes)"""
+        with self.lock:
+            return [item for feed in self.feeds.values() for item in feed.get('items', [])]
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    aggregator = FeedAggregator()
+    feeds = [
+        'http://bagong.pagasa.dost.gov.ph/rss-feed',
+        'http://www.fao.org/news/rss-feed/en/'
+    ]
+
+    print("=== FIRST REFRESH ===")
+    for url, items in aggregator.refresh(feeds).items():
+        print(f"{url}: {len(items)} new")
+
+    print("\n=== SECOND REFRESH (should be incremental) ===")
+    for url, items in aggregator.refresh(feeds).items():
+        print(f"{url}: {len(items)} new")
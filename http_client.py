@@ -0,0 +1,285 @@
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from urllib.parse import urlsplit
+import threading
+import random
+import time
+
+
+# Settings for every provider; PROVIDERS below overrides them per host
+DEFAULT_POLICY = {
+    'name': 'other',
+    'timeout': 10,  # seconds per attempt
+    'deadline': 20,  # seconds for the whole call, retries included
+    'retries': 2,
+    'backoff': 0.5,  # base of the jittered exponential backoff
+    'max_backoff': 4.0,
+    'hedge': False,
+    'hedge_delay': 1.0,  # used until enough latencies are recorded
+    'hedge_quantile': 0.95,
+    'min_hedge_delay': 0.2
+}
+
+PROVIDERS = {
+    # Latency-critical sources in the turn path: hedge slow calls
+    'api.open-meteo.com': {'name': 'open-meteo', 'timeout': 8, 'deadline': 10, 'hedge': True, 'hedge_delay': 1.5},
+    'api.inaturalist.org': {'name': 'inaturalist', 'timeout': 10, 'deadline': 15, 'hedge': True, 'hedge_delay': 2.0},
+    # Quota- or rate-limited: retry once, never hedge
+    'api.openweathermap.org': {'name': 'openweather', 'timeout': 8, 'deadline': 10, 'retries': 1},
+    'newsapi.org': {'name': 'newsapi', 'retries': 1, 'deadline': 12},
+    'api.agromonitoring.com': {'name': 'agromonitoring', 'retries': 1, 'deadline': 12},
+    'rest.isric.org': {'name': 'soilgrids', 'timeout': 30, 'deadline': 60, 'retries': 1},
+    'quickstats.nass.usda.gov': {'name': 'usda', 'retries': 1},
+    # Government sites are slow but we only hit them in the background or behind snapshots
+    'bagong.pagasa.dost.gov.ph': {'name': 'pagasa', 'timeout': 15, 'deadline': 30},
+    'www.da.gov.ph': {'name': 'da', 'timeout': 15, 'deadline': 30},
+    'bpi.da.gov.ph': {'name': 'bpi', 'timeout': 15, 'deadline': 30}
+}
+
+# Worth retrying: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """
+    Shared fetch path for idempotent GETs to the upstream providers.
+
+    Each call runs under its provider's deadline. Connection errors,
+    timeouts, 429 and 5xx answers are retried with full-jitter
+    exponential backoff while time remains. For latency-critical
+    providers a hedge is fired when the first attempt has not answered
+    after the provider's recent p95 latency, and whichever response
+    arrives first wins. Per-provider metrics (attempts, retries, hedges
+    fired and won, latency percentiles) are kept for the load test and
+    for tuning the policies.
+    """
+
+    def __init__(self, providers=None, max_workers=32, latency_window=200, min_samples=20):
+        self.providers = PROVIDERS if providers is None else providers
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}  # provider name -> counters
+        self.latencies = {}  # provider name -> deque of recent successful latencies
+        self._executor = None
+        self.max_workers = max_workers
+
+    def _session(self):
+        """One pooled session per thread (keep-alive across calls)"""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+        return session
+
+    def _get_executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='http-hedge')
+            return self._executor
+
+    def policy(self, url):
+        host = urlsplit(url).hostname or ''
+        return dict(DEFAULT_POLICY, **self.providers.get(host, {}))
+
+    # ==================== METRICS ====================
+
+    def _count(self, name, counter, amount=1):
+        with self.lock:
+            stats = self.stats.setdefault(name, {'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0,
+                                                 'hedges_fired': 0, 'hedges_won': 0})
+            stats[counter] += amount
+
+    def _record_latency(self, name, seconds):
+        with self.lock:
+            self.latencies.setdefault(name, deque(maxlen=self.latency_window)).append(seconds)
+
+    def _quantile(self, name, q):
+        with self.lock:
+            samples = sorted(self.latencies.get(name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def hedge_delay(self, policy):
+        """p95-derived wait before hedging, clamped to the provider's floor and half its deadline"""
+        delay = self._quantile(policy['name'], policy['hedge_quantile'])
+        if delay is None:
+            delay = policy['hedge_delay']
+        return min(max(delay, policy['min_hedge_delay']), policy['deadline'] / 2)
+
+    def metrics(self):
+        """{provider: counters plus p50/p95 latency in ms}"""
+        with self.lock:
+            names = list(self.stats)
+            result = {name: dict(self.stats[name]) for name in names}
+        for name in names:
+            for label, q in (('p50_ms', 0.5), ('p95_ms', 0.95)):
+                with self.lock:
+                    samples = sorted(self.latencies.get(name, ()))
+                result[name][label] = round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1) if samples else None
+        return result
+
+    def checkpoint_state(self):
+        """Recent latencies, so hedge delays start from the measured p95"""
+        with self.lock:
+            return {name: list(samples) for name, samples in self.latencies.items()}
+
+    def restore_state(self, state):
+        with self.lock:
+            for name, samples in state.items():
+                # Checkpointed samples are older than anything measured since boot
+                latencies = deque(samples, maxlen=self.latency_window)
+                latencies.extend(self.latencies.get(name, ()))
+                self.latencies[name] = latencies
+        return sum(len(samples) for samples in state.values())
+
+    # ==================== FETCHING ====================
+
+    def _attempt(self, url, timeout, kwargs):
+        start = time.perf_counter()
+        response = self._session().get(url, timeout=timeout, **kwargs)
+        return response, time.perf_counter() - start
+
+    def _hedged(self, url, timeout, kwargs, policy, name):
+        """Primary attempt plus, if it is slow, one hedge; first usable response wins"""
+        executor = self._get_executor()
+        primary = executor.submit(self._attempt, url, timeout, kwargs)
+        done, _ = wait([primary], timeout=min(self.hedge_delay(policy), timeout))
+        if done:
+            return primary.result()
+
+        self._count(name, 'hedges_fired')
+        hedge = executor.submit(self._attempt, url, timeout, kwargs)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, elapsed = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response.status_code in RETRY_STATUSES and pending:
+                    response.close()
+                    error = None
+                    continue
+                if future is hedge:
+                    self._count(name, 'hedges_won')
+                # The loser finishes in the background; its response is discarded
+                for other in pending:
+                    other.add_done_callback(lambda f: f.exception() is None and f.result()[0].close())
+                return response, elapsed
+        if error:
+            raise error
+        return response, elapsed
+
+    def get(self, url, params=None, timeout=None, hedge=None, **kwargs):
+        """
+        GET with the provider's retry/hedge policy. Returns the final
+        requests.Response (possibly a non-2xx one); raises the last error
+        when every attempt failed, like requests.get. Background jobs pass
+        hedge=False so bulk pulls never double their load on a provider.
+        """
+        policy = self.policy(url)
+        name = policy['name']
+        if params is not None:
+            kwargs['params'] = params
+        self._count(name, 'requests')
+
+        deadline = time.monotonic() + policy['deadline']
+        attempt_timeout = timeout or policy['timeout']
+        hedge = (policy['hedge'] if hedge is None else hedge) and not kwargs.get('stream')
+
+        response, error = None, None
+        for attempt in range(policy['retries'] + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._count(name, 'attempts')
+            try:
+                if hedge:
+                    response, elapsed = self._hedged(url, min(attempt_timeout, remaining), kwargs, policy, name)
+                else:
+                    response, elapsed = self._attempt(url, min(attempt_timeout, remaining), kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self._record_latency(name, elapsed)
+                return response
+
+            # Full jitter; honour Retry-After from rate limiters when it fits
+            sleep = random.uniform(0, min(policy['max_backoff'], policy['backoff'] * 2 ** attempt))
+            if response is not None and response.headers.get('Retry-After', '').isdigit():
+                sleep = max(sleep, int(response.headers['Retry-After']))
+            if attempt == policy['retries'] or time.monotonic() + sleep >= deadline - 0.1:
+                break
+            self._count(name, 'retries')
+            if response is not None:
+                response.close()
+            time.sleep(sleep)
+
+        self._count(name, 'failures')
+        if response is not None:
+            return response
+        raise error
+
+
+# Process-wide client shared by every API module
+client = HttpClient()
+
+
+def get(url, params=None, **kwargs):
+    """requests.get through the shared retry/hedge policy"""
+    return client.get(url, params=params, **kwargs)
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    import http.server
+    import json
+
+    class FlakyUpstream(http.server.BaseHTTPRequestHandler):
+        """5% of requests stall for 1 s, 10% fail with a 503"""
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            roll = random.random()
+            if roll < 0.05:
+                time.sleep(1.0)
+            elif roll < 0.15:
+                self.send_response(503)
+                self.end_headers()
+                return
+            else:
+                time.sleep(random.uniform(0.01, 0.03))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{"ok": true}')
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    random.seed(4)
+    for label, providers in (('no hedge', {}), ('hedged', {'127.0.0.1': {'name': 'local', 'hedge': True,
+                                                                          'hedge_delay': 0.1}})):
+        test_client = HttpClient(providers=providers)
+        latencies = []
+        for _ in range(200):
+            start = time.perf_counter()
+            test_client.get(url)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print(f"{label:<9} p50 {latencies[100] * 1000:6.1f} ms  p95 {latencies[190] * 1000:6.1f} ms  "
+              f"p99 {latencies[198] * 1000:6.1f} ms")
+        print(json.dumps(test_client.metrics()))
+    server.shutdown()
@@ -0,0 +1,133 @@
+from relevance_index import BM25Index
+from token_budget import count_tokens
+
+
+# Which knowledge chunks each detected intent may draw from
+INTENT_KINDS = {
+    'crop': ('calendar', 'advisory'),
+    'pest': ('pest', 'advisory'),
+    'price': ('price',)
+}
+
+
+class KnowledgeRetriever:
+    """
+    Retrieval over the static agricultural knowledge (crop calendars, pest
+    database, market prices) plus the cached DA advisories.
+
+    The static data is split into small self-contained chunks and added to
+    the shared BM25 index, so a question only pulls in the few chunks that
+    match it, packed into a strict token budget.
+    """
+
+    def __init__(self, ph_apis, index=None):
+        self.ph_apis = ph_apis
+        self.index = index if index is not None else BM25Index()
+        self.chunk_count = 0
+        self.load_static_knowledge()
+
+    # ==================== CHUNKING ====================
+
+    def _add_chunk(self, chunk_id, text, kind):
+        if self.index.add(chunk_id, text, {'text': text}, kind=kind):
+            self.chunk_count += 1
+
+    def load_static_knowledge(self):
+        """Chunk crop calendars, pests and prices into the index"""
+        crops = self.ph_apis.get_philippine_crop_calendar('').get('available_crops', [])
+        for crop in crops:
+            calendar = self.ph_apis.get_philippine_crop_calendar(crop)
+            name = crop.capitalize()
+
+            for season in ('wet_season', 'dry_season'):
+                if isinstance(calendar.get(season), dict):
+                    s = calendar[season]
+                    label = season.replace('_', ' ')
+                    self._add_chunk(f"calendar:{crop}:{season}",
+                                    f"{name} {label}: plant {s['planting']}, harvest {s['harvesting']} ({s['duration']}).",
+                                    'calendar')
+
+            if crop == 'vegetables':
+                for season in ('rainy_season', 'dry_season', 'year_round'):
+                    label = season.replace('_', ' ')
+                    self._add_chunk(f"calendar:{crop}:{season}",
+                                    f"Vegetables for {label}: {', '.join(calendar[season])}.",
+                                    'calendar')
+            elif 'planting' in calendar:
+                self._add_chunk(f"calendar:{crop}:planting",
+                                f"{name} planting: {calendar['planting']}; harvest {calendar['harvesting']}.",
+                                'calendar')
+
+            details = []
+            if 'varieties' in calendar:
+                details.append(f"varieties {', '.join(calendar['varieties'])}")
+            if 'notes' in calendar:
+                details.append(calendar['notes'])
+            if details:
+                self._add_chunk(f"calendar:{crop}:notes", f"{name}: {'; '.join(details)}.", 'calendar')
+
+        for crop, data in self.ph_apis.get_common_philippine_pests().items():
+            name = crop.capitalize()
+            for pest in data.get('pests', []):
+                self._add_chunk(f"pest:{crop}:{pest['name']}",
+                                f"{name} pest {pest['name']}: {pest['symptoms']}. Control: {pest['control']}.",
+                                'pest')
+            if 'prevention' in data:
+                self._add_chunk(f"pest:{crop}:prevention", f"{name} pest prevention: {data['prevention']}.", 'pest')
+            if 'common_pests' in data:
+                self._add_chunk(f"pest:{crop}:common",
+                                f"{name} pests: {', '.join(data['common_pests'])}; diseases: "
+                                f"{', '.join(data['diseases'])}. Control: {data['control']}.",
+                                'pest')
+
+        self.load_prices(self.ph_apis.get_market_prices_manual())
+
+    def load_prices(self, prices):
+        """Chunk a price table ({'prices': {category: {item: range}}}) into the index"""
+        for category, items in prices['prices'].items():
+            listed = ', '.join(f"{item.replace('_', ' ')} {value}" for item, value in items.items())
+            self._add_chunk(f"price:{category}:{prices['last_updated']}",
+                            f"{category.capitalize()} prices ({prices['last_updated']}): {listed}.",
+                            'price')
+
+    # ==================== RETRIEVAL ====================
+
+    def retrieve(self, question, intents, budget_tokens=300, region=None, k=8, with_kinds=False):
+        """
+        Best-matching chunks for the question, restricted to the kinds the
+        detected intents allow, greedily packed into budget_tokens.
+        Returns a list of chunk texts (highest score first), or of
+        (kind, text) pairs with with_kinds.
+        """
+        kinds = set()
+        for intent in intents:
+            kinds.update(INTENT_KINDS.get(intent, ()))
+        if not kinds:
+            return []
+
+        packed = []
+        used = 0
+        for _, kind, item in self.index.search(question, k=k, kinds=kinds, region=region):
+            text = item['text'] if 'text' in item else f"DA advisory: {item['title']}"
+            cost = count_tokens(text)
+            if used + cost > budget_tokens:
+                continue
+            packed.append((kind, text) if with_kinds else text)
+            used += cost
+
+        return packed
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    from philippine_apis import PhilippineAgriculturalAPIs
+
+    retriever = KnowledgeRetriever(PhilippineAgriculturalAPIs())
+    print(f"{retriever.chunk_count} chunks indexed")
+
+    for question, intents in [("kailan magtanim ng mais?", ['crop']),
+                              ("may armyworm sa mais ko, ano gagawin?", ['pest', 'crop']),
+                              ("presyo ng sibuyas ngayon", ['price'])]:
+        print(f"\n=== {question} ===")
+        for chunk in retriever.retrieve(question, intents, budget_tokens=120):
+            print(f"- {chunk}")
@@ -0,0 +1,381 @@
+"""
+Concurrent-user load test for FarmerChatbot.
+
+Runs simulated farmer sessions (multi-turn, mixed weather/pest/price/crop/
+news intents, Tagalog and English) at increasing concurrency against local
+fake upstreams and a fake Ollama, and writes a JSON report with latency and
+time-to-first-token percentiles, error rate, throughput and the saturation
+point, so releases can be diffed.
+
+    python load_test.py --levels 1,2,4,8,16 --output load_report.json
+"""
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import requests
+
+import http_client
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+CONVERSATIONS = [
+    ["Ano ang panahon bukas sa Nueva Ecija?", "May bagyo ba ngayong linggo?", "Pwede na ba mag-spray ng pataba?"],
+    ["What is the weather forecast for this week?", "Is it safe to harvest my palay on Friday?"],
+    ["May kulisap sa palay ko, naninilaw ang dahon", "Ano ang gamot sa rice black bug?", "Salamat po"],
+    ["There are holes in my corn leaves, what pest is this?", "How do I control fall armyworm?"],
+    ["presyo ng bigas?", "Magkano ang sibuyas ngayon?", "Saan ako pwedeng magbenta ng ani ko?"],
+    ["What is the price of tomato?", "Should I sell my corn now or wait?"],
+    ["kailan magtanim ng mais?", "Anong variety ng mais ang maganda sa tag-ulan?"],
+    ["When to plant rice in the dry season?", "How much fertilizer for one hectare of rice?"],
+    ["Ano ang latest na balita sa agrikultura?", "May bagong advisory ba ang DA?"],
+    ["Any news about the rice tariff?", "What is the weather in Iloilo?", "Is there a typhoon coming?"]
+]
+
+REGIONS = ['NCR', 'III', 'IV-A', 'VI', 'VII', 'XI', None]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile (None for an empty list)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# ==================== FAKE SERVICES ====================
+
+class FakeBackend(http.server.BaseHTTPRequestHandler):
+    """
+    One local server playing every upstream (by original host) and Ollama.
+    Ollama is modelled with a fixed number of parallel slots, prompt
+    evaluation time proportional to prompt length and a per-token delay.
+    """
+    protocol_version = 'HTTP/1.1'
+    upstream_latency = 0.05
+    prompt_seconds_per_char = 0.00005
+    token_delay = 0.01
+    reply_tokens = 40
+    slots = threading.Semaphore(1)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type='application/json', status=200):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fixture(self, name):
+        with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+            return f.read()
+
+    def do_GET(self):
+        if self.path.startswith('/api/ps'):
+            self._send({'models': [{'name': 'agriaid:latest'}]})
+            return
+
+        # Rewritten upstream URLs look like /<original host>/<original path>
+        _, host, path = self.path.split('/', 2)
+        path = '/' + path
+        time.sleep(self.upstream_latency * random.uniform(0.5, 2.0))
+
+        if host == 'api.open-meteo.com':
+            daily = {
+                'time': [f"2025-06-{day:02d}" for day in range(1, 8)],
+                'temperature_2m_max': [32.1, 31.4, 30.2, 29.8, 31.0, 32.5, 33.0],
+                'temperature_2m_min': [24.2, 24.0, 23.5, 23.1, 23.8, 24.4, 24.9],
+                'precipitation_sum': [0.0, 5.2, 22.4, 40.1, 12.0, 0.4, 0.0],
+                'rain_sum': [0.0, 5.2, 22.4, 40.1, 12.0, 0.4, 0.0],
+                'windspeed_10m_max': [12.0, 18.5, 30.2, 41.0, 22.3, 10.1, 9.0]
+            }
+            # 7 days of hourly data from local midnight today, so the agromet
+            # indicators (spray windows, rain ahead) have hours ahead of now
+            midnight = datetime.now(timezone(timedelta(hours=8))).replace(hour=0, minute=0, second=0, microsecond=0)
+            hours = range(168)
+            hourly = {
+                'time': [(midnight + timedelta(hours=h)).strftime('%Y-%m-%dT%H:%M') for h in hours],
+                'temperature_2m': [round(27 + 5 * math.sin((h % 24 - 9) / 24 * 2 * math.pi), 1) for h in hours],
+                'relative_humidity_2m': [round(80 - 15 * math.sin((h % 24 - 9) / 24 * 2 * math.pi)) for h in hours],
+                'precipitation': [2.5 if h % 24 in (15, 16) and h // 24 in (2, 3) else 0.0 for h in hours],
+                'wind_speed_10m': [round(8 + 6 * math.sin((h % 24 - 12) / 24 * 2 * math.pi), 1) for h in hours]
+            }
+            self._send({
+                'utc_offset_seconds': 8 * 3600,
+                'current': {'temperature_2m': 30.5, 'relative_humidity_2m': 78, 'precipitation': 0.2,
+                            'wind_speed_10m': 11.3, 'time': '2025-06-01T10:00'},
+                'current_weather': {'temperature': 30.5, 'windspeed': 11.3, 'weathercode': 2},
+                'hourly': hourly,
+                'daily': daily
+            })
+        elif host == 'bagong.pagasa.dost.gov.ph' and 'tropical-cyclone' in path:
+            self._send(self._fixture('pagasa_bulletin.html'), 'text/html')
+        elif host == 'www.da.gov.ph':
+            self._send(self._fixture('da_advisories.html'), 'text/html')
+        elif host == 'api.inaturalist.org':
+            self._send({'results': [{
+                'taxon': {'name': 'Spodoptera frugiperda', 'preferred_common_name': 'Fall Armyworm'},
+                'observed_on': '2025-05-30', 'place_guess': 'Cabanatuan, Nueva Ecija', 'photos': []
+            }] * 5})
+        elif host == 'newsapi.org':
+            self._send({'articles': [{
+                'title': f"Rice farmers in Central Luzon brace for typhoon season ({i})",
+                'description': 'DA urges early harvest and palay drying.', 'source': {'name': 'PNA'},
+                'url': f"https://news.example.ph/{i}", 'publishedAt': '2025-05-30T08:00:00Z'
+            } for i in range(10)]})
+        elif host == 'api.agromonitoring.com':
+            self._send({'t10': 299.1, 'moisture': 0.31, 'dt': 1748563200})
+        else:
+            items = ''.join(
+                f"<item><title>PAGASA weather update {i}</title><link>https://{host}/item/{i}</link>"
+                f"<guid>{host}-{i}</guid><description>Southwest monsoon brings rains over Luzon.</description></item>"
+                for i in range(5))
+            self._send(f'<?xml version="1.0"?><rss version="2.0"><channel><title>{host}</title>{items}</channel></rss>',
+                       'application/rss+xml')
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/api/generate'):
+            self._send({'error': 'not found'}, status=404)
+            return
+
+        prompt = body.get('prompt', '')
+        tokens = self.reply_tokens if body.get('prompt') else 0
+        if body.get('options', {}).get('num_predict'):
+            tokens = min(tokens, body['options']['num_predict'])
+
+        with self.slots:
+            time.sleep(len(prompt) * self.prompt_seconds_per_char)
+            if not body.get('stream'):
+                time.sleep(tokens * self.token_delay)
+                self._send({'response': 'Sige po. ' * max(tokens // 2, 1), 'done': True, 'eval_count': tokens})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for i in range(tokens):
+                    time.sleep(self.token_delay)
+                    self._chunk({'response': 'salita ' if i % 2 else 'Ang ', 'done': False})
+                self._chunk({'response': '', 'done': True, 'eval_count': tokens,
+                             'prompt_eval_count': len(prompt) // 4})
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+
+
+class QuietServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream (cancelled turns) are expected under load
+        pass
+
+
+@contextlib.contextmanager
+def fake_services(args):
+    """Start the fake backend and route every outgoing requests call to it"""
+    FakeBackend.upstream_latency = args.upstream_latency
+    FakeBackend.token_delay = args.token_delay
+    FakeBackend.reply_tokens = args.reply_tokens
+    FakeBackend.slots = threading.Semaphore(args.ollama_slots)
+
+    server = QuietServer(('127.0.0.1', 0), FakeBackend)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    local = f"127.0.0.1:{server.server_port}"
+
+    original_send = requests.adapters.HTTPAdapter.send
+
+    def send(adapter, request, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.netloc != local:
+            request.url = f"http://{local}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else '')
+        return original_send(adapter, request, **kwargs)
+
+    requests.adapters.HTTPAdapter.send = send
+    try:
+        yield f"http://{local}"
+    finally:
+        requests.adapters.HTTPAdapter.send = original_send
+        server.shutdown()
+
+
+# ==================== LOAD GENERATION ====================
+
+def run_session(session_id, turns_per_session, think_time):
+    """One farmer: a fresh chatbot and a scripted conversation; returns turn records"""
+    from agriaid_chatbot import FarmerChatbot
+
+    rng = random.Random(session_id)
+    bot = FarmerChatbot()
+    conversation = rng.choice(CONVERSATIONS)[:turns_per_session]
+    region = rng.choice(REGIONS)
+
+    records = []
+    for question in conversation:
+        start = time.perf_counter()
+        first_token = None
+        error = None
+        fast_path = False
+        try:
+            for event in bot.stream_chat(question, region=region):
+                if 'token' in event and first_token is None:
+                    first_token = time.perf_counter() - start
+                if event.get('done'):
+                    error = event.get('error')
+                    fast_path = bool(event.get('fast_path'))
+        except Exception as e:
+            error = str(e)
+
+        records.append({
+            'latency': time.perf_counter() - start,
+            'ttft': first_token,
+            'error': error,
+            'fast_path': fast_path
+        })
+        time.sleep(think_time * rng.uniform(0.5, 1.5))
+
+    bot.ollama.stop()
+    return records
+
+
+def run_level(concurrency, sessions_per_level, turns_per_session, think_time):
+    """Run sessions with `concurrency` farmers active at once"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_session, concurrency * 1000 + i, turns_per_session, think_time)
+                   for i in range(sessions_per_level)]
+        records = [record for future in futures for record in future.result()]
+    elapsed = time.perf_counter() - start
+
+    latencies = [r['latency'] for r in records if not r['error']]
+    ttfts = [r['ttft'] for r in records if r['ttft'] is not None and not r['error']]
+    errors = sum(1 for r in records if r['error'])
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        'concurrency': concurrency,
+        'turns': len(records),
+        'duration_s': round(elapsed, 2),
+        'throughput_tps': round(len(records) / elapsed, 2),
+        'error_rate': round(errors / len(records), 4) if records else 0.0,
+        'fast_path_rate': round(sum(1 for r in records if r['fast_path']) / len(records), 4) if records else 0.0,
+        'latency_ms': {'p50': ms(percentile(latencies, 50)), 'p95': ms(percentile(latencies, 95)),
+                       'p99': ms(percentile(latencies, 99))},
+        'ttft_ms': {'p50': ms(percentile(ttfts, 50)), 'p95': ms(percentile(ttfts, 95)),
+                    'p99': ms(percentile(ttfts, 99))}
+    }
+
+
+def find_saturation(levels, min_gain=0.10, latency_factor=3.0, max_error_rate=0.01):
+    """
+    First concurrency level where adding users stops paying off: throughput
+    gains under min_gain, p95 latency over latency_factor x the single-user
+    p95, or errors above max_error_rate. None if no level saturated.
+    """
+    baseline_p95 = levels[0]['latency_ms']['p95'] if levels else None
+    for previous, level in zip(levels, levels[1:]):
+        gain = (level['throughput_tps'] - previous['throughput_tps']) / max(previous['throughput_tps'], 1e-9)
+        p95 = level['latency_ms']['p95']
+        if (gain < min_gain or level['error_rate'] > max_error_rate
+                or (baseline_p95 and p95 and p95 > latency_factor * baseline_p95)):
+            return {'concurrency': level['concurrency'], 'throughput_gain': round(gain, 3),
+                    'p95_ms': p95, 'error_rate': level['error_rate']}
+    return None
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default='1,2,4,8,16', help='comma-separated concurrency levels')
+    parser.add_argument('--sessions', type=int, default=0, help='sessions per level (default: 2 x concurrency)')
+    parser.add_argument('--turns', type=int, default=3, help='max turns per session')
+    parser.add_argument('--think-time', type=float, default=0.2, help='mean seconds between turns')
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help='mean fake upstream latency (s)')
+    parser.add_argument('--token-delay', type=float, default=0.01, help='fake Ollama seconds per token')
+    parser.add_argument('--reply-tokens', type=int, default=40, help='fake Ollama tokens per reply')
+    parser.add_argument('--ollama-slots', type=int, default=1, help='fake Ollama parallel requests (OLLAMA_NUM_PARALLEL)')
+    parser.add_argument('--speculative', action='store_true', help='start replies before slow sources load (AGRIAID_SPECULATIVE)')
+    parser.add_argument('--output', default='load_report.json', help='where to write the JSON report')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(',')]
+
+    with tempfile.TemporaryDirectory() as data_dir, fake_services(args) as backend:
+        os.environ.update({
+            'AGRIAID_DATA_DIR': data_dir,
+            'OLLAMA_HOST': backend,
+            'AGRIAID_WARMUP': '0',
+            'AGRIAID_CRAWL': '0',
+            'AGRIAID_BRIEFINGS': '0',
+            'AGRIAID_CHECKPOINT': '0',
+            # Sessions share the host; don't fork a parse pool per simulated farmer
+            'AGRIAID_PARSE_WORKERS': '0',
+            'AGRIAID_SPECULATIVE': '1' if args.speculative else '0'
+        })
+
+        results = []
+        for concurrency in levels:
+            sessions = args.sessions or 2 * concurrency
+            print(f"▶ {concurrency} concurrent farmers, {sessions} sessions...", flush=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run_level(concurrency, sessions, args.turns, args.think_time)
+            results.append(result)
+            print(f"  p50 {result['latency_ms']['p50']} ms, p95 {result['latency_ms']['p95']} ms, "
+                  f"TTFT p95 {result['ttft_ms']['p95']} ms, {result['throughput_tps']} turns/s, "
+                  f"errors {result['error_rate']:.1%}")
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'levels': results,
+        'saturation': find_saturation(results),
+        'upstreams': http_client.client.metrics()
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    saturation = report['saturation']
+    print(f"\nSaturation: " + (f"{saturation['concurrency']} concurrent farmers" if saturation else "not reached"))
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import requests
+import threading
+import time
+import os
+
+
+class OllamaMonitor:
+    """
+    Keeps the Ollama model warm and tracks backend health.
+
+    warm_up() loads the model with an empty prompt and then evaluates a
+    one-token generation, which runs the ModelFile SYSTEM prompt through
+    the model so its prefix is already cached for the first real question.
+    A background probe checks /api/ps every probe_interval seconds: if the
+    model was unloaded it is warmed up again, and the state becomes
+    'degraded' (slow or reloading) or 'down' (unreachable) before a farmer
+    runs into it.
+    """
+
+    def __init__(self, host=None, model=None, keep_alive=None, probe_interval=30, slow_probe_seconds=2.0,
+                 warm_up_retries=3, retry_delay=5):
+        self.host = (host or os.getenv('OLLAMA_HOST', 'http://localhost:11434')).rstrip('/')
+        self.model = model or os.getenv('OLLAMA_MODEL', 'agriaid')
+        # How long Ollama keeps the model resident after a request ('-1' = forever)
+        self.keep_alive = keep_alive or os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        self.probe_interval = probe_interval
+        self.slow_probe_seconds = slow_probe_seconds
+        self.warm_up_retries = warm_up_retries
+        self.retry_delay = retry_delay
+        self.state = 'starting'
+        self.last_error = None
+        self.last_warm_up_seconds = None
+        self.failures = 0
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_down(self):
+        return self.state == 'down'
+
+    def _set_state(self, state, error=None):
+        with self.lock:
+            if state != self.state:
+                print(f"🩺 Ollama backend {self.state} -> {state}" + (f" ({error})" if error else ""))
+            self.state = state
+            self.last_error = error
+
+    def _model_names(self):
+        """Names to match in /api/ps ('agriaid' is listed as 'agriaid:latest')"""
+        return {self.model, self.model if ':' in self.model else f"{self.model}:latest"}
+
+    # ==================== WARM-UP ====================
+
+    def warm_up(self):
+        """Load the model and pre-evaluate the system prompt prefix; returns seconds taken"""
+        url = f"{self.host}/api/generate"
+        start = time.perf_counter()
+        try:
+            # An empty prompt only loads the model into memory
+            requests.post(url, json={"model": self.model, "prompt": "", "stream": False,
+                                     "keep_alive": self.keep_alive}, timeout=300).raise_for_status()
+            # A one-token generation evaluates the SYSTEM prefix into the cache
+            requests.post(url, json={"model": self.model, "prompt": "Kumusta", "stream": False,
+                                     "keep_alive": self.keep_alive, "options": {"num_predict": 1}},
+                          timeout=300).raise_for_status()
+        except Exception as e:
+            self.failures += 1
+            # Same rule as the probe: one failure is a blip, two in a row mean the backend is gone
+            self._set_state('down' if self.failures >= 2 else 'degraded', str(e))
+            return None
+
+        self.last_warm_up_seconds = time.perf_counter() - start
+        self.failures = 0
+        self._set_state('ready')
+        return self.last_warm_up_seconds
+
+    # ==================== HEALTH PROBE ====================
+
+    def probe(self):
+        """One health check; reloads the model if Ollama has idled it out"""
+        start = time.perf_counter()
+        try:
+            response = requests.get(f"{self.host}/api/ps", timeout=5)
+            response.raise_for_status()
+            loaded = {m.get('name') for m in response.json().get('models', [])}
+        except Exception as e:
+            self.failures += 1
+            # One failed probe is a blip; two in a row means the backend is gone
+            self._set_state('down' if self.failures >= 2 else 'degraded', str(e))
+            return self.state
+
+        self.failures = 0
+        if not loaded & self._model_names():
+            self._set_state('degraded', 'model not resident, reloading')
+            self.warm_up()
+        elif time.perf_counter() - start > self.slow_probe_seconds:
+            self._set_state('degraded', 'slow health probe')
+        else:
+            self._set_state('ready')
+        return self.state
+
+    def _run(self):
+        # Retry a failed warm-up with a growing delay instead of waiting for the next probe
+        for attempt in range(self.warm_up_retries + 1):
+            if self.warm_up() is not None or attempt == self.warm_up_retries:
+                break
+            if self._stop.wait(self.retry_delay * (attempt + 1)):
+                return
+        while not self._stop.wait(self.probe_interval):
+            self.probe()
+
+    def start(self):
+        """Warm up and start probing in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ollama-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    monitor = OllamaMonitor()
+    print(f"Warming up {monitor.model} at {monitor.host}...")
+    seconds = monitor.warm_up()
+    print(f"State: {monitor.state}" + (f", warm-up took {seconds:.1f}s" if seconds else f" ({monitor.last_error})"))
+    print(f"Probe: {monitor.probe()}")
@@ -0,0 +1,320 @@
+import http_client
+from datetime import datetime, timedelta, timezone
+import threading
+import sqlite3
+import math
+import time
+import re
+import os
+
+
+INAT_OBSERVATIONS_URL = "https://api.inaturalist.org/v1/observations"
+
+# Philippine bounding box for the sync
+PH_BBOX = {'swlat': 4.5, 'swlng': 116.0, 'nelat': 21.5, 'nelng': 127.0}
+INSECTA_TAXON_ID = 47158
+
+# Scientific name inside the parentheses of a pest entry, e.g. 'Corn Borer (Ostrinia furnacalis)'
+SCIENTIFIC_NAME_PATTERN = re.compile(r"\(([A-Z][a-z]+ [a-z]+)\)")
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+class PestObservationIndex:
+    """
+    Local spatio-temporal index of research-grade iNaturalist insect
+    observations in the Philippines.
+
+    sync() pulls only observations updated since the previous complete
+    sync (updated_since) and upserts them, so after the first backfill
+    each run is a page or two, and an older upload that reaches research
+    grade days later is still picked up. Rows are keyed by a fixed
+    lat/lon grid cell and the observation day, with a (cell, day) index,
+    so "sightings within R km in the last N days" reads only the handful
+    of cells around the farm.
+    The SQLite file (WAL mode) is shared by all worker processes.
+    """
+
+    def __init__(self, db_path=None, cell_degrees=0.1, backfill_days=365, interval=None, timeout=30):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.db_path = db_path or os.path.join(data_dir, 'pest_observations.db')
+        self.cell_degrees = cell_degrees
+        self.cols = int(round(360 / cell_degrees))
+        self.backfill_days = backfill_days
+        if interval is None:
+            interval = int(os.getenv('AGRIAID_PEST_SYNC_INTERVAL', '21600'))
+        self.interval = interval
+        self.timeout = timeout
+        self.local = threading.local()
+        self.sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS observations (
+                id INTEGER PRIMARY KEY,
+                cell INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                taxon_id INTEGER,
+                species TEXT NOT NULL,
+                common_name TEXT,
+                place TEXT,
+                photo TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS observations_cell_day ON observations (cell, day)")
+        conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _conn(self):
+        """One connection per thread (sqlite3 connections are not thread-safe)"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+    @property
+    def watermark(self):
+        """Highest iNaturalist observation id stored"""
+        return self._conn().execute("SELECT MAX(id) FROM observations").fetchone()[0] or 0
+
+    @property
+    def synced_since(self):
+        """updated_since for the next sync (ISO UTC time), or None before the first complete sync"""
+        row = self._conn().execute("SELECT value FROM sync_state WHERE key = 'updated_since'").fetchone()
+        return row[0] if row else None
+
+    # ==================== GRID ====================
+
+    def _row_col(self, lat, lon):
+        return int((lat + 90) / self.cell_degrees), int((lon + 180) / self.cell_degrees)
+
+    def cell_of(self, lat, lon):
+        row, col = self._row_col(lat, lon)
+        return row * self.cols + col
+
+    @staticmethod
+    def _day(date_text):
+        """'YYYY-MM-DD' -> days since 1970-01-01"""
+        return (datetime.strptime(date_text[:10], '%Y-%m-%d') - datetime(1970, 1, 1)).days
+
+    # ==================== SYNC ====================
+
+    def add_observations(self, results):
+        """Store (or update) raw iNaturalist observation dicts; returns how many rows were written"""
+        rows = []
+        for obs in results:
+            location = obs.get('location')
+            taxon = obs.get('taxon') or {}
+            if not obs.get('id') or not location or not obs.get('observed_on') or not taxon.get('name'):
+                continue
+            lat, lon = (float(v) for v in location.split(','))
+            photos = obs.get('photos') or []
+            rows.append((
+                obs['id'], self.cell_of(lat, lon), self._day(obs['observed_on']), lat, lon,
+                taxon.get('id'), taxon['name'], taxon.get('preferred_common_name'),
+                obs.get('place_guess'), photos[0]['url'] if photos else None
+            ))
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def sync(self, max_pages=50, per_page=200, delay=1.0):
+        """
+        Pull observations created or updated since the last complete sync
+        (the first run backfills backfill_days) and upsert them; returns
+        the number of rows written
+        """
+        with self.sync_lock:
+            started = datetime.now(timezone.utc)
+            params = dict(PH_BBOX, taxon_id=INSECTA_TAXON_ID, quality_grade='research',
+                          order_by='id', order='asc', per_page=per_page)
+            synced_since = self.synced_since
+            if synced_since:
+                params['updated_since'] = synced_since
+            else:
+                params['d1'] = (datetime.now() - timedelta(days=self.backfill_days)).strftime('%Y-%m-%d')
+
+            added = 0
+            cursor = 0  # id_above pages through this run's matches
+            complete = False
+            for page in range(max_pages):
+                params['id_above'] = cursor
+                try:
+                    response = http_client.get(INAT_OBSERVATIONS_URL, params=params, timeout=self.timeout, hedge=False)
+                    response.raise_for_status()
+                    results = response.json()['results']
+                except Exception as e:
+                    print(f"iNaturalist sync error: {e}")
+                    break
+
+                added += self.add_observations(results)
+                cursor = max([cursor] + [obs.get('id') or 0 for obs in results])
+                if len(results) < per_page:
+                    complete = True
+                    break
+                # iNaturalist asks API clients to stay around one request per second
+                time.sleep(delay)
+
+            if complete:
+                # A few minutes of overlap for updates indexed while we were paging
+                since = (started - timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S+00:00')
+                self._conn().execute("INSERT OR REPLACE INTO sync_state VALUES ('updated_since', ?)", (since,))
+            return added
+
+    def _run(self):
+        while True:
+            self.sync()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """Sync now and then every interval seconds in a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='pest-sync', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ==================== QUERIES ====================
+
+    def _query(self, lat, lon, radius_km, start_day, end_day):
+        """Rows within radius_km and [start_day, end_day], reading only nearby cells"""
+        lat_span = radius_km / 111.0
+        lon_span = radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+        row0, col0 = self._row_col(lat - lat_span, lon - lon_span)
+        row1, col1 = self._row_col(lat + lat_span, lon + lon_span)
+
+        # One contiguous cell range per grid row keeps this on the (cell, day) index
+        ranges = ' OR '.join(['(cell BETWEEN ? AND ?)'] * (row1 - row0 + 1))
+        args = []
+        for row in range(row0, row1 + 1):
+            args += [row * self.cols + col0, row * self.cols + col1]
+
+        rows = self._conn().execute(
+            f"SELECT id, day, lat, lon, species, common_name, place, photo FROM observations "
+            f"WHERE ({ranges}) AND day BETWEEN ? AND ?",
+            args + [start_day, end_day]
+        ).fetchall()
+        return [row for row in rows if haversine_km(lat, lon, row[2], row[3]) <= radius_km]
+
+    def recent_near(self, lat, lon, radius_km=50, days=30, limit=10, today=None):
+        """Most recent sightings near a point, in the get_pest_observations format"""
+        end = self._day(today or datetime.now().strftime('%Y-%m-%d'))
+        rows = self._query(lat, lon, radius_km, end - days, end)
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=True)
+        epoch = datetime(1970, 1, 1)
+        return [{
+            'species': species,
+            'common_name': common_name or 'Unknown',
+            'observed_on': (epoch + timedelta(days=day)).strftime('%Y-%m-%d'),
+            'location': place or 'Unknown',
+            'distance_km': round(haversine_km(lat, lon, obs_lat, obs_lon), 1),
+            'photo': photo
+        } for _, day, obs_lat, obs_lon, species, common_name, place, photo in rows[:limit]]
+
+    def species_counts(self, lat, lon, radius_km=50, days=30, today=None):
+        """
+        Sightings per species in the last `days` and in the `days` before;
+        returns [{'species', 'common_name', 'count', 'previous', 'trend'}],
+        most sighted first
+        """
+        end = self._day(today or datetime.now().strftime('%Y-%m-%d'))
+        counts = {}
+        for _, day, _, _, species, common_name, _, _ in self._query(lat, lon, radius_km, end - 2 * days, end):
+            entry = counts.setdefault(species, {'species': species, 'common_name': common_name or 'Unknown',
+                                                'count': 0, 'previous': 0})
+            entry['count' if day > end - days else 'previous'] += 1
+
+        for entry in counts.values():
+            if entry['count'] > entry['previous']:
+                entry['trend'] = 'rising'
+            elif entry['count'] < entry['previous']:
+                entry['trend'] = 'falling'
+            else:
+                entry['trend'] = 'steady'
+        return sorted((e for e in counts.values() if e['count']), key=lambda e: e['count'], reverse=True)
+
+    def match_known_pests(self, counts, pests_database):
+        """
+        Pair species counts with the pests in get_common_philippine_pests
+        (matched on the binomial, then the genus); returns
+        [{'crop', 'pest', 'species', 'count', 'trend'}]
+        """
+        by_species = {entry['species'].lower(): entry for entry in counts}
+        by_genus = {}
+        for entry in counts:
+            by_genus.setdefault(entry['species'].split()[0].lower(), []).append(entry)
+
+        matches = []
+        for crop, data in pests_database.items():
+            for pest in data.get('pests', []):
+                found = SCIENTIFIC_NAME_PATTERN.search(pest['name'])
+                if not found:
+                    continue
+                name = found.group(1).lower()
+                entries = [by_species[name]] if name in by_species else by_genus.get(name.split()[0], [])
+                for entry in entries:
+                    matches.append({'crop': crop, 'pest': pest['name'], 'species': entry['species'],
+                                    'count': entry['count'], 'trend': entry['trend']})
+        return matches
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    import random
+
+    index = PestObservationIndex(db_path=':memory:')
+    random.seed(3)
+    species = [('Spodoptera frugiperda', 'Fall Armyworm'), ('Ostrinia furnacalis', 'Asian Corn Borer'),
+               ('Scotinophara coarctata', 'Malayan Black Rice Bug'), ('Danaus chrysippus', 'Plain Tiger')]
+    today = datetime.now()
+    results = []
+    for i in range(1, 50001):
+        name, common = random.choice(species)
+        results.append({
+            'id': i, 'observed_on': (today - timedelta(days=random.randint(0, 365))).strftime('%Y-%m-%d'),
+            'location': f"{random.uniform(5, 21):.5f},{random.uniform(117, 126.5):.5f}",
+            'taxon': {'id': i % 4, 'name': name, 'preferred_common_name': common}, 'place_guess': 'PH', 'photos': []
+        })
+    print(f"Stored {index.add_observations(results)} synthetic observations")
+
+    from philippine_apis import PhilippineAgriculturalAPIs
+    pests = PhilippineAgriculturalAPIs().get_common_philippine_pests()
+
+    start = time.perf_counter()
+    near = index.recent_near(15.58, 120.9, radius_km=50, days=30)
+    counts = index.species_counts(15.58, 120.9, radius_km=50, days=30)
+    matches = index.match_known_pests(counts, pests)
+    print(f"Nueva Ecija, 50 km, 30 days: {len(near)} recent, query took {(time.perf_counter() - start) * 1000:.2f} ms")
+    for entry in counts:
+        print(f"- {entry['common_name']} ({entry['species']}): {entry['count']} vs {entry['previous']} ({entry['trend']})")
+    for match in matches:
+        print(f"- {match['crop']}: {match['pest']} -> {match['count']} sightings, {match['trend']}")
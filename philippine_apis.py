@@ -1,33 +1,74 @@
-import requests
-import feedparser
-from bs4 import BeautifulSoup
+import http_client
 from datetime import datetime
 import json
+from feed_aggregator import FeedAggregator
+from data_store import SnapshotStore, snapshot
+from scraper import PageScraper, parse_da_advisories, parse_pagasa_bulletins, parse_headlines, parse_bantay_presyo
+from price_history import PriceHistoryStore
+
+
+# Representative point per region (NCR, CAR, I-XIII, BARMM)
+REGION_COORDS = {
+    'NCR': (14.5995, 120.9842),  # Metro Manila
+    'CAR': (16.4023, 120.5960),  # Baguio
+    'I': (16.0934, 120.3320),  # Ilocos
+    'II': (16.9754, 121.8107),  # Cagayan Valley
+    'III': (15.4800, 120.7100),  # Central Luzon
+    'IV-A': (14.1008, 121.0794),  # CALABARZON
+    'IV-B': (13.0563, 121.0543),  # MIMAROPA
+    'V': (13.4215, 123.4137),  # Bicol
+    'VI': (11.0050, 122.5378),  # Western Visayas
+    'VII': (10.3157, 123.8854),  # Central Visayas
+    'VIII': (11.2504, 125.0076),  # Eastern Visayas
+    'IX': (8.4869, 123.8083),  # Zamboanga
+    'X': (8.4542, 124.6319),  # Northern Mindanao
+    'XI': (7.0731, 125.6128),  # Davao
+    'XII': (6.9214, 124.8458),  # SOCCSKSARGEN
+    'XIII': (8.9476, 125.5406),  # Caraga
+    'BARMM': (7.2045, 124.2302)  # Bangsamoro
+}
+
+REGION_NAMES = {
+    'NCR': 'Metro Manila', 'CAR': 'Cordillera', 'I': 'Ilocos', 'II': 'Cagayan Valley', 'III': 'Central Luzon',
+    'IV-A': 'CALABARZON', 'IV-B': 'MIMAROPA', 'V': 'Bicol', 'VI': 'Western Visayas', 'VII': 'Central Visayas',
+    'VIII': 'Eastern Visayas', 'IX': 'Zamboanga Peninsula', 'X': 'Northern Mindanao', 'XI': 'Davao',
+    'XII': 'SOCCSKSARGEN', 'XIII': 'Caraga', 'BARMM': 'Bangsamoro'
+}
 
 
 class PhilippineAgriculturalAPIs:
 
-    def __init__(self):
-        pass
+    def __init__(self, feed_aggregator=None, scraper=None, store=None, price_history=None):
+        # Shared RSS engine (conditional GET + persistent dedup store)
+        self.feeds = feed_aggregator or FeedAggregator()
+        # Targeted lxml parsing, skipped when the page body is unchanged
+        self.scraper = scraper or PageScraper()
+        # Persistent snapshots shared across worker processes (read-through)
+        self.store = store or SnapshotStore()
+        # Columnar price history of Bantay Presyo observations
+        self.price_history = price_history or PriceHistoryStore()
+        self._price_history_day = None
 
     # ==================== WEATHER ====================
 
+    @snapshot('pagasa_forecast', ttl=1800, valid=bool)
     def get_pagasa_weather_forecast(self):
         """
         Get PAGASA weather forecast from RSS feed
+        Unchanged feeds are answered from the local store via a 304
         """
         feed_url = "http://bagong.pagasa.dost.gov.ph/rss-feed"
 
         try:
-            feed = feedparser.parse(feed_url)
+            self.feeds.refresh([feed_url])
 
             forecasts = []
-            for entry in feed.entries[:5]:
+            for entry in self.feeds.latest(feed_url, limit=5):
                 forecasts.append({
-                    'title': entry.title,
-                    'summary': entry.summary if hasattr(entry, 'summary') else entry.description,
-                    'published': entry.published,
-                    'link': entry.link
+                    'title': entry['title'],
+                    'summary': entry['summary'],
+                    'published': entry['published'],
+                    'link': entry['link']
                 })
 
             return forecasts
@@ -35,6 +76,7 @@ class PhilippineAgriculturalAPIs:
             print(f"PAGASA error: {e}")
             return None
 
+    @snapshot('pagasa_cyclone', ttl=900)
     def get_pagasa_tropical_cyclone_info(self):
         """
         Get tropical cyclone information from PAGASA
@@ -42,16 +84,13 @@ class PhilippineAgriculturalAPIs:
         url = "https://bagong.pagasa.dost.gov.ph/tropical-cyclone/severe-weather-bulletin"
 
         try:
-            response = requests.get(url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
             # Look for active cyclone bulletins
-            bulletins = soup.find_all('div', class_='bulletin-item')
+            bulletins = self.scraper.scrape(url, parse_pagasa_bulletins, limit=3)
 
             cyclone_info = []
-            for bulletin in bulletins[:3]:
+            for bulletin in bulletins:
                 cyclone_info.append({
-                    'content': bulletin.get_text(strip=True),
+                    'content': bulletin,
                     'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M')
                 })
 
@@ -62,25 +101,35 @@ class PhilippineAgriculturalAPIs:
 
     # ==================== CROP PRICES ====================
 
+    @snapshot('bantay_presyo', ttl=21600)
     def get_da_bantay_presyo(self):
         """
         DA Bantay Presyo - Price monitoring
-        Scrape from DA website or use cached data
+        Scrape the prevailing retail price table and return that day's prices
         """
-        # DA Bantay Presyo mobile app data endpoint (if available)
-        # Alternatively, scrape from website
-
         url = "http://www.da.gov.ph/bantay-presyo/"
 
         try:
-            response = requests.get(url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
+            page = self.scraper.scrape(url, parse_bantay_presyo)
+            if not page['rows']:
+                print("Bantay Presyo: no price table found")
+                return None
 
-            # This is a simplified example - actual implementation depends on site structure
+            day = page['date'] or datetime.now().strftime('%Y-%m-%d')
             price_data = {
-                'rice': 'Check DA website',
-                'corn': 'Check DA website',
-                'vegetables': 'Check DA website',
+                'date': day,
+                'prices': [
+                    {
+                        'commodity': row['commodity'],
+                        'market': row['market'],
+                        'region': row['region'],
+                        'price_min': row['price_min'],
+                        'price_max': row['price_max'],
+                        'price': f"{row['price_min']:.2f}-{row['price_max']:.2f} PHP/kg"
+                    }
+                    for row in page['rows']
+                ],
+                'source': 'DA Bantay Presyo',
                 'note': 'Visit http://www.da.gov.ph/bantay-presyo/ for latest prices'
             }
 
@@ -89,6 +138,26 @@ class PhilippineAgriculturalAPIs:
             print(f"Bantay Presyo error: {e}")
             return None
 
+    def update_price_history(self, price_data=None):
+        """
+        Record a Bantay Presyo payload (default: the current snapshot) in the
+        price history and pick up what other workers recorded; returns the
+        number of new observations. Works the same whether the payload was
+        just scraped or served from the shared snapshot store.
+        """
+        self.price_history.reload()
+        if price_data is None:
+            price_data = self.get_da_bantay_presyo()
+        if not price_data or price_data.get('date') == self._price_history_day:
+            return 0
+
+        rows = [row for row in price_data['prices'] if 'price_min' in row]
+        added = self.price_history.ingest_rows(rows, default_day=price_data['date'])
+        if added:
+            self.price_history.save()
+        self._price_history_day = price_data['date']
+        return added
+
     def get_market_prices_manual(self):
         """
         Manual database of typical Philippine crop prices
@@ -127,6 +196,7 @@ class PhilippineAgriculturalAPIs:
 
     # ==================== AGRICULTURAL ADVISORIES ====================
 
+    @snapshot('da_advisories', ttl=21600, valid=bool)
     def get_da_advisories(self):
         """
         Get latest advisories from Department of Agriculture
@@ -134,28 +204,13 @@ class PhilippineAgriculturalAPIs:
         url = "https://www.da.gov.ph/category/advisories/"
 
         try:
-            response = requests.get(url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            advisories = []
-            articles = soup.find_all('article', limit=5)
-
-            for article in articles:
-                title_tag = article.find('h2') or article.find('h3')
-                link_tag = article.find('a')
-
-                if title_tag and link_tag:
-                    advisories.append({
-                        'title': title_tag.get_text(strip=True),
-                        'link': link_tag.get('href'),
-                        'source': 'DA Philippines'
-                    })
-
+            advisories = self.scraper.scrape(url, parse_da_advisories, limit=5)
             return advisories
         except Exception as e:
             print(f"DA advisories error: {e}")
             return None
 
+    @snapshot('bpi_alerts', ttl=86400)
     def get_bpi_plant_quarantine_alerts(self):
         """
         Bureau of Plant Industry - pest and disease alerts
@@ -163,14 +218,12 @@ class PhilippineAgriculturalAPIs:
         url = "http://bpi.da.gov.ph/"
 
         try:
-            response = requests.get(url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
             # Look for news/advisory sections
             alerts = {
                 'message': 'Check BPI website for latest plant health advisories',
                 'website': 'http://bpi.da.gov.ph/',
-                'note': 'BPI provides pest and disease advisories for farmers'
+                'note': 'BPI provides pest and disease advisories for farmers',
+                'headlines': self.scraper.scrape(url, parse_headlines, limit=5)
             }
 
             return alerts
@@ -180,33 +233,14 @@ class PhilippineAgriculturalAPIs:
 
     # ==================== REGIONAL DATA ====================
 
+    @snapshot('regional_weather', ttl=1800)
     def get_regional_weather(self, region):
         """
         Get region-specific weather information
         Philippine regions: NCR, CAR, I-XIII, BARMM
         """
-        region_coords = {
-            'NCR': (14.5995, 120.9842),  # Metro Manila
-            'CAR': (16.4023, 120.5960),  # Baguio
-            'I': (16.0934, 120.3320),  # Ilocos
-            'II': (16.9754, 121.8107),  # Cagayan Valley
-            'III': (15.4800, 120.7100),  # Central Luzon
-            'IV-A': (14.1008, 121.0794),  # CALABARZON
-            'IV-B': (13.0563, 121.0543),  # MIMAROPA
-            'V': (13.4215, 123.4137),  # Bicol
-            'VI': (11.0050, 122.5378),  # Western Visayas
-            'VII': (10.3157, 123.8854),  # Central Visayas
-            'VIII': (11.2504, 125.0076),  # Eastern Visayas
-            'IX': (8.4869, 123.8083),  # Zamboanga
-            'X': (8.4542, 124.6319),  # Northern Mindanao
-            'XI': (7.0731, 125.6128),  # Davao
-            'XII': (6.9214, 124.8458),  # SOCCSKSARGEN
-            'XIII': (8.9476, 125.5406),  # Caraga
-            'BARMM': (7.2045, 124.2302)  # Bangsamoro
-        }
-
-        if region.upper() in region_coords:
-            lat, lon = region_coords[region.upper()]
+        if region.upper() in REGION_COORDS:
+            lat, lon = REGION_COORDS[region.upper()]
 
             # Use Open-Meteo for free weather data
             url = "https://api.open-meteo.com/v1/forecast"
@@ -219,7 +253,8 @@ class PhilippineAgriculturalAPIs:
             }
 
             try:
-                response = requests.get(url, params=params)
+                response = http_client.get(url, params=params)
+                response.raise_for_status()
                 data = response.json()
 
                 return {
@@ -0,0 +1,373 @@
+from array import array
+from datetime import date, datetime, timedelta
+import csv
+import json
+import re
+import struct
+import threading
+import os
+from data_store import file_lock
+
+
+PRICE_RANGE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:-|–|to)?\s*(\d+(?:\.\d+)?)?")
+
+
+def parse_price_range(text):
+    """'45-50 PHP/kg' -> (45.0, 50.0); '48.50' -> (48.5, 48.5); None if no number"""
+    match = PRICE_RANGE_PATTERN.search(str(text).replace(',', ''))
+    if not match:
+        return None
+    low = float(match.group(1))
+    high = float(match.group(2)) if match.group(2) else low
+    return (min(low, high), max(low, high))
+
+
+def normalize_commodity(name):
+    """'Rice, Regular Milled' -> 'rice regular milled'"""
+    return ' '.join(re.sub(r"[^a-z0-9ñ ]", ' ', name.lower()).split())
+
+
+class PriceHistoryStore:
+    """
+    Columnar market-price history (commodity x market x date).
+
+    Rows live in parallel typed arrays -- commodity id, market id, day
+    ordinal, min and max price -- with commodity and market names
+    dictionary-encoded, so a year of Bantay Presyo data for every NCR and
+    regional market is a few MB and scans stay tight. A per-commodity row
+    list makes range, trend and regional queries touch only that
+    commodity's rows. The store persists to a single binary file; each
+    save merges in rows other worker processes saved first, and reload()
+    picks up their saves before answering.
+    """
+
+    MAGIC = b'AGPH1'
+
+    def __init__(self, path=None):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.path = path or os.path.join(data_dir, 'price_history.bin')
+        self.lock = threading.RLock()
+
+        self.commodities = []  # id -> name
+        self.commodity_ids = {}
+        self.markets = []  # id -> (name, region)
+        self.market_ids = {}  # (name, region) -> id; market names repeat across regions
+
+        self.commodity_col = array('H')
+        self.market_col = array('H')
+        self.day_col = array('i')  # date.toordinal()
+        self.min_col = array('f')
+        self.max_col = array('f')
+
+        self.rows_by_commodity = {}  # commodity id -> array('I') of row numbers
+        self.row_index = {}  # (commodity id, market id, day) -> row number
+        self.mtime = None  # file mtime as of our last load or save
+
+        self.load()
+
+    def __len__(self):
+        return len(self.day_col)
+
+    # ==================== INGEST ====================
+
+    def _commodity_id(self, name):
+        name = normalize_commodity(name)
+        if name not in self.commodity_ids:
+            self.commodity_ids[name] = len(self.commodities)
+            self.commodities.append(name)
+        return self.commodity_ids[name]
+
+    def _market_id(self, market, region):
+        key = (market.strip(), (region or '').strip().upper())
+        if key not in self.market_ids:
+            self.market_ids[key] = len(self.markets)
+            self.markets.append(key)
+        return self.market_ids[key]
+
+    def add(self, day, commodity, market, region, price_min, price_max):
+        """Insert or overwrite one observation; day is a date or 'YYYY-MM-DD'"""
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+
+        with self.lock:
+            c = self._commodity_id(commodity)
+            m = self._market_id(market, region)
+            d = day.toordinal()
+            row = self.row_index.get((c, m, d))
+
+            if row is not None:
+                self.min_col[row] = price_min
+                self.max_col[row] = price_max
+                return False
+
+            row = len(self.day_col)
+            self.commodity_col.append(c)
+            self.market_col.append(m)
+            self.day_col.append(d)
+            self.min_col.append(price_min)
+            self.max_col.append(price_max)
+            self.rows_by_commodity.setdefault(c, array('I')).append(row)
+            self.row_index[(c, m, d)] = row
+            return True
+
+    def ingest_rows(self, rows, default_day=None):
+        """
+        Ingest dicts with commodity, market, region, price_min, price_max and
+        an optional date; returns the number of new observations.
+        """
+        added = 0
+        for row in rows:
+            day = row.get('date') or default_day
+            if not day:
+                continue
+            if self.add(day, row['commodity'], row.get('market') or 'Unknown', row.get('region'),
+                        float(row['price_min']), float(row['price_max'])):
+                added += 1
+        return added
+
+    def ingest_csv(self, path):
+        """Ingest a CSV export with date,commodity,market,region,price_min,price_max columns"""
+        with open(path, newline='', encoding='utf-8') as f:
+            return self.ingest_rows(csv.DictReader(f))
+
+    # ==================== QUERIES ====================
+
+    def find(self, term):
+        """Commodity names containing every word of term ('onion' -> ['vegetables onion', ...])"""
+        words = normalize_commodity(term).split()
+        return [name for name in self.commodities if all(word in name.split() for word in words)]
+
+    def _rows(self, commodity, start=None, end=None, region=None, market=None):
+        c = self.commodity_ids.get(normalize_commodity(commodity))
+        if c is None:
+            return []
+        lo = start.toordinal() if start else -1
+        hi = end.toordinal() if end else 1 << 30
+        region = region.upper() if region else None
+
+        rows = []
+        for row in self.rows_by_commodity.get(c, ()):
+            d = self.day_col[row]
+            if d < lo or d > hi:
+                continue
+            name, market_region = self.markets[self.market_col[row]]
+            if region and market_region != region:
+                continue
+            if market and name != market:
+                continue
+            rows.append(row)
+        return rows
+
+    def range(self, commodity, start=None, end=None, region=None, market=None):
+        """Observations as (date, market, region, min, max), oldest first"""
+        with self.lock:
+            rows = self._rows(commodity, start, end, region, market)
+            result = [(date.fromordinal(self.day_col[r]), *self.markets[self.market_col[r]],
+                       round(self.min_col[r], 2), round(self.max_col[r], 2)) for r in rows]
+        return sorted(result, key=lambda item: item[0])
+
+    def daily_midpoints(self, commodity, start=None, end=None, region=None):
+        """{date: mean of (min+max)/2 across markets}"""
+        with self.lock:
+            totals = {}
+            for r in self._rows(commodity, start, end, region):
+                mid = (self.min_col[r] + self.max_col[r]) / 2
+                total, count = totals.get(self.day_col[r], (0.0, 0))
+                totals[self.day_col[r]] = (total + mid, count + 1)
+        return {date.fromordinal(d): total / count for d, (total, count) in sorted(totals.items())}
+
+    def latest(self, commodity, region=None):
+        """Most recent day's (date, mean min, mean max) across matching markets, or None"""
+        with self.lock:
+            rows = self._rows(commodity, region=region)
+            if not rows:
+                return None
+            last = max(self.day_col[r] for r in rows)
+            rows = [r for r in rows if self.day_col[r] == last]
+            low = sum(self.min_col[r] for r in rows) / len(rows)
+            high = sum(self.max_col[r] for r in rows) / len(rows)
+        return (date.fromordinal(last), round(low, 2), round(high, 2))
+
+    def week_over_week(self, commodity, region=None):
+        """Percent change of the mean midpoint vs. the closest day 5-9 days earlier, or None"""
+        series = self.daily_midpoints(commodity, region=region)
+        if not series:
+            return None
+        last_day = max(series)
+        for offset in (7, 6, 8, 5, 9):
+            previous = series.get(last_day - timedelta(days=offset))
+            if previous:
+                return round((series[last_day] - previous) / previous * 100, 1)
+        return None
+
+    def trend(self, commodity, days=28, region=None):
+        """Least-squares slope of the daily midpoint in PHP/day over the last `days` days"""
+        series = self.daily_midpoints(commodity, region=region)
+        if len(series) < 2:
+            return None
+        last_day = max(series)
+        points = [((d - last_day).days, mid) for d, mid in series.items() if (last_day - d).days < days]
+        if len(points) < 2:
+            return None
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if not var_x:
+            return None
+        return round(sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x, 3)
+
+    def compare_regions(self, commodity, day=None):
+        """{region: (mean min, mean max)} on `day` (default: the latest day with data)"""
+        with self.lock:
+            rows = self._rows(commodity)
+            if not rows:
+                return {}
+            target = day.toordinal() if day else max(self.day_col[r] for r in rows)
+            sums = {}
+            for r in rows:
+                if self.day_col[r] != target:
+                    continue
+                region = self.markets[self.market_col[r]][1]
+                low, high, count = sums.get(region, (0.0, 0.0, 0))
+                sums[region] = (low + self.min_col[r], high + self.max_col[r], count + 1)
+        return {region: (round(low / n, 2), round(high / n, 2)) for region, (low, high, n) in sorted(sums.items())}
+
+    def summary(self, terms, region=None, limit=6):
+        """
+        Chat-ready current prices with week-over-week change for commodities
+        matching any of terms, preferring the farmer's region when it has data.
+        """
+        lines = []
+        for term in terms:
+            for name in self.find(term):
+                scope = region if region and self.latest(name, region) else None
+                current = self.latest(name, scope)
+                if not current:
+                    continue
+                lines.append({
+                    'commodity': name,
+                    'region': scope or 'all markets',
+                    'date': current[0].isoformat(),
+                    'min': current[1],
+                    'max': current[2],
+                    'week_change_pct': self.week_over_week(name, scope)
+                })
+                if len(lines) >= limit:
+                    return lines
+        return lines
+
+    # ==================== PERSISTENCE ====================
+
+    def save(self):
+        """Write the store as: magic, header length, JSON header, then the raw columns"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with file_lock(f"{self.path}.lock"):
+            # Keep rows other workers saved since we last read the file
+            self.reload()
+            with self.lock:
+                header = json.dumps({
+                    'rows': len(self.day_col),
+                    'commodities': self.commodities,
+                    'markets': self.markets
+                }).encode('utf-8')
+                columns = [self.commodity_col, self.market_col, self.day_col, self.min_col, self.max_col]
+
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(self.MAGIC)
+                    f.write(struct.pack('<I', len(header)))
+                    f.write(header)
+                    for column in columns:
+                        column.tofile(f)
+                os.replace(tmp_path, self.path)
+                self.mtime = os.stat(self.path).st_mtime_ns
+
+    def _read(self):
+        """(header, columns, mtime) as stored in the file"""
+        with open(self.path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f"unknown file format in {self.path}")
+            (header_len,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_len))
+            columns = [array(column.typecode) for column in
+                       (self.commodity_col, self.market_col, self.day_col, self.min_col, self.max_col)]
+            for column in columns:
+                column.fromfile(f, header['rows'])
+            return header, columns, os.fstat(f.fileno()).st_mtime_ns
+
+    def load(self):
+        """Merge the rows saved on disk into the store"""
+        try:
+            header, columns, mtime = self._read()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Price history load error: {e}")
+            return
+
+        with self.lock:
+            if len(self.day_col):
+                commodity_col, market_col, day_col, min_col, max_col = columns
+                for row in range(header['rows']):
+                    market, region = header['markets'][market_col[row]]
+                    self.add(date.fromordinal(day_col[row]), header['commodities'][commodity_col[row]],
+                             market, region, min_col[row], max_col[row])
+            else:
+                self.commodity_col, self.market_col, self.day_col, self.min_col, self.max_col = columns
+                self.commodities = header['commodities']
+                self.commodity_ids = {name: i for i, name in enumerate(self.commodities)}
+                self.markets = [tuple(market) for market in header['markets']]
+                self.market_ids = {market: i for i, market in enumerate(self.markets)}
+                for row in range(len(self.day_col)):
+                    c = self.commodity_col[row]
+                    self.rows_by_commodity.setdefault(c, array('I')).append(row)
+                    self.row_index[(c, self.market_col[row], self.day_col[row])] = row
+            self.mtime = mtime
+
+    def reload(self):
+        """Merge in what other processes saved since our last load or save; True if anything was read"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.load()
+        return True
+
+
+# ==================== TESTING ====================
+if __name__ == "__main__":
+    import tempfile
+    import time
+    from scraper import parse_bantay_presyo
+
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    store = PriceHistoryStore(path=os.path.join(tempfile.mkdtemp(), 'prices.bin'))
+
+    added = store.ingest_csv(os.path.join(fixtures_dir, 'bantay_presyo.csv'))
+    print(f"CSV fixture: {added} observations")
+
+    with open(os.path.join(fixtures_dir, 'bantay_presyo.html'), 'rb') as f:
+        page = parse_bantay_presyo(f.read())
+    added = store.ingest_rows(page['rows'], default_day=page['date'])
+    print(f"HTML fixture ({page['date']}): {added} observations")
+    store.save()
+
+    reloaded = PriceHistoryStore(path=store.path)
+    assert len(reloaded) == len(store)
+
+    for name in reloaded.find('rice'):
+        print(f"\n=== {name} ===")
+        print(f"latest: {reloaded.latest(name)}  w/w: {reloaded.week_over_week(name)}%  "
+              f"trend: {reloaded.trend(name)} PHP/day")
+        print(f"regions: {reloaded.compare_regions(name)}")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        reloaded.range('rice regular milled', start=date(2025, 5, 25), region='NCR')
+    print(f"\nrange query: {(time.perf_counter() - start):.3f} ms avg over 1000 runs")
+    print(json.dumps(reloaded.summary(['onion', 'rice'], region='III'), indent=2))
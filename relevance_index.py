@@ -0,0 +1,195 @@
+import heapq
+import math
+import re
+import threading
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9ñ]+")
+
+STOPWORDS = {
+    # English
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from', 'how', 'i', 'in',
+    'is', 'it', 'my', 'of', 'on', 'or', 'should', 'that', 'the', 'this', 'to', 'what', 'when',
+    'where', 'which', 'will', 'with', 'you', 'your',
+    # Tagalog
+    'ang', 'ng', 'mga', 'sa', 'na', 'at', 'ay', 'ko', 'ba', 'po', 'ano', 'kailan', 'paano',
+    'saan', 'ito', 'iyan', 'yung', 'may', 'para', 'kung', 'lang', 'din', 'rin', 'nga'
+}
+
+# Tagalog farm vocabulary folded onto the English term so either language matches
+SYNONYMS = {
+    'palay': 'rice', 'bigas': 'rice', 'mais': 'corn', 'gulay': 'vegetables', 'saging': 'banana',
+    'sibuyas': 'onion', 'kamatis': 'tomato', 'talong': 'eggplant', 'repolyo': 'cabbage',
+    'bagyo': 'typhoon', 'ulan': 'rain', 'tagtuyot': 'drought', 'baha': 'flood',
+    'peste': 'pest', 'kulisap': 'pest', 'sakit': 'disease', 'presyo': 'price',
+    'abono': 'fertilizer', 'pataba': 'fertilizer', 'binhi': 'seeds', 'magsasaka': 'farmers',
+    'ani': 'harvest', 'anihin': 'harvest', 'tanim': 'plant', 'magtanim': 'plant', 'itanim': 'plant',
+    'lupa': 'soil'
+}
+
+# Place names per region, used to boost items that mention the farmer's area
+REGION_TERMS = {
+    'NCR': ['metro manila', 'manila', 'quezon city', 'ncr'],
+    'CAR': ['cordillera', 'benguet', 'baguio', 'ifugao', 'kalinga', 'abra', 'apayao'],
+    'I': ['ilocos', 'pangasinan', 'la union'],
+    'II': ['cagayan valley', 'isabela', 'nueva vizcaya', 'quirino', 'batanes'],
+    'III': ['central luzon', 'nueva ecija', 'pampanga', 'tarlac', 'bulacan', 'zambales', 'bataan', 'aurora'],
+    'IV-A': ['calabarzon', 'cavite', 'laguna', 'batangas', 'rizal', 'quezon'],
+    'IV-B': ['mimaropa', 'mindoro', 'marinduque', 'romblon', 'palawan'],
+    'V': ['bicol', 'albay', 'camarines', 'sorsogon', 'catanduanes', 'masbate'],
+    'VI': ['western visayas', 'iloilo', 'capiz', 'aklan', 'antique', 'guimaras', 'negros occidental'],
+    'VII': ['central visayas', 'cebu', 'bohol', 'negros oriental', 'siquijor'],
+    'VIII': ['eastern visayas', 'leyte', 'samar', 'biliran'],
+    'IX': ['zamboanga'],
+    'X': ['northern mindanao', 'bukidnon', 'misamis', 'lanao del norte', 'camiguin'],
+    'XI': ['davao'],
+    'XII': ['soccsksargen', 'cotabato', 'sultan kudarat', 'sarangani', 'general santos'],
+    'XIII': ['caraga', 'agusan', 'surigao', 'dinagat'],
+    'BARMM': ['bangsamoro', 'barmm', 'maguindanao', 'lanao del sur', 'sulu', 'tawi-tawi', 'basilan']
+}
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords, Tagalog terms normalised"""
+    return [SYNONYMS.get(t, t) for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incremental in-memory BM25 index over short documents
+    (DA advisories, news articles, RSS items).
+
+    Documents are added once by id; search walks only the postings of the
+    query terms, so a lookup over a few thousand items stays well under a
+    millisecond.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.docs = {}  # doc_id -> (kind, item)
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_len = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, text, item, kind='news'):
+        """Index a document; returns False if the id is already indexed"""
+        if not doc_id or doc_id in self.docs:
+            return False
+
+        terms = tokenize(text)
+        with self.lock:
+            if doc_id in self.docs:
+                return False
+            self.docs[doc_id] = (kind, item)
+            self.doc_len[doc_id] = len(terms)
+            self.total_len += len(terms)
+            for term in terms:
+                postings = self.postings.setdefault(term, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+
+        return True
+
+    # Crawled/fetched documents worth carrying across restarts. Static
+    # knowledge chunks are rebuilt from code at boot, so an edited crop
+    # calendar or pest entry is never shadowed by a checkpointed copy.
+    CHECKPOINT_KINDS = ('advisory', 'news', 'rss')
+
+    def checkpoint_state(self):
+        with self.lock:
+            docs = {doc_id: doc for doc_id, doc in self.docs.items() if doc[0] in self.CHECKPOINT_KINDS}
+            postings = {}
+            for term, term_postings in self.postings.items():
+                kept = {doc_id: tf for doc_id, tf in term_postings.items() if doc_id in docs}
+                if kept:
+                    postings[term] = kept
+            return {'docs': docs, 'postings': postings, 'doc_len': {doc_id: self.doc_len[doc_id] for doc_id in docs}}
+
+    def restore_state(self, state):
+        """Merge a checkpointed index (ids already indexed keep their entry); returns the docs added"""
+        with self.lock:
+            new = {doc_id for doc_id, doc in state['docs'].items()
+                   if doc_id not in self.docs and doc[0] in self.CHECKPOINT_KINDS}
+            for doc_id in new:
+                self.docs[doc_id] = tuple(state['docs'][doc_id])
+                self.doc_len[doc_id] = state['doc_len'][doc_id]
+                self.total_len += state['doc_len'][doc_id]
+            for term, postings in state['postings'].items():
+                for doc_id, tf in postings.items():
+                    if doc_id in new:
+                        self.postings.setdefault(term, {})[doc_id] = tf
+        return len(new)
+
+    def search(self, query, k=3, kinds=None, region=None, region_boost=0.5):
+        """
+        Top-k (score, kind, item) for a free-text query.
+        kinds restricts the document types; region adds that region's
+        place names as extra, down-weighted query terms.
+        """
+        weights = {}
+        for term in tokenize(query):
+            weights[term] = weights.get(term, 0) + 1.0
+        if region and region.upper() in REGION_TERMS:
+            for place in REGION_TERMS[region.upper()]:
+                for term in tokenize(place):
+                    weights[term] = weights.get(term, 0) + region_boost
+
+        with self.lock:
+            n_docs = len(self.docs)
+            if not n_docs or not weights:
+                return []
+            avg_len = self.total_len / n_docs
+
+            scores = {}
+            for term, weight in weights.items():
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    if kinds and self.docs[doc_id][0] not in kinds:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0) + weight * idf * tf * (self.k1 + 1) / (tf + norm)
+
+            ranked = heapq.nlargest(k, scores.items(), key=lambda pair: pair[1])
+            return [(score, self.docs[doc_id][0], self.docs[doc_id][1]) for doc_id, score in ranked]
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(1)
+    topics = ['rice', 'palay', 'corn', 'mais', 'typhoon', 'bagyo', 'fertilizer', 'subsidy', 'price',
+              'drought', 'el', 'nino', 'armyworm', 'tungro', 'irrigation', 'seeds', 'farmers',
+              'nueva', 'ecija', 'iloilo', 'davao', 'banana', 'onion', 'import', 'tariff', 'loan']
+    # News text has a long-tailed vocabulary; topic words make up a small share of it
+    vocabulary = topics + [f"w{i}" for i in range(20000)]
+    frequencies = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    random.shuffle(frequencies)
+
+    index = BM25Index()
+    for i in range(5000):
+        words = ' '.join(random.choices(vocabulary, weights=frequencies, k=40))
+        index.add(f"doc-{i}", words, {'title': f"Item {i}", 'link': f"https://example.ph/{i}"},
+                  kind=random.choice(['advisory', 'news', 'rss']))
+
+    queries = ['may armyworm sa mais ko', 'fertilizer subsidy for rice farmers', 'bagyo sa iloilo']
+    rounds = 200
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            results = index.search(query, k=3, region='VI')
+    elapsed = (time.perf_counter() - start) * 1000 / (rounds * len(queries))
+
+    print(f"=== BM25 over {len(index)} docs ===")
+    print(f"{elapsed:.3f} ms per query")
+    for score, kind, item in index.search(queries[0], k=3):
+        print(f"  {score:6.2f} [{kind}] {item['title']}")
@@ -0,0 +1,300 @@
+import http_client
+from lxml import etree
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from datetime import datetime
+import hashlib
+import re
+import threading
+import os
+
+
+# ==================== PARSERS ====================
+# Module-level functions so they can be shipped to the parse worker processes.
+# Each one streams the page with iterparse and stops as soon as it has enough.
+
+def _text(element):
+    """Equivalent of BeautifulSoup's get_text(strip=True)"""
+    return ''.join(part.strip() for part in element.itertext())
+
+
+def parse_da_advisories(content, limit=5):
+    """Extract title/link pairs from the first <article> tags of a DA listing page"""
+    advisories = []
+    seen_articles = 0
+
+    for _, article in etree.iterparse(BytesIO(content), events=('end',), tag='article',
+                                      html=True, recover=True, no_network=True):
+        seen_articles += 1
+        title_tag = article.find('.//h2')
+        if title_tag is None:
+            title_tag = article.find('.//h3')
+        link_tag = article.find('.//a')
+
+        if title_tag is not None and link_tag is not None:
+            advisories.append({
+                'title': _text(title_tag),
+                'link': link_tag.get('href'),
+                'source': 'DA Philippines'
+            })
+
+        article.clear()
+        if seen_articles >= limit:
+            break
+
+    return advisories
+
+
+def parse_pagasa_bulletins(content, limit=3):
+    """Extract the text of <div class="bulletin-item"> blocks from a PAGASA page"""
+    bulletins = []
+
+    for _, div in etree.iterparse(BytesIO(content), events=('end',), tag='div',
+                                  html=True, recover=True, no_network=True):
+        if 'bulletin-item' not in (div.get('class') or '').split():
+            continue
+        bulletins.append(_text(div))
+        div.clear()
+        if len(bulletins) >= limit:
+            break
+
+    return bulletins
+
+
+def parse_headlines(content, limit=5):
+    """Extract linked headlines (h2/h3 > a) from a news or advisory page"""
+    headlines = []
+
+    for _, heading in etree.iterparse(BytesIO(content), events=('end',), tag=('h2', 'h3'),
+                                      html=True, recover=True, no_network=True):
+        link_tag = heading.find('.//a')
+        if link_tag is not None and link_tag.get('href'):
+            headlines.append({'title': _text(heading), 'link': link_tag.get('href')})
+        heading.clear()
+        if len(headlines) >= limit:
+            break
+
+    return headlines
+
+
+def _spaced_text(element):
+    """Element text with whitespace collapsed (keeps word boundaries across tags)"""
+    return ' '.join(' '.join(element.itertext()).split())
+
+
+def parse_advisory_listing(content):
+    """
+    Extract every advisory on a DA listing page plus the next-page link:
+    returns {'items': [{'title', 'link', 'published'}], 'next': url or None}
+    """
+    result = {'items': [], 'next': None}
+
+    for _, element in etree.iterparse(BytesIO(content), events=('end',), tag=('article', 'a', 'link'),
+                                      html=True, recover=True, no_network=True):
+        if element.tag == 'article':
+            title_tag = element.find('.//h2')
+            if title_tag is None:
+                title_tag = element.find('.//h3')
+            link_tag = element.find('.//a')
+            time_tag = element.find('.//time')
+
+            if title_tag is not None and link_tag is not None and link_tag.get('href'):
+                result['items'].append({
+                    'title': _text(title_tag),
+                    'link': link_tag.get('href'),
+                    'published': (time_tag.get('datetime') or '')[:10] if time_tag is not None else None
+                })
+            element.clear()
+
+        # WordPress marks the older-posts link as <a class="next"> and <link rel="next">
+        elif result['next'] is None:
+            classes = (element.get('class') or '').split()
+            if (element.tag == 'a' and 'next' in classes) or (element.tag == 'link' and element.get('rel') == 'next'):
+                result['next'] = element.get('href')
+
+    return result
+
+
+def parse_advisory_article(content, max_chars=4000):
+    """Extract the publish date and body text of a single DA advisory page"""
+    result = {'published': None, 'body': ''}
+
+    for _, element in etree.iterparse(BytesIO(content), events=('end',), tag=('time', 'div', 'article'),
+                                      html=True, recover=True, no_network=True):
+        if element.tag == 'time':
+            if result['published'] is None and element.get('datetime'):
+                result['published'] = element.get('datetime')[:10]
+        elif element.tag == 'article' or 'entry-content' in (element.get('class') or '').split():
+            result['body'] = _spaced_text(element)[:max_chars]
+            break
+
+    return result
+
+
+PRICE_DATE_PATTERN = re.compile(r"([A-Z][a-z]+ \d{1,2}, \d{4})")
+
+
+def parse_bantay_presyo(content):
+    """
+    Extract a Bantay Presyo price table: returns {'date': 'YYYY-MM-DD' or None,
+    'rows': [{'commodity', 'market', 'region', 'price_min', 'price_max'}]}.
+    Rows need Commodity | Market | Region | Low | High cells; prices may be
+    single values or 'low-high' ranges, and blank/'n/a' cells are skipped.
+    """
+    from price_history import parse_price_range
+
+    result = {'date': None, 'rows': []}
+
+    for _, element in etree.iterparse(BytesIO(content), events=('end',), tag=('h2', 'tr'),
+                                      html=True, recover=True, no_network=True):
+        if element.tag == 'h2':
+            match = PRICE_DATE_PATTERN.search(_text(element))
+            if match and result['date'] is None:
+                result['date'] = datetime.strptime(match.group(1), '%B %d, %Y').strftime('%Y-%m-%d')
+            element.clear()
+            continue
+
+        cells = [' '.join(cell.itertext()).strip() for cell in element.findall('td')]
+        element.clear()
+        if len(cells) < 5:
+            continue
+
+        low = parse_price_range(cells[3])
+        high = parse_price_range(cells[4])
+        if not low or not high:
+            continue
+        result['rows'].append({
+            'commodity': cells[0],
+            'market': cells[1],
+            'region': cells[2],
+            'price_min': low[0],
+            'price_max': high[1]
+        })
+
+    return result
+
+
+# ==================== SCRAPER ====================
+
+class PageScraper:
+    """
+    Fetch a page and run a targeted parser over it.
+
+    The parsed result is cached per (url, parser) together with the SHA-1 of
+    the body, so an unchanged page is never parsed twice. Parsing runs in a
+    small process pool (AGRIAID_PARSE_WORKERS, 0 = parse inline) so that
+    CPU-bound HTML work does not hold the GIL of the serving threads.
+    """
+
+    def __init__(self, parse_workers=None, timeout=10):
+        if parse_workers is None:
+            parse_workers = int(os.getenv('AGRIAID_PARSE_WORKERS', '2'))
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.cache = {}  # (url, parser name) -> (body hash, parsed result)
+        self._pool = None
+
+    def _get_pool(self):
+        with self.lock:
+            if self._pool is None and self.parse_workers > 0:
+                self._pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+            return self._pool
+
+    def parse(self, parser, content, **kwargs):
+        """Run a parser in the worker pool (or inline when the pool is disabled)"""
+        pool = self._get_pool()
+        if pool is None:
+            return parser(content, **kwargs)
+        return pool.submit(parser, content, **kwargs).result()
+
+    def scrape(self, url, parser, **kwargs):
+        """
+        Fetch url and return parser(body); raises on network errors and
+        non-2xx answers (an error page is not an empty result) so callers
+        keep their own error handling. Unchanged bodies reuse the last result.
+        """
+        response = http_client.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        content = response.content
+        body_hash = hashlib.sha1(content).hexdigest()
+        key = (url, parser.__name__)
+
+        with self.lock:
+            cached = self.cache.get(key)
+        if cached and cached[0] == body_hash:
+            return cached[1]
+
+        result = self.parse(parser, content, **kwargs)
+        with self.lock:
+            self.cache[key] = (body_hash, result)
+        return result
+
+    def checkpoint_state(self):
+        with self.lock:
+            return [[url, parser_name, body_hash, result] for (url, parser_name), (body_hash, result) in self.cache.items()]
+
+    def restore_state(self, state):
+        """Parsed results by body hash; a page is still fetched and only reused if unchanged"""
+        with self.lock:
+            for url, parser_name, body_hash, result in state:
+                self.cache.setdefault((url, parser_name), (body_hash, result))
+        return len(state)
+
+    def close(self):
+        """Shut down the parse workers"""
+        with self.lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    import time
+    from bs4 import BeautifulSoup
+
+    fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    rounds = 50
+
+    def bs4_advisories(content):
+        soup = BeautifulSoup(content, 'html.parser')
+        results = []
+        for article in soup.find_all('article', limit=5):
+            title_tag = article.find('h2') or article.find('h3')
+            link_tag = article.find('a')
+            if title_tag and link_tag:
+                results.append({'title': title_tag.get_text(strip=True), 'link': link_tag.get('href')})
+        return results
+
+    def bs4_bulletins(content):
+        soup = BeautifulSoup(content, 'html.parser')
+        return [b.get_text(strip=True) for b in soup.find_all('div', class_='bulletin-item')[:3]]
+
+    cases = [
+        ('da_advisories.html', bs4_advisories, parse_da_advisories),
+        ('pagasa_bulletin.html', bs4_bulletins, parse_pagasa_bulletins)
+    ]
+
+    print("=== PARSE-TIME BENCHMARK (ms per page) ===")
+    for fixture, baseline, targeted in cases:
+        with open(os.path.join(fixtures_dir, fixture), 'rb') as f:
+            content = f.read()
+
+        timings = {}
+        for label, parser in (('bs4 html.parser', baseline), ('lxml iterparse', targeted)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                result = parser(content)
+            timings[label] = (time.perf_counter() - start) * 1000 / rounds
+
+        print(f"\n{fixture} ({len(content) / 1024:.0f} KB, {len(result)} items)")
+        for label, ms in timings.items():
+            print(f"  {label:<16} {ms:8.2f}")
+        print(f"  speedup          {timings['bs4 html.parser'] / timings['lxml iterparse']:8.1f}x")
+
+        # An unchanged page costs only the body hash in PageScraper.scrape
+        start = time.perf_counter()
+        for _ in range(rounds):
+            hashlib.sha1(content).hexdigest()
+        print(f"  unchanged (hash) {(time.perf_counter() - start) * 1000 / rounds:8.2f}")
@@ -0,0 +1,316 @@
+import http_client
+from array import array
+from datetime import datetime
+import argparse
+import struct
+import mmap
+import json
+import time
+import os
+
+
+MAGIC = b'AGSG1'
+NODATA = -32768
+
+# Philippine bounding box (degrees)
+PH_BBOX = {'lat_min': 4.5, 'lat_max': 21.5, 'lon_min': 116.0, 'lon_max': 127.0}
+
+# SoilGrids property -> (factor from mapped integer to conventional unit, unit)
+PROPERTIES = {
+    'clay': (10, '%'),
+    'sand': (10, '%'),
+    'silt': (10, '%'),
+    'phh2o': (10, 'pH'),
+    'soc': (10, 'g/kg'),
+    'nitrogen': (100, 'g/kg')
+}
+DEPTHS = ['0-5cm', '5-15cm']
+BANDS = [f"{prop}_{depth}" for prop in PROPERTIES for depth in DEPTHS]
+
+SOILGRIDS_URL = "https://rest.isric.org/soilgrids/v2.0/properties/query"
+
+
+class SoilGrid:
+    """
+    Local SoilGrids raster for the Philippines, read through mmap.
+
+    The file is a small JSON header followed by little-endian int16 cells,
+    north-up and band-interleaved (all bands of a cell are adjacent), in
+    SoilGrids' own mapped units. A point lookup is one offset computation
+    and one read, and because the file is mapped read-only every worker
+    process on the host shares the same page cache.
+    """
+
+    def __init__(self, path=None):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.path = path or os.path.join(data_dir, 'soilgrids_ph.bin')
+        self.header = None
+        self.mm = None
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Soil grid open error: {e}")
+            return
+
+        if mm[:len(MAGIC)] != MAGIC:
+            print(f"Soil grid error: {self.path} is not a soil grid file")
+            mm.close()
+            return
+
+        header_len = struct.unpack_from('<I', mm, len(MAGIC))[0]
+        self.header = json.loads(mm[len(MAGIC) + 4:len(MAGIC) + 4 + header_len])
+        self.band_index = {band: i for i, band in enumerate(self.header['bands'])}
+        self.cell_format = f"<{len(self.header['bands'])}h"
+        self.cell_size = 2 * len(self.header['bands'])
+        self.mm = mm
+
+    @property
+    def available(self):
+        return self.mm is not None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    # ==================== LOOKUP ====================
+
+    def _cell(self, row, col):
+        h = self.header
+        if not (0 <= row < h['rows'] and 0 <= col < h['cols']):
+            return None
+        values = struct.unpack_from(self.cell_format, self.mm, h['data_offset'] + (row * h['cols'] + col) * self.cell_size)
+        return None if all(v == NODATA for v in values) else values
+
+    def cell_values(self, lat, lon, search_radius=1):
+        """
+        Raw band values of the cell containing (lat, lon), or of the nearest
+        cell with data within search_radius cells (coastal points often fall
+        on a sea cell). None outside the grid.
+        """
+        if self.mm is None:
+            return None
+        h = self.header
+        row = int((h['lat_max'] - lat) / h['resolution'])
+        col = int((lon - h['lon_min']) / h['resolution'])
+
+        for radius in range(search_radius + 1):
+            for dr in range(-radius, radius + 1):
+                for dc in range(-radius, radius + 1):
+                    if max(abs(dr), abs(dc)) != radius:
+                        continue
+                    values = self._cell(row + dr, col + dc)
+                    if values:
+                        return values
+        return None
+
+    def lookup(self, lat, lon, depth='0-5cm'):
+        """
+        Soil properties at a point for one depth, in SoilGrids mapped units
+        (same shape as the SoilGrids REST answer used by get_soilgrids_data)
+        """
+        values = self.cell_values(lat, lon)
+        if values is None:
+            return None
+        result = {}
+        for prop in PROPERTIES:
+            i = self.band_index.get(f"{prop}_{depth}")
+            if i is not None and values[i] != NODATA:
+                result[prop] = values[i]
+        return result or None
+
+    def profile(self, lat, lon):
+        """{property: {depth: value in conventional units}} at a point"""
+        values = self.cell_values(lat, lon)
+        if values is None:
+            return None
+        result = {}
+        for band, i in self.band_index.items():
+            prop, depth = band.split('_', 1)
+            if values[i] != NODATA and prop in PROPERTIES:
+                result.setdefault(prop, {})[depth] = values[i] / PROPERTIES[prop][0]
+        return result
+
+
+def to_conventional(soil_info):
+    """Mapped SoilGrids integers -> %, pH, g/kg"""
+    return {prop: value / PROPERTIES[prop][0] for prop, value in soil_info.items()
+            if prop in PROPERTIES and value is not None}
+
+
+# ==================== BUILDER ====================
+
+def create_grid(path, resolution=0.05, bbox=None, bands=None, source=''):
+    """Write an empty (all NODATA) grid file and return its header"""
+    bbox = bbox or PH_BBOX
+    bands = bands or BANDS
+    rows = int(round((bbox['lat_max'] - bbox['lat_min']) / resolution))
+    cols = int(round((bbox['lon_max'] - bbox['lon_min']) / resolution))
+    header = dict(bbox, resolution=resolution, rows=rows, cols=cols, bands=bands, nodata=NODATA,
+                  built=datetime.now().strftime('%Y-%m-%d'), source=source)
+
+    # Reserve room for the header, then align the cells to a page boundary
+    header['data_offset'] = 0
+    header_len = len(json.dumps(header)) + 16
+    header['data_offset'] = ((len(MAGIC) + 4 + header_len) // mmap.PAGESIZE + 1) * mmap.PAGESIZE
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_len)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        f.write(b'\0' * (header['data_offset'] - f.tell()))
+        f.write(struct.pack('<h', NODATA) * (rows * cols * len(bands)))
+    os.replace(tmp_path, path)
+    return header
+
+
+def _open_for_write(path):
+    f = open(path, 'r+b')
+    mm = mmap.mmap(f.fileno(), 0)
+    header_len = struct.unpack_from('<I', mm, len(MAGIC))[0]
+    header = json.loads(mm[len(MAGIC) + 4:len(MAGIC) + 4 + header_len])
+    return f, mm, header
+
+
+def build_from_xyz(path, band_files, resolution=0.05, bbox=None):
+    """
+    Build the grid from XYZ text rasters, one per band ('lon lat value'
+    lines, as written by `gdal_translate -of XYZ` from SoilGrids layers
+    clipped to the bounding box). Samples are averaged into each cell.
+    """
+    create_grid(path, resolution, bbox, source='SoilGrids XYZ export')
+    f, mm, header = _open_for_write(path)
+    rows, cols, n_bands = header['rows'], header['cols'], len(header['bands'])
+
+    try:
+        for band, band_path in band_files.items():
+            b = header['bands'].index(band)
+            sums = array('d', bytes(8 * rows * cols))
+            counts = array('I', bytes(4 * rows * cols))
+
+            with open(band_path, 'r', encoding='utf-8') as src:
+                for line in src:
+                    parts = line.replace(',', ' ').split()
+                    if len(parts) < 3:
+                        continue
+                    try:
+                        lon, lat, value = float(parts[0]), float(parts[1]), float(parts[2])
+                    except ValueError:
+                        continue  # header line
+                    row = int((header['lat_max'] - lat) / header['resolution'])
+                    col = int((lon - header['lon_min']) / header['resolution'])
+                    # SoilGrids marks no-data with 0 or -32768
+                    if 0 <= row < rows and 0 <= col < cols and value > 0:
+                        sums[row * cols + col] += value
+                        counts[row * cols + col] += 1
+
+            for cell in range(rows * cols):
+                if counts[cell]:
+                    struct.pack_into('<h', mm, header['data_offset'] + (cell * n_bands + b) * 2,
+                                     int(round(sums[cell] / counts[cell])))
+            print(f"  {band}: {sum(1 for c in counts if c)} cells")
+        mm.flush()
+    finally:
+        mm.close()
+        f.close()
+
+
+def build_from_rest(path, resolution=0.25, bbox=None, delay=12.0, timeout=30):
+    """
+    Fill the grid by querying the SoilGrids REST API at every cell centre.
+    ISRIC asks for at most 5 calls a minute, so this is only practical at a
+    coarse resolution. The number of cells finished so far is kept in
+    <path>.done, so a rerun resumes after the last finished cell. A failed
+    request stops the build at that cell; rerun to retry from it.
+    """
+    if not os.path.exists(path):
+        create_grid(path, resolution, bbox, source='SoilGrids REST')
+    f, mm, header = _open_for_write(path)
+    rows, cols, bands = header['rows'], header['cols'], header['bands']
+    done_path = f"{path}.done"
+    try:
+        with open(done_path, 'r', encoding='utf-8') as done_file:
+            done = int(done_file.read() or 0)
+    except FileNotFoundError:
+        done = 0
+
+    try:
+        for cell in range(done, rows * cols):
+            row, col = divmod(cell, cols)
+            lat = header['lat_max'] - (row + 0.5) * header['resolution']
+            lon = header['lon_min'] + (col + 0.5) * header['resolution']
+            params = {'lat': lat, 'lon': lon, 'property': list(PROPERTIES), 'depth': DEPTHS, 'value': 'mean'}
+
+            try:
+                response = http_client.get(SOILGRIDS_URL, params=params, timeout=timeout)
+                response.raise_for_status()
+                for layer in response.json()['properties']['layers']:
+                    for depth in layer['depths']:
+                        band = f"{layer['name']}_{depth['label']}"
+                        value = depth['values'].get('mean')
+                        if band in bands and value is not None:
+                            struct.pack_into('<h', mm, header['data_offset'] + (cell * len(bands) + bands.index(band)) * 2, value)
+            except Exception as e:
+                print(f"SoilGrids error at ({lat:.2f}, {lon:.2f}): {e}")
+                break
+
+            with open(done_path, 'w', encoding='utf-8') as done_file:
+                done_file.write(str(cell + 1))
+            if (cell + 1) % 50 == 0:
+                mm.flush()
+                print(f"  {cell + 1}/{rows * cols} cells")
+            time.sleep(delay)
+        mm.flush()
+    finally:
+        mm.close()
+        f.close()
+
+
+# ==================== CLI ====================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local Philippine SoilGrids raster")
+    parser.add_argument('--path', help="grid file (default: $AGRIAID_DATA_DIR/soilgrids_ph.bin)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    xyz = commands.add_parser('build-xyz', help="build from XYZ exports of the SoilGrids layers")
+    xyz.add_argument('bands', nargs='+', help="band=path pairs, e.g. clay_0-5cm=clay_0-5.xyz")
+    xyz.add_argument('--resolution', type=float, default=0.05)
+
+    rest = commands.add_parser('build-rest', help="sample the SoilGrids REST API (slow, resumable)")
+    rest.add_argument('--resolution', type=float, default=0.25)
+    rest.add_argument('--delay', type=float, default=12.0, help="seconds between calls")
+
+    query = commands.add_parser('lookup', help="look up a point")
+    query.add_argument('lat', type=float)
+    query.add_argument('lon', type=float)
+
+    args = parser.parse_args()
+    path = args.path or SoilGrid().path
+
+    if args.command == 'build-xyz':
+        band_files = dict(pair.split('=', 1) for pair in args.bands)
+        unknown = set(band_files) - set(BANDS)
+        if unknown:
+            parser.error(f"unknown bands {sorted(unknown)}; expected {BANDS}")
+        build_from_xyz(path, band_files, args.resolution)
+        print(f"Wrote {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+    elif args.command == 'build-rest':
+        build_from_rest(path, args.resolution, delay=args.delay)
+    else:
+        grid = SoilGrid(path)
+        if not grid.available:
+            parser.error(f"no soil grid at {path}")
+        start = time.perf_counter()
+        profile = grid.profile(args.lat, args.lon)
+        elapsed = (time.perf_counter() - start) * 1e6
+        print(json.dumps(profile, indent=2))
+        print(f"Lookup took {elapsed:.0f} µs")
@@ -0,0 +1,73 @@
+from datetime import date
+import os
+import pytest
+from price_history import PriceHistoryStore
+from scraper import parse_bantay_presyo
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+@pytest.fixture
+def page():
+    with open(os.path.join(FIXTURES_DIR, 'bantay_presyo.html'), 'rb') as f:
+        return parse_bantay_presyo(f.read())
+
+
+@pytest.fixture
+def store(tmp_path, page):
+    store = PriceHistoryStore(path=str(tmp_path / 'prices.bin'))
+    store.ingest_csv(os.path.join(FIXTURES_DIR, 'bantay_presyo.csv'))
+    store.ingest_rows(page['rows'], default_day=page['date'])
+    return store
+
+
+def test_parse_bantay_presyo(page):
+    assert page['date'] == '2025-06-02'
+    assert len(page['rows']) == 54  # 9 commodities x 6 markets
+    assert page['rows'][0] == {
+        'commodity': 'Rice, Regular Milled',
+        'market': 'Commonwealth Market',
+        'region': 'NCR',
+        'price_min': 44.30,
+        'price_max': 48.38
+    }
+
+
+def test_ingest_csv(tmp_path):
+    store = PriceHistoryStore(path=str(tmp_path / 'prices.bin'))
+    assert store.ingest_csv(os.path.join(FIXTURES_DIR, 'bantay_presyo.csv')) == 756
+    # Re-ingesting the same export overwrites rather than duplicates
+    assert store.ingest_csv(os.path.join(FIXTURES_DIR, 'bantay_presyo.csv')) == 0
+    assert len(store) == 756
+    assert store.latest('rice regular milled') == (date(2025, 6, 1), 44.2, 48.26)
+
+
+def test_html_after_csv(store):
+    assert len(store) == 756 + 54
+    assert store.latest('rice regular milled') == (date(2025, 6, 2), 43.01, 47.09)
+    assert store.latest('rice regular milled', region='III') == (date(2025, 6, 2), 42.14, 46.21)
+    assert store.range('rice regular milled', start=date(2025, 6, 2), market='Commonwealth Market') == [
+        (date(2025, 6, 2), 'Commonwealth Market', 'NCR', 44.3, 48.38)
+    ]
+
+
+def test_week_over_week(store):
+    # Mean midpoint 45.05 on 2025-06-02 vs 44.86 on 2025-05-26
+    assert store.week_over_week('rice regular milled') == 0.4
+    assert store.week_over_week('banana lakatan', region='NCR') is not None
+    assert store.week_over_week('durian') is None
+
+
+def test_same_market_name_in_two_regions(tmp_path):
+    store = PriceHistoryStore(path=str(tmp_path / 'prices.bin'))
+    store.add('2025-06-02', 'Tomato', 'Public Market', 'III', 60.0, 80.0)
+    store.add('2025-06-02', 'Tomato', 'Public Market', 'VII', 70.0, 90.0)
+    assert len(store) == 2
+    assert store.compare_regions('tomato') == {'III': (60.0, 80.0), 'VII': (70.0, 90.0)}
+
+    store.save()
+    reloaded = PriceHistoryStore(path=store.path)
+    assert reloaded.compare_regions('tomato') == {'III': (60.0, 80.0), 'VII': (70.0, 90.0)}
+    reloaded.add('2025-06-02', 'Tomato', 'Public Market', 'VII', 72.0, 92.0)
+    assert len(reloaded) == 2
@@ -0,0 +1,426 @@
+import numpy as np
+import threading
+import json
+import time
+import re
+import os
+
+
+MODELFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ModelFile')
+
+# One pass over the text, one alternative per feature class
+TOKEN_PATTERN = re.compile(r"([A-Za-z]+)|([0-9])|(\n)|([!-/:-@\[-`{-~])|([^\x00-\x7f])")
+
+# Feature order: words, letters beyond the 6th of a word, digits, newlines,
+# ASCII punctuation, non-ASCII characters (accents, emoji)
+FEATURES = ('words', 'long_letters', 'digits', 'newlines', 'punctuation', 'non_ascii')
+
+# Starting point for gemma's SentencePiece vocabulary: common words are one
+# piece, long (often Tagalog) words split every ~3-4 letters, digits are
+# always split one per token, emoji fall back to several byte pieces
+DEFAULT_WEIGHTS = (1.0, 0.3, 1.0, 1.0, 0.9, 1.4)
+DEFAULT_OVERHEAD = 12  # chat template tokens around every prompt
+
+
+def read_modelfile(path=MODELFILE_PATH):
+    """(num_ctx, system prompt) from an Ollama ModelFile; (None, '') when missing"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None, ''
+
+    num_ctx = re.search(r"^PARAMETER\s+num_ctx\s+(\d+)", text, re.MULTILINE)
+    system = re.search(r'^SYSTEM\s+"""(.*?)"""', text, re.MULTILINE | re.DOTALL)
+    return int(num_ctx.group(1)) if num_ctx else None, system.group(1).strip() if system else ''
+
+
+class TokenCounter:
+    """
+    Calibrated token-count estimator for the gemma3 prompts.
+
+    No tokenizer ships with the app, so counts come from a linear model over
+    a few character-class features (words, long-word letters, digits,
+    newlines, punctuation, non-ASCII), found in a single regex pass. The
+    weights start from values typical for gemma's vocabulary and are refit
+    by least squares from the prompt_eval_count Ollama reports for real
+    prompts, so the estimate converges on the deployed model's tokenizer.
+    Samples and weights persist in the data directory.
+    """
+
+    def __init__(self, path=None, max_samples=500, refit_every=20):
+        data_dir = os.getenv('AGRIAID_DATA_DIR', 'data')
+        self.path = path or os.path.join(data_dir, 'token_calibration.json')
+        self.max_samples = max_samples
+        self.refit_every = refit_every
+        self.lock = threading.Lock()
+        self.weights = np.array(DEFAULT_WEIGHTS)
+        self.overhead = DEFAULT_OVERHEAD
+        self.samples = []  # [feature list, observed prompt tokens]
+        self._since_fit = 0
+        self.load()
+
+    @staticmethod
+    def features(text):
+        words = long_letters = digits = newlines = punctuation = non_ascii = 0
+        for word, digit, newline, punct, other in TOKEN_PATTERN.findall(text):
+            if word:
+                words += 1
+                if len(word) > 6:
+                    long_letters += len(word) - 6
+            elif digit:
+                digits += 1
+            elif newline:
+                newlines += 1
+            elif punct:
+                punctuation += 1
+            else:
+                non_ascii += 1
+        return [words, long_letters, digits, newlines, punctuation, non_ascii]
+
+    def count(self, text):
+        """Estimated tokens in text (no template overhead)"""
+        if not text:
+            return 0
+        return int(np.dot(self.weights, self.features(text)) + 0.5)
+
+    def prompt_tokens(self, text):
+        """Estimated prompt_eval_count for a full prompt sent to the model"""
+        return self.count(text) + int(self.overhead)
+
+    # ==================== CALIBRATION ====================
+
+    def observe(self, text, prompt_eval_count, cached_prefix=''):
+        """
+        Record the token count Ollama reported for a prompt (system prompt
+        included in text). Ollama only evaluates what is not already in its
+        KV cache, so cached_prefix -- the start text shares with the previous
+        prompt sent to the model -- is left out of the sample. Partial cache
+        hits this misses (another request used the slot in between) are left
+        to the robust fit; only gross ones, under a third of the estimate,
+        and samples too short to say anything are dropped here.
+        """
+        features = [a - b for a, b in zip(self.features(text), self.features(cached_prefix))]
+        estimate = float(np.dot(self.weights, features)) + self.overhead
+        if not prompt_eval_count or estimate < 32 or prompt_eval_count < estimate / 3:
+            return False
+        with self.lock:
+            self.samples.append([features, int(prompt_eval_count)])
+            self.samples = self.samples[-self.max_samples:]
+            self._since_fit += 1
+            refit = self._since_fit >= self.refit_every
+        if refit:
+            self.fit()
+            self.save()
+        return True
+
+    def fit(self, iterations=20):
+        """
+        Refit the weights (and template overhead) from the samples by Huber
+        regression on relative error: counts cut short by an undetected
+        KV-cache hit are outliers and get down-weighted instead of dragging
+        the weights low, whatever the current weights are.
+        """
+        with self.lock:
+            samples = list(self.samples)
+            self._since_fit = 0
+        if len(samples) < len(FEATURES) + 2:
+            return False
+
+        x = np.array([features + [1] for features, _ in samples], dtype=np.float64)
+        y = np.array([tokens for _, tokens in samples], dtype=np.float64)
+        # Features that never occur keep their prior weight
+        used = np.r_[x[:, :-1].any(axis=0), True]
+        # Each row scaled by its count, so long and short prompts weigh alike
+        a = x[:, used] / y[:, None]
+        b = np.ones(len(y))
+        w = np.ones(len(y))
+        for _ in range(iterations):
+            root = np.sqrt(w)
+            solution, *_ = np.linalg.lstsq(a * root[:, None], b * root, rcond=None)
+            residual = np.abs(b - a @ solution)
+            # Huber threshold at 1.345 robust standard deviations (MAD)
+            k = 1.345 * max(1.4826 * float(np.median(np.abs(residual - np.median(residual)))), 1e-3)
+            w = np.where(residual <= k, 1.0, k / np.maximum(residual, 1e-12))
+
+        weights = self.weights.copy()
+        weights[used[:-1]] = np.clip(solution[:-1], 0.05, 8.0)
+        with self.lock:
+            self.weights = weights
+            self.overhead = max(0.0, float(solution[-1]))
+        return True
+
+    def error(self):
+        """Mean absolute relative error of the current weights on the samples"""
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return None
+        errors = [abs(np.dot(self.weights, f) + self.overhead - tokens) / tokens for f, tokens in samples]
+        return float(np.mean(errors))
+
+    def save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                state = {'weights': self.weights.tolist(), 'overhead': self.overhead, 'samples': self.samples}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Token calibration save error: {e}")
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Token calibration load error: {e}")
+            return
+        if len(state.get('weights', [])) == len(FEATURES):
+            self.weights = np.array(state['weights'])
+            self.overhead = state['overhead']
+            self.samples = state.get('samples', [])[-self.max_samples:]
+
+
+# Process-wide counter shared by the history, knowledge retrieval and packer
+counter = TokenCounter()
+
+
+def count_tokens(text):
+    return counter.count(text)
+
+
+# Data sections in the order they are kept when the window is tight
+# (matched against the section header; unknown sections go in the middle)
+SECTION_PRIORITY = [
+    'TYPHOON', 'REGIONAL WEATHER BRIEFING', 'FARM WEATHER INDICATORS', 'PAGASA WEATHER FORECAST',
+    'DETAILED CONDITIONS', 'RELEVANT FARMING INFORMATION', 'PEST SIGHTINGS', 'FIELDS WITH DECLINING VIGOR',
+    'PRICE WATCH', 'CURRENT MARKET PRICES', 'SOIL PROPERTIES', 'SOIL CONDITIONS', 'COMMON PHILIPPINE PESTS',
+    'RECENT INSECT SIGHTINGS', 'DA ADVISORIES', 'LATEST AGRICULTURAL NEWS'
+]
+
+DATA_HEADER = "[REAL-TIME AGRICULTURAL DATA]"
+DATA_FOOTER = "[END OF REAL-TIME DATA]"
+
+
+class ContextPacker:
+    """
+    Splits the model's context window (num_ctx from the ModelFile) between
+    the parts of a prompt, in priority order:
+
+    1. the ModelFile system prompt and chat template (fixed),
+    2. the reply (reserve_tokens are kept free for generation),
+    3. the farmer's question,
+    4. this turn's real-time data, whole sections in SECTION_PRIORITY order,
+    5. conversation history, with whatever is left (at least history_floor
+       tokens are held back from the data for the previous exchange).
+
+    Anything that would overflow is dropped here instead of being silently
+    truncated by Ollama, which cuts from the start of the prompt.
+    """
+
+    def __init__(self, num_ctx=None, system_prompt=None, reserve_tokens=512, history_floor=200,
+                 counter_=None, modelfile=MODELFILE_PATH):
+        file_ctx, file_system = read_modelfile(modelfile)
+        self.num_ctx = num_ctx or int(os.getenv('OLLAMA_NUM_CTX', '0')) or file_ctx or 2048
+        self.system_prompt = file_system if system_prompt is None else system_prompt
+        self.reserve_tokens = reserve_tokens
+        self.history_floor = history_floor
+        self.counter = counter_ or counter
+        self.stats = {'turns': 0, 'sections_dropped': 0, 'data_truncated': 0}
+
+    @property
+    def system_tokens(self):
+        return self.counter.prompt_tokens(self.system_prompt)
+
+    @property
+    def available(self):
+        """Tokens left for question, data and history"""
+        return self.num_ctx - self.reserve_tokens - self.system_tokens
+
+    @staticmethod
+    def sections(context_text):
+        """Split a format_context_for_llm block into its sections (header line first)"""
+        body = context_text.replace(DATA_HEADER, '').replace(DATA_FOOTER, '')
+        return [section.strip('\n') for section in re.split(r"\n\n(?=\S)", body) if section.strip()]
+
+    @staticmethod
+    def _priority(section):
+        header = section.split('\n', 1)[0].upper()
+        for rank, name in enumerate(SECTION_PRIORITY):
+            if name in header:
+                return rank
+        return len(SECTION_PRIORITY) // 2
+
+    def pack_data(self, context_text, budget):
+        """The data block with the lowest-priority sections dropped to fit budget tokens"""
+        sections = self.sections(context_text)
+        if not sections:
+            return '', 0
+
+        frame = f"\n\n{DATA_HEADER}\n\n{DATA_FOOTER}\n"
+        used = self.counter.count(frame)
+        costs = [self.counter.count(section) + 1 for section in sections]
+        keep = [False] * len(sections)
+        for i in sorted(range(len(sections)), key=lambda i: (self._priority(sections[i]), i)):
+            if used + costs[i] <= budget:
+                keep[i] = True
+                used += costs[i]
+            else:
+                self.stats['sections_dropped'] += 1
+
+        if not any(keep):
+            # Not even the most important section fits whole: keep its first lines
+            best = min(range(len(sections)), key=lambda i: (self._priority(sections[i]), i))
+            lines = []
+            for line in sections[best].split('\n'):
+                cost = self.counter.count(line) + 1
+                if used + cost > budget:
+                    break
+                lines.append(line)
+                used += cost
+            if len(lines) < 2:
+                return '', 0
+            sections, keep = ['\n'.join(lines)], [True]
+            self.stats['data_truncated'] += 1
+
+        kept = [section for section, k in zip(sections, keep) if k]
+        return f"\n\n{DATA_HEADER}\n\n" + '\n\n'.join(kept) + f"\n\n{DATA_FOOTER}\n", used
+
+    def plan(self, context_text, question):
+        """
+        Fit one turn into the window; returns {'data': packed data block,
+        'history': token budget for earlier turns, 'question', 'data_tokens'}
+        """
+        self.stats['turns'] += 1
+        available = self.available
+        question_tokens = self.counter.count(f"user: {question}\n")
+        available -= question_tokens
+
+        data, data_tokens = self.pack_data(context_text, max(0, available - self.history_floor))
+        return {
+            'data': data,
+            'history': max(0, available - data_tokens),
+            'question': question_tokens,
+            'data_tokens': data_tokens
+        }
+
+
+# ==================== BENCHMARK ====================
+if __name__ == "__main__":
+    import random
+    import sys
+
+    # Accuracy is only measured against prompt_eval_count values a real
+    # Ollama reported: fixtures/prompt_eval_counts.json, written by
+    #   python token_budget.py --record [path]   (needs Ollama at OLLAMA_HOST)
+    # or the calibration file the bot writes, passed as the first argument.
+    # There is no tokenizer here to compare against, so without recorded
+    # counts no accuracy figure is given.
+    FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'prompt_eval_counts.json')
+
+    random.seed(11)
+    words = ("palay rice corn mais pataba fertilizer pagtatanim harvest ulan bagyo typhoon signal "
+             "magsasaka presyo kilo peso weather forecast advisory province Nueva Ecija Isabela "
+             "kulisap naninilaw dahon spray irrigation").split()
+
+    def sample_text(n_words):
+        parts = []
+        for _ in range(n_words):
+            roll = random.random()
+            if roll < 0.1:
+                parts.append(str(random.randint(1, 5000)))
+            elif roll < 0.15:
+                parts.append(random.choice(['-', ':', '(', ')', '%', '°C', '₱', '🌾']))
+            elif roll < 0.2:
+                parts.append('\n')
+            else:
+                parts.append(random.choice(words))
+        return ' '.join(parts)
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--record':
+        import requests
+
+        path = sys.argv[2] if len(sys.argv) > 2 else FIXTURE_PATH
+        host = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
+        model = os.getenv('OLLAMA_MODEL', 'agriaid')
+        _, system_prompt = read_modelfile()
+        texts = [f"{system_prompt}\n{sample_text(random.randint(50, 1200))}" for _ in range(150)]
+        recorded = []
+        for i, text in enumerate(texts):
+            # Raw mode with a unique first line: no template, no reusable cached prefix
+            text = f"[{i}:{random.random()}]\n{text}"
+            result = requests.post(f"{host}/api/generate", json={
+                "model": model, "prompt": text, "raw": True, "stream": False, "options": {"num_predict": 1}
+            }, timeout=300).json()
+            recorded.append({'text': text, 'prompt_eval_count': result['prompt_eval_count']})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'model': model, 'recorded_at': time.strftime('%Y-%m-%d'), 'samples': recorded}, f)
+        print(f"Recorded {len(recorded)} prompt_eval_count samples from {model} to {path}")
+        sys.exit(0)
+
+    samples_path = sys.argv[1] if len(sys.argv) > 1 else FIXTURE_PATH
+    try:
+        with open(samples_path, 'r', encoding='utf-8') as f:
+            samples = json.load(f).get('samples', [])
+    except FileNotFoundError:
+        samples = []
+    # Fixture entries keep the text; the bot's calibration file keeps features
+    samples = [[TokenCounter.features(s['text']), s['prompt_eval_count']] if isinstance(s, dict) else s
+               for s in samples]
+    if len(samples) >= 4 * (len(FEATURES) + 2):
+        # Fit on the older samples, score on the newer ones
+        split = len(samples) * 2 // 3
+        default_counter = TokenCounter(path='/nonexistent/token_calibration.json')
+        default_counter.samples = samples[split:]
+        fitted = TokenCounter(path='/nonexistent/token_calibration.json')
+        fitted.samples = samples[:split]
+        fitted.fit()
+        fitted.samples = samples[split:]
+        print(f"Estimate error on {len(samples) - split} recorded prompts: {default_counter.error():.1%} with "
+              f"default weights, {fitted.error():.1%} after calibrating on {split} earlier ones")
+    else:
+        print(f"Only {len(samples)} recorded prompt_eval_count samples in {samples_path}; no accuracy figure "
+              f"without real counts (record them with: python token_budget.py --record)")
+
+    # Calibration direction check, independent of any tokenizer: a model whose
+    # tokenizer needs 25% fewer tokens than the defaults assume, with a fifth
+    # of the prompts cut to half by unnoticed KV-cache hits
+    reference = TokenCounter(path='/nonexistent/token_calibration.json')
+    drift = TokenCounter(path='/nonexistent/token_calibration.json', refit_every=10**9)
+    for i in range(200):
+        text = sample_text(random.randint(200, 1500))
+        drift.observe(text, int(0.75 * reference.prompt_tokens(text) * (0.5 if i % 5 == 0 else 1)))
+    drift.fit()
+    ratio = np.mean([drift.prompt_tokens(t) / (0.75 * reference.prompt_tokens(t))
+                     for t in (sample_text(random.randint(200, 1500)) for _ in range(50))])
+    print(f"Drift check: accepted {len(drift.samples)} of 200 samples, calibrated estimate at "
+          f"{ratio:.2f}x the true count (1.00 = calibrated downward despite cache hits)")
+
+    test_counter = TokenCounter(path='/nonexistent/token_calibration.json')
+    text = sample_text(1500)
+    start = time.perf_counter()
+    for _ in range(200):
+        test_counter.count(text)
+    print(f"count(): {(time.perf_counter() - start) / 200 * 1000:.2f} ms for {len(text)} chars")
+
+    sections = '\n\n'.join(f"{icon} {name}:\n" + '\n'.join(f"- {sample_text(40)}" for _ in range(4))
+                           for icon, name in (('⚠️', 'TYPHOON ALERT'), ('📡', 'LATEST AGRICULTURAL NEWS'),
+                                              ('🌾', 'FARM WEATHER INDICATORS (next 7 days)'),
+                                              ('📰', 'DA ADVISORIES'), ('💰', 'CURRENT MARKET PRICES')))
+    context_text = f"\n\n{DATA_HEADER}\n\n{sections}\n\n{DATA_FOOTER}\n"
+    # A tight window, so the packer has to drop sections
+    packer = ContextPacker(counter_=test_counter, num_ctx=1700)
+    start = time.perf_counter()
+    for _ in range(200):
+        plan = packer.plan(context_text, "May bagyo ba? Pwede na ba mag-spray ng pataba sa palay ko?")
+    print(f"plan(): {(time.perf_counter() - start) / 200 * 1000:.2f} ms per turn")
+    print(f"num_ctx {packer.num_ctx}: system {packer.system_tokens}, question {plan['question']}, "
+          f"data {plan['data_tokens']} of {test_counter.count(context_text)}, history {plan['history']}")
+    print("Kept:", [s.split('\n', 1)[0] for s in packer.sections(plan['data'])])